@@ -0,0 +1,470 @@
+"""Reproducible benchmarks for the file manager hot paths.
+
+Synthetic folder trees are generated in a temporary directory and the
+same operations the GUI performs are timed on them. Results are written
+as JSON so runs from different commits can be compared::
+
+    python benchmark.py --scale 0.1 --output before.json
+    python benchmark.py --scale 0.1 --output after.json --compare before.json
+
+By default only the headless model layer is timed. With --gui the real
+FileManager window is driven as well, which needs a display (for example
+``xvfb-run python benchmark.py --gui``).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from queue import Queue, Empty
+from types import SimpleNamespace
+
+from file_manager_core import (
+    CategoryClassifier, DirectorySnapshot, scan_directory, EntryFilter, FolderSizeIndex,
+    FolderSizeEngine, iter_folder_sizes, create_volume_backend, VolumeProber,
+    VOLUME_PROBE_TIMEOUT, DEFAULT_SIZE_WORKERS, remove_tree)
+
+
+# Bump when the layout of the JSON results changes
+RESULTS_VERSION = 1
+
+# Full size of each synthetic tree, scaled down with --scale
+WIDE_FILES = 100000
+DEEP_LEVELS = 10000
+MIXED_FILES = 1000000
+
+# Files per folder and subfolders per folder in the mixed tree
+MIXED_FILES_PER_DIR = 100
+MIXED_FANOUT = 20
+
+# Extension mix of the mixed tree, as (suffix, weight)
+EXTENSION_MIX = [
+    (".txt", 8), (".log", 6), (".md", 3), (".pdf", 3), (".docx", 2), (".xlsx", 1),
+    (".py", 8), (".js", 8), (".json", 6), (".html", 3), (".css", 2), (".c", 4),
+    (".h", 4), (".o", 3), (".so", 1), (".jpg", 6), (".png", 6), (".gif", 1),
+    (".svg", 1), (".mp3", 2), (".wav", 1), (".mp4", 1), (".mkv", 1),
+    (".zip", 1), (".tar.gz", 1), (".7z", 1), ("", 4),
+]
+
+# Filter panel combinations timed by the filter benchmark
+FILTER_COMBINATIONS = [
+    ("All", "Any", "Any time"),
+    ("Documents", "Any", "Any time"),
+    ("Images", "<10MB", "Any time"),
+    ("All", ">1GB", "This year"),
+]
+
+SORT_COLUMNS = ["name", "size", "type", "modified"]
+
+
+def create_file(path, size):
+    """Create a sparse file of the given apparent size"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if size:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def random_size(rng):
+    """Roughly log-normal file sizes, mostly small with a long tail"""
+    return min(int(rng.lognormvariate(8, 2.5)), 8 * 1024 ** 3)
+
+
+def random_name(rng, index):
+    suffixes, weights = zip(*EXTENSION_MIX)
+    return f"file_{index:07d}{rng.choices(suffixes, weights)[0]}"
+
+
+def generate_wide(path, count, rng):
+    """One folder holding count files"""
+    os.makedirs(path)
+    for i in range(count):
+        create_file(os.path.join(path, random_name(rng, i)), random_size(rng))
+    return {"files": count, "dirs": 1, "listing": path}
+
+
+def max_depth(path, name_length):
+    """Deepest chain of folders whose paths still fit in PATH_MAX"""
+    try:
+        path_max = os.pathconf(path, 'PC_PATH_MAX')
+    except (AttributeError, OSError, ValueError):
+        path_max = 260
+    return max(1, (path_max - len(path) - 64) // (name_length + 1))
+
+
+def generate_deep(path, levels, rng):
+    """A chain of nested folders with one file at every level.
+
+    The chain is cut short where paths would exceed PATH_MAX, since the
+    scanner works on path strings.
+    """
+    os.makedirs(path)
+    depth = min(levels, max_depth(path, 1))
+    current = path
+    for i in range(depth):
+        create_file(os.path.join(current, "f.txt"), random_size(rng))
+        current = os.path.join(current, "d")
+        os.mkdir(current)
+    return {"files": depth, "dirs": depth + 1, "listing": path,
+            "requested_levels": levels, "levels": depth}
+
+
+def generate_mixed(path, count, rng):
+    """count files spread over a balanced folder tree with a realistic extension mix"""
+    os.makedirs(path)
+    dirs_needed = max(1, -(-count // MIXED_FILES_PER_DIR))
+
+    # Breadth-first folder creation, MIXED_FANOUT children per folder
+    folders = [path]
+    queue_index = 0
+    while len(folders) < dirs_needed:
+        parent = folders[queue_index]
+        queue_index += 1
+        for i in range(MIXED_FANOUT):
+            if len(folders) >= dirs_needed:
+                break
+            child = os.path.join(parent, f"dir_{i:02d}")
+            os.mkdir(child)
+            folders.append(child)
+
+    for i in range(count):
+        folder = folders[i % len(folders)]
+        create_file(os.path.join(folder, random_name(rng, i)), random_size(rng))
+    return {"files": count, "dirs": len(folders), "listing": path}
+
+
+GENERATORS = {
+    "wide": (generate_wide, WIDE_FILES),
+    "deep": (generate_deep, DEEP_LEVELS),
+    "mixed": (generate_mixed, MIXED_FILES),
+}
+
+
+def prepare_tree(workdir, name, scale, seed):
+    """Generate a tree, or reuse one left in workdir by an earlier run with the same settings"""
+    generate, full_count = GENERATORS[name]
+    count = max(1, int(full_count * scale))
+    path = os.path.join(workdir, name)
+    marker = os.path.join(workdir, f"{name}.json")
+    settings = {"count": count, "seed": seed}
+    try:
+        with open(marker) as f:
+            info = json.load(f)
+        if info.get("settings") == settings and os.path.isdir(path):
+            info["generate_seconds"] = 0.0
+            return info
+    except (OSError, ValueError):
+        pass
+
+    if os.path.isdir(path):
+        remove_tree(path)
+    start = time.perf_counter()
+    info = generate(path, count, random.Random(seed))
+    info["settings"] = settings
+    with open(marker, "w") as f:
+        json.dump(info, f)
+    info["generate_seconds"] = time.perf_counter() - start
+    return info
+
+
+def time_runs(func, repeat):
+    """Run func repeat times and return the wall clock seconds of each run"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def summarize(runs):
+    return {"runs": runs, "min": min(runs), "median": statistics.median(runs)}
+
+
+class HeadlessView(SimpleNamespace):
+    """Stand-in for the widgets FileManager's status bar code touches"""
+
+    def __init__(self):
+        label = SimpleNamespace(config=lambda **kw: None)
+        super().__init__(row_sizes={}, total_size=0, selected_items=set(), selected_size=0,
+                         populate_items=[], selection=(), status_left=label,
+                         status_right=label, format_size=lambda size: "")
+        self.tree = SimpleNamespace(selection=lambda: self.selection,
+                                    delete=lambda *items: None,
+                                    get_children=lambda: ())
+
+
+def benchmark_model(tree, repeat):
+    """Time the model layer operations behind each GUI action on one tree"""
+    classifier = CategoryClassifier()
+    listing = tree["listing"]
+    results = {}
+
+    # display_files: one scandir pass, snapshot with sort keys, filtered name order
+    def list_folder():
+        snapshot = DirectorySnapshot(listing, scan_directory(listing, classifier.classify))
+        entry_filter = EntryFilter()
+        return [i for i in snapshot.order("name") if entry_filter(snapshot.entries[i])]
+    results["listing"] = summarize(time_runs(list_folder, repeat))
+    snapshot = DirectorySnapshot(listing, scan_directory(listing, classifier.classify))
+
+    # Folder sizes: a fresh walk, a walk answered by the size index, and the
+    # parallel per-subfolder sizing the view does
+    index = FolderSizeIndex(':memory:')
+    results["folder_size_cold"] = summarize(time_runs(
+        lambda: FolderSizeEngine(FolderSizeIndex(':memory:')).folder_size(listing), repeat))
+    FolderSizeEngine(index).folder_size(listing)
+    results["folder_size_indexed"] = summarize(time_runs(
+        lambda: FolderSizeEngine(index).folder_size(listing), repeat))
+    subfolders = [snapshot.entries[i].path for i in snapshot.dirs]
+    if subfolders:
+        def size_subfolders():
+            engine = FolderSizeEngine(FolderSizeIndex(':memory:'))
+            for folder, size in iter_folder_sizes(subfolders, engine, DEFAULT_SIZE_WORKERS):
+                pass
+        results["folder_size_parallel"] = summarize(time_runs(size_subfolders, repeat))
+    for i in snapshot.dirs:
+        snapshot.set_folder_size(i, 0)
+
+    # Sort changes: first use of every column, then its reverse
+    def sort_all():
+        snapshot.orders = {}
+        for column in SORT_COLUMNS:
+            snapshot.order(column)
+            snapshot.order(column, reverse=True)
+    results["sort"] = summarize(time_runs(sort_all, repeat))
+
+    # Filter changes over the cached name order
+    def filter_all():
+        order = snapshot.order("name")
+        entries = snapshot.entries
+        for combination in FILTER_COMBINATIONS:
+            entry_filter = EntryFilter(*combination)
+            [i for i in order if entry_filter(entries[i])]
+    results["filter"] = summarize(time_runs(filter_all, repeat))
+
+    status_bar = benchmark_status_bar(snapshot, repeat)
+    if status_bar is not None:
+        results["status_bar"] = status_bar
+    return results
+
+
+def benchmark_status_bar(snapshot, repeat):
+    """Time the status bar bookkeeping of FileManager without a window"""
+    try:
+        from file_manager import FileManager
+    except ImportError as e:
+        print(f"Skipping status bar benchmark: {str(e)}", file=sys.stderr)
+        return None
+
+    item_ids = [str(i) for i in snapshot.order("name")]
+    entries = snapshot.entries
+
+    def update_rows():
+        view = HeadlessView()
+        for item_id in item_ids:
+            entry = entries[int(item_id)]
+            FileManager.add_row_size(view, item_id, None if entry.is_dir else entry.size)
+        for i in snapshot.dirs:
+            FileManager.set_row_size(view, str(i), 4096)
+        # Select everything, then half, then nothing
+        for selection in (item_ids, item_ids[::2], ()):
+            view.selection = selection
+            FileManager.update_status_bar(view)
+    return summarize(time_runs(update_rows, repeat))
+
+
+def benchmark_volumes(repeat):
+    """Time listing volumes and probing all of them, as My Computer does"""
+    backend = create_volume_backend()
+    results = {"list_volumes": summarize(time_runs(backend.list_volumes, repeat))}
+
+    def probe_all():
+        prober = VolumeProber(backend, Queue(), ttl=0)
+        paths = {volume.path for volume in backend.list_volumes()}
+        for path in paths:
+            prober.probe(path, 0)
+        try:
+            for _ in paths:
+                prober.result_queue.get(timeout=VOLUME_PROBE_TIMEOUT)
+        except Empty:
+            pass  # Stuck volumes count as the timeout, like in the view
+    results["probe_volumes"] = summarize(time_runs(probe_all, repeat))
+    return results
+
+
+def benchmark_gui(trees, repeat):
+    """Drive a real FileManager window through the same actions"""
+    import tkinter as tk
+    import file_manager
+
+    # The filename indexer walks every volume in the background; keep it
+    # out of the measurements
+    file_manager.FileManager.run_indexer = lambda self: None
+    root = tk.Tk()
+    app = file_manager.FileManager(root)
+
+    def pump(done):
+        while not done():
+            root.update()
+
+    def populated():
+        return not app.populate_items
+
+    results = {}
+    try:
+        for name, tree in trees.items():
+            tree_results = results[name] = {}
+            listing = tree["listing"]
+
+            def first_paint():
+                app.update_path(listing)
+
+            def display():
+                app.update_path(listing)
+                pump(populated)
+            tree_results["first_paint"] = summarize(time_runs(first_paint, repeat))
+            pump(populated)
+            tree_results["display_files"] = summarize(time_runs(display, repeat))
+
+            def sort_all():
+                for column in SORT_COLUMNS:
+                    for _ in range(2):
+                        app.sort_items(column)
+                        pump(populated)
+            tree_results["sort"] = summarize(time_runs(sort_all, repeat))
+
+            def filter_all():
+                for type_filter, size_filter, date_filter in FILTER_COMBINATIONS:
+                    app.type_var.set(type_filter)
+                    app.size_var.set(size_filter)
+                    app.date_var.set(date_filter)
+                    app.apply_filters()
+                    pump(populated)
+                app.reset_filters()
+                pump(populated)
+            tree_results["filter"] = summarize(time_runs(filter_all, repeat))
+
+            def status_bar():
+                app.select_all()
+                app.update_status_bar()
+                app.tree.selection_set(())
+                app.update_status_bar()
+            tree_results["status_bar"] = summarize(time_runs(status_bar, repeat))
+
+        def my_computer():
+            app.show_my_computer()
+            pump(lambda: not app.volume_deadlines)
+        results["my_computer"] = summarize(time_runs(my_computer, repeat))
+    finally:
+        app.size_scheduler.shutdown()
+        root.destroy()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    """Print median times of results next to a baseline run"""
+    def flatten(section, prefix=""):
+        for key, value in section.items():
+            if isinstance(value, dict) and "median" in value:
+                yield prefix + key, value["median"]
+            elif isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+
+    old = dict(flatten(baseline.get("results", {})))
+    print(f"{'benchmark':<40} {'baseline':>10} {'current':>10} {'ratio':>7}", file=sys.stderr)
+    for name, median in flatten(results["results"]):
+        if name in old and old[name] > 0:
+            print(f"{name:<40} {old[name]:>10.4f} {median:>10.4f} {median / old[name]:>7.2f}",
+                  file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the file manager on synthetic trees.")
+    parser.add_argument("--trees", default="wide,deep,mixed",
+                        help="comma separated trees to run (default: wide,deep,mixed)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="fraction of the full tree sizes to generate (default: 1.0)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for tree generation")
+    parser.add_argument("--workdir", help="folder for the generated trees, reused between runs")
+    parser.add_argument("--gui", action="store_true", help="also drive the Tk window")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.trees.split(",") if name.strip()]
+    for name in names:
+        if name not in GENERATORS:
+            parser.error(f"unknown tree {name!r}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fm_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    # Keep the persistent size and filename indexes out of the user's cache
+    os.environ["XDG_CACHE_HOME"] = os.environ["LOCALAPPDATA"] = os.path.join(workdir, "cache")
+
+    results = {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "trees": {},
+        "results": {},
+    }
+    try:
+        trees = {}
+        for name in names:
+            print(f"Preparing {name} tree...", file=sys.stderr)
+            trees[name] = prepare_tree(workdir, name, args.scale, args.seed)
+            results["trees"][name] = {key: value for key, value in trees[name].items()
+                                      if key not in ("listing", "settings")}
+        for name, tree in trees.items():
+            print(f"Benchmarking {name} tree...", file=sys.stderr)
+            results["results"][name] = benchmark_model(tree, args.repeat)
+        results["results"]["volumes"] = benchmark_volumes(args.repeat)
+        if args.gui:
+            print("Benchmarking the GUI...", file=sys.stderr)
+            results["results"]["gui"] = benchmark_gui(trees, args.repeat)
+    finally:
+        if not args.workdir:
+            try:
+                remove_tree(workdir)
+            except OSError as e:
+                print(f"Error removing {workdir}: {str(e)}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,69 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import os
-import math
 import threading
-from queue import Queue
+from queue import Queue, Empty
 import time
-import string
-from ctypes import windll
-import ctypes
-import shutil
+import bisect
+import sqlite3
 from datetime import datetime
-import mimetypes
-from tkinter import filedialog
+
+from file_manager_core import (
+    CategoryClassifier, FileEntry, make_entry, DirectorySnapshot,
+    create_directory_watcher, INDEX_REFRESH_SECONDS, FilenameIndex,
+    iter_content_matches, create_volume_backend,
+    VOLUME_PROBE_TIMEOUT, VolumeProber, DEFAULT_SIZE_WORKERS, FolderSizeScheduler,
+    FolderSizeIndex, FolderSizeEngine, format_size, SIZE_RANGES, TYPE_FILTERS,
+    DATE_FILTERS, EntryFilter, get_cache_dir, profiler, CopyJob, DeleteJob,
+    FileOperationQueue, find_duplicates, DiskUsageScan, is_archive, split_archive_path,
+    ArchiveCache, ExtractJob, Preview, PreviewCache, PreviewLoader, SnapshotCache,
+    SnapshotPrefetcher, list_folder)
+
+
+# Rows inserted synchronously for the first paint of a folder
+FIRST_PAINT_ROWS = 200
+
+# Time budget for each batch of Treeview inserts, in seconds
+ROW_BATCH_SECONDS = 0.015
+
+# Delay between applying batches of filesystem changes, in milliseconds
+WATCH_APPLY_MS = 250
+
+# Minimum delay between tooltip updates while hovering rows, in milliseconds
+TOOLTIP_THROTTLE_MS = 50
+
+# Delay between checks for file operation progress, in milliseconds
+OPERATION_POLL_MS = 100
+
+# Errors listed when a file operation finishes with errors
+OPERATION_ERRORS_SHOWN = 10
+
+# Delay between checks for volume probes that are still running past
+# VOLUME_PROBE_TIMEOUT, in milliseconds
+VOLUME_LATE_POLL_MS = 1000
+
+# Delay between refreshes of the performance overlay, in milliseconds
+PERF_OVERLAY_MS = 500
+
+# Delay between updates of a running disk usage report, in milliseconds
+USAGE_REFRESH_MS = 500
+
+# Delay before previewing a newly selected row, and between checks for
+# the rendered preview, in milliseconds
+PREVIEW_DELAY_MS = 50
+PREVIEW_POLL_MS = 30
+
+# Folders remembered for Back and Forward
+HISTORY_LENGTH = 100
+
+# Timers shown in the performance overlay, as (timer, label)
+PERF_OVERLAY_TIMERS = [("scan", "scan"), ("snapshot", "snapshot"), ("sort", "sort"),
+                       ("filter", "filter"), ("populate", "insert"),
+                       ("update_sizes", "sizes"), ("status_bar", "status")]
+
 
 class FileManager:
-    def __init__(self, root):
+    def __init__(self, root, size_workers=DEFAULT_SIZE_WORKERS, category_overrides=None):
         self.root = root
         self.root.title("File Manager")
         self.root.geometry("1000x700")
@@ -23,27 +72,87 @@ class FileManager:
         # Remove default title bar
         self.root.overrideredirect(True)
         
+        # Platform specific volume enumeration for My Computer
+        self.volume_backend = create_volume_backend()
+        self.volume_rows = {}
+        self.volume_queue = Queue()
+        self.volume_prober = VolumeProber(self.volume_backend, self.volume_queue)
+        self.volume_generation = 0
+        self.volume_deadlines = {}
+        
+        # Extension to category table, built once
+        self.classifier = CategoryClassifier(category_overrides)
+        
         # Queue for communication between threads
         self.size_queue = Queue()
         
+        # Folder size engine backed by the persistent size index, kept off
+        # mounted filesystems by default so a network share is never walked
+        # by accident; the "One filesystem" box turns this off
+        self.size_engine = FolderSizeEngine(FolderSizeIndex(), one_device=True)
+        self.mount_points = set()  # listed folders found on another filesystem
+        
+        # Bounded pool for folder size calculation
+        self.size_workers = size_workers
+        self.size_scheduler = FolderSizeScheduler(self.size_queue, self.get_folder_size,
+                                                  max_workers=size_workers)
+        self.visible_rows_job = None
+        
+        # Time-sliced row insertion state
+        self.populate_job = None
+        self.populate_items = []
+        self.populate_next = 0
+        
+        # Copy, move and delete jobs run one after another in the background
+        self.operation_queue = Queue()
+        self.file_operations = FileOperationQueue(self.operation_queue)
+        self.operation_jobs = {}      # job id -> job, until it finishes
+        self.operation_progress = {}  # job id -> latest JobProgress
+        self.operation_removed = {}   # job id -> completed deletions already applied
+        self.clipboard = None         # ("copy" or "move", [paths])
+        
+        # Zip and tar archives are browsed as read-only folders
+        self.archive_cache = ArchiveCache()
+        self.archive_location = None  # (archive, inner folder) while browsing one
+        self.archive_generation = 0
+        self.archive_queue = Queue()
+        
+        # Navigation history; None stands for My Computer
+        self.history = []
+        self.history_index = -1
+        
+        # Recently listed folders, and optional prefetching of the folder under the pointer
+        self.snapshot_cache = SnapshotCache()
+        self.prefetcher = SnapshotPrefetcher(self.snapshot_cache, self.get_file_type_category)
+        
+        # Preview pane, hidden until toggled with Alt+P
+        self.preview_visible = False
+        self.preview_cache = PreviewCache()
+        self.preview_queue = Queue()
+        self.preview_loader = PreviewLoader(self.preview_queue)
+        self.preview_job = None
+        self.preview_poll_job = None
+        self.preview_pending = None  # key of the preview being rendered
+        
         # Sorting variables
         self.sort_by = "name"
         self.sort_reverse = False
         
         # Filter variables
-        self.file_type_filter = "All"
-        self.size_min = 0
-        self.size_max = float('inf')
-        self.date_min = None
-        self.date_max = None
-        self.date_range = None
+        self.entry_filter = EntryFilter()
         
         # Path tracking
         self.current_path = None
+        self.snapshot = None
         self.path_var = tk.StringVar(value="My Computer")
         
+        # Exact byte sizes of the rows in the tree (None while unknown),
+        # kept in sync so the status bar never has to read the widget
+        self.row_sizes = {}
+        self.total_size = 0
+        
         # Selected items tracking
-        self.selected_items = []
+        self.selected_items = set()
         self.selected_size = 0
         
         # Create tooltip
@@ -72,14 +181,58 @@ class FileManager:
         # Create Treeview
         self.create_treeview()
         
+        # Create preview pane, packed only while shown
+        self.create_preview_pane()
+        
         # Create status bar
         self.create_status_bar()
         
         # Bind keyboard shortcuts
         self.bind_shortcuts()
         
+        # Filename index for search, kept fresh in the background
+        self.filename_index = FilenameIndex()
+        self.search_query = None
+        self.search_generation = 0
+        # Results taken off the queue but not inserted yet, and the next one
+        self.search_batch = []
+        self.search_batch_next = 0
+        self.search_queue = Queue()
+        indexer = threading.Thread(target=self.run_indexer)
+        indexer.daemon = True
+        indexer.start()
+        
+        # Reports such as duplicate files replace the view until left
+        self.report = None          # restarts the report shown, None when browsing
+        self.report_path = None     # folder or drive the report covers
+        self.report_generation = 0
+        self.report_queue = Queue()
+        self.report_paths = {}      # report row id -> file path
+        self.report_label = None
+        
+        # Watch the current directory for changes
+        self.watch_queue = Queue()
+        self.watcher = create_directory_watcher(self.on_directory_changed)
+        
+        # Performance overlay and tracing, off until toggled
+        self.perf_overlay = False
+        self.perf_overlay_job = None
+        profiler.gauge("size.workers_busy", lambda: self.size_scheduler.busy)
+        profiler.gauge("queue.size_jobs", lambda: len(self.size_scheduler.jobs))
+        profiler.gauge("queue.size_results", self.size_queue.qsize)
+        profiler.gauge("queue.watch", self.watch_queue.qsize)
+        profiler.gauge("rows.pending", lambda: max(0, len(self.populate_items) - self.populate_next))
+        trace_path = os.environ.get("FILE_MANAGER_TRACE")
+        if trace_path:
+            self.start_trace(trace_path)
+        
         # Initialize with My Computer view
         self.show_my_computer()
+        
+        # Start draining folder size results and filesystem changes
+        self.root.after(100, self.update_sizes)
+        self.root.after(WATCH_APPLY_MS, self.process_watch_events)
+        self.root.after(OPERATION_POLL_MS, self.update_operations)
 
     def create_title_bar(self):
         title_bar = tk.Frame(self.root, bg="#1f1f1f", relief="raised", bd=0)
@@ -117,6 +270,18 @@ class FileManager:
         my_computer_button.pack(side="left", padx=(0, 5))
         self.show_tooltip(my_computer_button, "Go to My Computer (Ctrl+M)")
         
+        # Back and Forward buttons
+        back_button = tk.Button(nav_frame, text="←",
+                                command=self.go_back,
+                                bg="#3c3f41", fg="white", bd=0)
+        back_button.pack(side="left", padx=(0, 5))
+        self.show_tooltip(back_button, "Back (Alt+Left)")
+        forward_button = tk.Button(nav_frame, text="→",
+                                   command=self.go_forward,
+                                   bg="#3c3f41", fg="white", bd=0)
+        forward_button.pack(side="left", padx=(0, 5))
+        self.show_tooltip(forward_button, "Forward (Alt+Right)")
+        
         # Up button
         up_button = tk.Button(nav_frame, text="↑ Up",
                             command=self.go_up,
@@ -130,6 +295,70 @@ class FileManager:
                                 bg="#3c3f41", fg="white", bd=0)
         refresh_button.pack(side="left", padx=5)
         self.show_tooltip(refresh_button, "Refresh (F5)")
+        
+        # File operation buttons
+        for text, command, tip in (("Copy", self.copy_selection, "Copy (Ctrl+C)"),
+                                   ("Cut", self.cut_selection, "Cut (Ctrl+X)"),
+                                   ("Paste", self.paste_clipboard,
+                                    "Paste (Ctrl+V), paste and verify (Ctrl+Shift+V)"),
+                                   ("Delete", self.delete_selection, "Delete (Del)")):
+            button = tk.Button(nav_frame, text=text, command=command,
+                               bg="#3c3f41", fg="white", bd=0)
+            button.pack(side="left", padx=(0, 5))
+            self.show_tooltip(button, tip)
+        
+        # Preview button
+        preview_button = tk.Button(nav_frame, text="Preview",
+                                   command=self.toggle_preview,
+                                   bg="#3c3f41", fg="white", bd=0)
+        preview_button.pack(side="left", padx=(0, 5))
+        self.show_tooltip(preview_button, "Show or hide the preview pane (Alt+P)")
+        
+        # Report buttons
+        for text, command, tip in (
+                ("Disk Usage", self.show_disk_usage,
+                 "Largest files and folders in this folder or the selected drive (Ctrl+U)"),
+                ("Duplicates", self.find_duplicates,
+                 "Find duplicate files in this folder or the selected drive (Ctrl+D)")):
+            button = tk.Button(nav_frame, text=text, command=command,
+                               bg="#3c3f41", fg="white", bd=0)
+            button.pack(side="left", padx=(0, 5))
+            self.show_tooltip(button, tip)
+        
+        # Search box
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(nav_frame, textvariable=self.search_var,
+                                     bg="#3c3f41", fg="white", insertbackground="white",
+                                     bd=0, width=30)
+        self.search_entry.pack(side="right")
+        self.search_entry.bind("<Return>", lambda e: self.start_search())
+        self.search_entry.bind("<Escape>", lambda e: self.clear_search())
+        self.content_search_var = tk.BooleanVar(value=False)
+        content_check = tk.Checkbutton(nav_frame, text="In contents",
+                                       variable=self.content_search_var,
+                                       bg="#2b2b2b", fg="white", selectcolor="#3c3f41",
+                                       activebackground="#2b2b2b", activeforeground="white")
+        content_check.pack(side="right", padx=5)
+        tk.Label(nav_frame, text="Search:", bg="#2b2b2b", fg="white").pack(side="right", padx=5)
+        
+        # Opt-in listing of the folder under the pointer, so opening it is instant
+        self.prefetch_var = tk.BooleanVar(value=False)
+        prefetch_check = tk.Checkbutton(nav_frame, text="Prefetch",
+                                        variable=self.prefetch_var,
+                                        bg="#2b2b2b", fg="white", selectcolor="#3c3f41",
+                                        activebackground="#2b2b2b", activeforeground="white")
+        prefetch_check.pack(side="right", padx=5)
+        self.show_tooltip(prefetch_check, "List the folder under the pointer or selected in the background")
+        
+        # Folder sizes, disk usage and duplicates stay on one filesystem unless unticked
+        self.one_device_var = tk.BooleanVar(value=True)
+        one_device_check = tk.Checkbutton(nav_frame, text="One filesystem",
+                                          variable=self.one_device_var,
+                                          command=self.toggle_one_device,
+                                          bg="#2b2b2b", fg="white", selectcolor="#3c3f41",
+                                          activebackground="#2b2b2b", activeforeground="white")
+        one_device_check.pack(side="right", padx=5)
+        self.show_tooltip(one_device_check, "Do not size or scan folders on other filesystems, such as mounts")
 
     def create_filter_panel(self):
         filter_frame = tk.Frame(self.content_frame, bg="#1f1f1f", width=200)
@@ -145,8 +374,7 @@ class FileManager:
         type_frame.pack(fill="x", padx=5, pady=5)
         
         self.type_var = tk.StringVar(value="All")
-        types = ["All", "Documents", "Images", "Audio", "Video", "Archives", "Others"]
-        for t in types:
+        for t in TYPE_FILTERS:
             tk.Radiobutton(type_frame, text=t, value=t, variable=self.type_var,
                           bg="#1f1f1f", fg="white", selectcolor="#3c3f41",
                           command=self.apply_filters).pack(anchor="w")
@@ -155,9 +383,8 @@ class FileManager:
         size_frame = tk.LabelFrame(filter_frame, text="Size Range", bg="#1f1f1f", fg="white")
         size_frame.pack(fill="x", padx=5, pady=5)
         
-        sizes = ["Any", "<10MB", "10MB-100MB", "100MB-1GB", ">1GB"]
         self.size_var = tk.StringVar(value="Any")
-        for s in sizes:
+        for s in SIZE_RANGES:
             tk.Radiobutton(size_frame, text=s, value=s, variable=self.size_var,
                           bg="#1f1f1f", fg="white", selectcolor="#3c3f41",
                           command=self.apply_filters).pack(anchor="w")
@@ -166,9 +393,8 @@ class FileManager:
         date_frame = tk.LabelFrame(filter_frame, text="Date Modified", bg="#1f1f1f", fg="white")
         date_frame.pack(fill="x", padx=5, pady=5)
         
-        dates = ["Any time", "Today", "This week", "This month", "This year"]
         self.date_var = tk.StringVar(value="Any time")
-        for d in dates:
+        for d in DATE_FILTERS:
             tk.Radiobutton(date_frame, text=d, value=d, variable=self.date_var,
                           bg="#1f1f1f", fg="white", selectcolor="#3c3f41",
                           command=self.apply_filters).pack(anchor="w")
@@ -179,37 +405,16 @@ class FileManager:
         reset_btn.pack(pady=10)
 
     def apply_filters(self):
-        if self.current_path is None:
-            return
-            
         # Get filter values
         type_filter = self.type_var.get()
         size_filter = self.size_var.get()
         date_filter = self.date_var.get()
         
-        # Process size filter
-        size_ranges = {
-            "Any": (0, float('inf')),
-            "<10MB": (0, 10 * 1024 * 1024),
-            "10MB-100MB": (10 * 1024 * 1024, 100 * 1024 * 1024),
-            "100MB-1GB": (100 * 1024 * 1024, 1024 * 1024 * 1024),
-            ">1GB": (1024 * 1024 * 1024, float('inf'))
-        }
-        self.size_min, self.size_max = size_ranges[size_filter]
-        
-        # Process date filter
-        now = datetime.now()
-        date_ranges = {
-            "Any time": None,
-            "Today": (now.replace(hour=0, minute=0, second=0), now),
-            "This week": (now.replace(day=now.day-now.weekday(), hour=0, minute=0, second=0), now),
-            "This month": (now.replace(day=1, hour=0, minute=0, second=0), now),
-            "This year": (now.replace(month=1, day=1, hour=0, minute=0, second=0), now)
-        }
-        self.date_range = date_ranges[date_filter]
-        
-        # Update display
-        self.display_files(self.current_path)
+        self.entry_filter = EntryFilter(type_filter, size_filter, date_filter)
+        
+        # Update display from the current snapshot
+        if self.snapshot is not None:
+            self.render_snapshot()
 
     def reset_filters(self):
         self.type_var.set("All")
@@ -217,51 +422,14 @@ class FileManager:
         self.date_var.set("Any time")
         self.apply_filters()
 
-    def get_file_type_category(self, file_path):
-        if os.path.isdir(file_path):
-            return "Folder"
-            
-        mime_type, _ = mimetypes.guess_type(file_path)
-        if not mime_type:
-            return "Others"
-            
-        if mime_type.startswith('text/') or mime_type in ['application/pdf', 'application/msword']:
-            return "Documents"
-        elif mime_type.startswith('image/'):
-            return "Images"
-        elif mime_type.startswith('audio/'):
-            return "Audio"
-        elif mime_type.startswith('video/'):
-            return "Video"
-        elif mime_type in ['application/zip', 'application/x-rar-compressed']:
-            return "Archives"
-        else:
-            return "Others"
+    def get_file_type_category(self, file_path, is_dir=None):
+        if is_dir is None:
+            is_dir = os.path.isdir(file_path)
+        return self.classifier.classify(file_path, is_dir)
 
-    def should_show_item(self, full_path, file_type, size, mtime):
+    def should_show_item(self, entry):
         try:
-            # Always show folders
-            if os.path.isdir(full_path):
-                return True
-                
-            # Check file type filter
-            if self.type_var.get() != "All":
-                if self.get_file_type_category(full_path) != self.type_var.get():
-                    return False
-            
-            # Check size filter (only for files)
-            if not os.path.isdir(full_path):  # Only apply size filter to files
-                if not (self.size_min <= size <= self.size_max):
-                    return False
-            
-            # Check date filter
-            if hasattr(self, 'date_range') and self.date_range:
-                start_date, end_date = self.date_range
-                mtime_dt = datetime.fromtimestamp(mtime)
-                if not (start_date <= mtime_dt <= end_date):
-                    return False
-            
-            return True
+            return self.entry_filter(entry)
         except Exception as e:
             print(f"Error in should_show_item: {str(e)}")
             return True  # Show item by default if there's an error
@@ -279,17 +447,17 @@ class FileManager:
                     foreground="white")
         
         # Create scrollbar
-        scrollbar = ttk.Scrollbar(self.file_view_frame)
-        scrollbar.pack(side="right", fill="y")
+        self.tree_scrollbar = ttk.Scrollbar(self.file_view_frame)
+        self.tree_scrollbar.pack(side="right", fill="y")
         
         # Create Treeview with multiple columns
         self.tree = ttk.Treeview(self.file_view_frame,
                                 columns=("name", "size", "type", "modified"),
                                 show="headings",
-                                yscrollcommand=scrollbar.set)
+                                yscrollcommand=self.on_tree_scroll)
         
         # Configure scrollbar
-        scrollbar.config(command=self.tree.yview)
+        self.tree_scrollbar.config(command=self.tree.yview)
         
         # Configure columns
         self.tree.heading("name", text="Name", command=lambda: self.sort_items("name"))
@@ -306,15 +474,134 @@ class FileManager:
         # Configure tags for folders and files
         self.tree.tag_configure('folder', foreground='#87CEEB')
         self.tree.tag_configure('file', foreground='white')
+        self.tree.tag_configure('group', foreground='#e0c060')
         
         self.tree.pack(fill="both", expand=True, padx=10, pady=5)
         
         # Bind events
         self.tree.bind("<Double-1>", self.on_item_double_click)
+        self.tree.bind("<Delete>", self.delete_selection)
         self.tree.bind("<<TreeviewSelect>>", self.update_status_bar)
+        self.tree.bind("<<TreeviewSelect>>", self.schedule_preview, add="+")
+        self.tree.bind("<<TreeviewSelect>>", self.prefetch_selection, add="+")
+        
+        # One tooltip handler for all rows, text is built on demand
+        self.tooltip_job = None
+        self.tooltip_row = None
+        self.tooltip_event = None
+        self.tree.bind("<Motion>", self.on_tree_motion)
+        self.tree.bind("<Leave>", self.hide_tree_tooltip)
+        self.tree.bind("<Button-1>", self.hide_tree_tooltip, add="+")
+
+    def create_preview_pane(self):
+        """Create the preview pane for the selected row"""
+        self.preview_frame = tk.Frame(self.content_frame, bg="#1f1f1f", width=320)
+        self.preview_frame.pack_propagate(False)  # Keep the width whatever is shown
+        
+        self.preview_title = tk.Label(self.preview_frame, text="", bg="#1f1f1f", fg="white",
+                                      font=("Arial", 11, "bold"), anchor="w")
+        self.preview_title.pack(fill="x", padx=5, pady=(5, 0))
+        self.preview_details = tk.Label(self.preview_frame, text="", bg="#1f1f1f", fg="#9cdcfe",
+                                        anchor="w", justify="left", wraplength=300)
+        self.preview_details.pack(fill="x", padx=5, pady=(0, 5))
+        
+        scrollbar = ttk.Scrollbar(self.preview_frame)
+        scrollbar.pack(side="right", fill="y")
+        self.preview_text = tk.Text(self.preview_frame, bg="#2b2b2b", fg="white",
+                                    bd=0, wrap="none", font=("Consolas", 9),
+                                    state="disabled", yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.preview_text.yview)
+        self.preview_text.pack(fill="both", expand=True, padx=(5, 0), pady=(0, 5))
+
+    def toggle_preview(self, event=None):
+        """Show or hide the preview pane"""
+        self.preview_visible = not self.preview_visible
+        if self.preview_visible:
+            self.preview_frame.pack(side="right", fill="y", padx=5, pady=5,
+                                    before=self.file_view_frame)
+            self.update_preview()
+        else:
+            self.preview_frame.pack_forget()
+            self.preview_loader.cancel()
+            self.preview_pending = None
+
+    def schedule_preview(self, event=None):
+        """Preview the selection once it stops changing, e.g. while arrowing through rows"""
+        if not self.preview_visible:
+            return
+        if self.preview_job is not None:
+            self.root.after_cancel(self.preview_job)
+        self.preview_job = self.root.after(PREVIEW_DELAY_MS, self.update_preview)
+
+    def update_preview(self):
+        """Show the preview of the selected row, from the cache or rendered in the background"""
+        self.preview_job = None
+        selection = self.tree.selection()
+        item = selection[0] if len(selection) == 1 else None
+        entry = path = None
+        if item is None:
+            pass
+        elif self.snapshot is not None and item.isdigit():
+            entry = self.snapshot.entries[int(item)]
+            path = entry.path if entry is not None else None
+        elif item in self.report_paths:
+            path = self.report_paths[item]
+        elif self.current_path is None and item in self.volume_rows:
+            path = self.volume_rows[item].path
+        
+        preview = None
+        if path is None:
+            count = len(selection)
+            preview = Preview("", f"{count} items selected" if count else "Nothing selected", "")
+        elif self.archive_location is not None and entry is not None:
+            # Members are not extracted just to be previewed
+            details = entry.type if entry.is_dir else f"{entry.type}, {self.format_size(entry.size)}"
+            preview = Preview(entry.name, details,
+                              f"Stored in {os.path.basename(self.archive_location[0])}")
+        
+        # Only rows with a known mtime can be cached, a change on disk gives a new key
+        key = (path, entry.modified, entry.size) if entry is not None else (path, None, None)
+        if preview is None and entry is not None:
+            preview = self.preview_cache.get(key)
+        if preview is not None:
+            self.preview_loader.cancel()
+            self.preview_pending = None
+            self.show_preview(preview)
+            return
+        
+        self.preview_pending = key
+        self.preview_title.config(text=os.path.basename(path.rstrip('\\/')) or path)
+        self.preview_details.config(text="Loading preview...")
+        self.preview_loader.request(key, path)
+        if self.preview_poll_job is None:
+            self.preview_poll_job = self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+
+    def poll_preview(self):
+        """Show the rendered preview once it arrives"""
+        self.preview_poll_job = None
+        try:
+            while True:
+                key, preview = self.preview_queue.get_nowait()
+                if key[1] is not None:
+                    self.preview_cache.put(key, preview)
+                if key == self.preview_pending:
+                    self.preview_pending = None
+                    self.show_preview(preview)
+        except Empty:
+            pass
+        if self.preview_pending is not None:
+            self.preview_poll_job = self.root.after(PREVIEW_POLL_MS, self.poll_preview)
+
+    def show_preview(self, preview):
+        self.preview_title.config(text=preview.title)
+        self.preview_details.config(text=preview.details)
+        self.preview_text.config(state="normal")
+        self.preview_text.delete("1.0", "end")
+        self.preview_text.insert("1.0", preview.text)
+        self.preview_text.config(state="disabled")
 
     def sort_items(self, column):
-        if self.current_path is None:
+        if self.snapshot is None:
             return
             
         if self.sort_by == column:
@@ -323,169 +610,478 @@ class FileManager:
             self.sort_by = column
             self.sort_reverse = False
             
-        self.display_files(self.current_path)
+        self.render_snapshot()
 
     def format_size(self, size):
-        if size is None:
-            return "Calculating..."
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} PB"
-
-    def get_folder_size(self, folder):
-        """Calculate the total size of a folder"""
+        return format_size(size)
+
+    def get_folder_size(self, folder, cancelled=None, progress=None):
+        """Calculate the total size of a folder, or None if cancelled"""
         if not os.path.exists(folder):
             return 0
-            
-        total_size = 0
+        if not self.size_engine.one_device:
+            return self.size_engine.folder_size(folder, cancelled, progress)
+        # Stay on the filesystem of the listed folder, a mount point is not sized
         try:
-            for dirpath, dirnames, filenames in os.walk(folder, onerror=None):
-                for f in filenames:
+            device = os.stat(os.path.dirname(folder)).st_dev
+            if os.stat(folder).st_dev != device:
+                self.mount_points.add(folder)
+                return 0
+        except OSError:
+            device = None
+        return self.size_engine.folder_size(folder, cancelled, progress, device)
+
+    def folder_size_text(self, path, size):
+        """Return the size column text of a folder row"""
+        if size is not None and path in self.mount_points:
+            return "(other filesystem)"
+        return self.format_size(size)
+
+    def toggle_one_device(self):
+        """Apply the One filesystem box and size the current view again"""
+        self.size_engine.set_one_device(self.one_device_var.get())
+        self.mount_points.clear()
+        self.refresh()
+
+    def update_sizes(self):
+        """Update folder sizes as they become available"""
+        sizes_changed = False
+        results = 0
+        with profiler.span("update_sizes"):
+            try:
+                while True:
+                    generation, item_id, size, done = self.size_queue.get_nowait()
+                    results += 1
+                    # Drop results for a view that has since been replaced
+                    if not self.size_scheduler.is_current(generation):
+                        continue
+                    if done and size is None:
+                        text = "Unavailable"  # The size worker failed
+                    elif done and self.snapshot is not None:
+                        self.snapshot.set_folder_size(int(item_id), size)
+                        self.set_row_size(item_id, size)
+                        sizes_changed = True
+                        text = self.folder_size_text(self.snapshot.entries[int(item_id)].path, size)
+                    else:
+                        text = self.format_size(size) if done else f"≥ {self.format_size(size)}..."
                     try:
-                        fp = os.path.join(dirpath, f)
-                        if not os.path.islink(fp):  # Skip symbolic links
-                            total_size += os.path.getsize(fp)
-                    except (OSError, FileNotFoundError, PermissionError):
+                        self.tree.set(item_id, "size", text)
+                    except tk.TclError:
                         continue
-        except (OSError, PermissionError):
-            return 0
-        return total_size
+            except Empty:
+                pass
+        profiler.count("size.results", results)
+        if sizes_changed:
+            self.update_status_bar()
+        # Schedule next check
+        self.root.after(100, self.update_sizes)
+
+    def on_tree_scroll(self, first, last):
+        """Keep the scrollbar in sync and reprioritize visible folders"""
+        self.tree_scrollbar.set(first, last)
+        if self.visible_rows_job is None:
+            self.visible_rows_job = self.root.after(150, self.prioritize_visible_rows)
+
+    def prioritize_visible_rows(self):
+        """Calculate sizes of folders currently on screen first"""
+        self.visible_rows_job = None
+        top = self.tree.identify_row(1)
+        if not top:
+            return
+        bottom = self.tree.identify_row(self.tree.winfo_height() - 1)
+        children = self.tree.get_children()
+        start = self.tree.index(top)
+        end = self.tree.index(bottom) if bottom else len(children) - 1
+        self.size_scheduler.prioritize(children[start:end + 1])
 
-    def calculate_folder_size_async(self, folder, item_id):
-        """Calculate folder size in a separate thread"""
-        size = self.get_folder_size(folder)
-        self.size_queue.put((item_id, size))
+    def display_files(self, path):
+        # Cancel size calculations for the previous listing
+        self.size_scheduler.cancel_all()
+        self.snapshot = None
+        self.archive_generation += 1
+        self.archive_location = None if os.path.isdir(path) else split_archive_path(path)
+        if self.archive_location is not None:
+            self.watcher.watch(None)
+            self.display_archive()
+            return
+        
+        # Start watching before listing so no change is missed
+        self.watcher.watch(path)
+        
+        # Recently listed folders are shown at once and checked against the disk after
+        cached = self.snapshot_cache.get(path)
+        if cached is not None:
+            self.snapshot = self.reuse_snapshot(cached[0])
+            self.render_snapshot()
+            self.root.after_idle(self.revalidate_snapshot, self.snapshot, cached[1])
+            return
         
-    def update_sizes(self):
-        """Update folder sizes as they become available"""
+        try:
+            # Get all items with their information in a single pass
+            self.snapshot, mtime_ns = list_folder(path, self.get_file_type_category)
+            self.snapshot_cache.put(path, self.snapshot, mtime_ns)
+        except PermissionError:
+            messagebox.showerror("Error", "Permission denied")
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+        
+        self.render_snapshot()
+
+    def reuse_snapshot(self, snapshot):
+        """Prepare a cached snapshot to be shown again and return it"""
+        profiler.count("snapshot.cache_hits")
+        for index in list(snapshot.size_requested):
+            snapshot.forget_folder_size(index)  # Cancelled when the folder was left
+        # Keep the folder sizes the size engine has not dropped since
+        for index in list(snapshot.folder_sizes):
+            entry = snapshot.entries[index]
+            if entry is None or self.size_engine.cached_size(entry.path, entry.modified) is None:
+                snapshot.forget_folder_size(index)
+        return snapshot
+
+    def revalidate_snapshot(self, snapshot, mtime_ns):
+        """List a folder shown from the cache again if it changed since it was cached"""
+        if self.snapshot is not snapshot:
+            return
+        try:
+            current = os.stat(snapshot.path).st_mtime_ns
+        except OSError:
+            current = None
+        if current != mtime_ns:
+            self.snapshot_cache.discard(snapshot.path)
+            self.display_files(snapshot.path)
+
+    def prefetch_row(self, item):
+        """List the folder of a row in the background, if prefetching is on"""
+        if (not self.prefetch_var.get() or self.snapshot is None
+                or self.archive_location is not None or not item.isdigit()):
+            return
+        entry = self.snapshot.entries[int(item)]
+        if entry is not None and entry.is_dir:
+            self.prefetcher.request(entry.path, entry.path)
+
+    def prefetch_selection(self, event=None):
+        selection = self.tree.selection()
+        if len(selection) == 1:
+            self.prefetch_row(selection[0])
+
+    def display_archive(self):
+        """List a folder inside an archive, reading the archive in the background if needed"""
+        archive, inner = self.archive_location
+        try:
+            index = self.archive_cache.get(archive, build=False)
+        except OSError as e:
+            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+            self.render_snapshot()
+            return
+        if index is not None:
+            self.show_archive_folder(index)
+            return
+        
+        # Parsing the directory of a large archive takes a while, keep the window responsive
+        self.render_snapshot()
+        self.status_right.config(text=f"Reading {os.path.basename(archive)}...")
+        generation = self.archive_generation
+        def read_index():
+            try:
+                result = self.archive_cache.get(archive)
+            except OSError as e:
+                result = e
+            self.archive_queue.put((generation, result))
+        thread = threading.Thread(target=read_index)
+        thread.daemon = True
+        thread.start()
+        self.root.after(50, self.update_archive_index, generation)
+
+    def update_archive_index(self, generation):
+        """Show an archive folder once its index has been read"""
+        if generation != self.archive_generation:
+            return
         try:
             while True:
-                item_id, size = self.size_queue.get_nowait()
-                self.tree.set(item_id, "size", self.format_size(size))
-        except:
-            # Queue is empty, schedule next check
-            self.root.after(100, self.update_sizes)
+                result_generation, result = self.archive_queue.get_nowait()
+                if result_generation == generation:
+                    break
+        except Empty:
+            self.root.after(50, self.update_archive_index, generation)
+            return
+        if isinstance(result, OSError):
+            messagebox.showerror("Error", f"An error occurred: {str(result)}")
+            return
+        self.show_archive_folder(result)
 
-    def display_files(self, path):
+    def show_archive_folder(self, index):
+        """Show the current archive folder from the archive index"""
+        try:
+            self.snapshot = index.snapshot(self.archive_location[1], self.get_file_type_category)
+        except OSError as e:
+            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+        self.render_snapshot()
+
+    def render_snapshot(self):
+        """Show the current snapshot with the active sort order and filters"""
+        # Cancel row insertion for the previous view
+        self.cancel_populate()
+        
         # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.clear_rows()
         
-        try:
-            # Get all items with their information
-            items = []
-            for item in os.listdir(path):
-                try:
-                    full_path = os.path.join(path, item)
-                    stats = os.stat(full_path)
-                    
-                    # Get size based on whether it's a file or directory
-                    try:
-                        if os.path.isfile(full_path):
-                            size = stats.st_size
-                        else:
-                            # For directories, show "Folder" instead of size initially
-                            size = 0
-                    except:
-                        size = 0
-                    
-                    mtime = stats.st_mtime
-                    
-                    if self.should_show_item(full_path, self.get_file_type_category(full_path), size, mtime):
-                        items.append({
-                            'name': item,
-                            'path': full_path,
-                            'size': size,
-                            'type': self.get_file_type_category(full_path),
-                            'modified': mtime,
-                            'is_dir': os.path.isdir(full_path)
-                        })
-                except (PermissionError, OSError) as e:
-                    print(f"Error accessing {item}: {str(e)}")
-                    continue
+        snapshot = self.snapshot
+        if snapshot is not None:
+            entries = snapshot.entries
+            order = snapshot.order(self.sort_by, self.sort_reverse)
+            with profiler.span("filter"):
+                rows = [i for i in order if self.should_show_item(entries[i])]
             
-            # Sort items
-            items.sort(key=lambda x: (
-                not x['is_dir'],  # Directories first
-                {
-                    'name': x['name'].lower(),
-                    'size': x['size'],
-                    'type': x['type'],
-                    'modified': x['modified']
-                }[self.sort_by]
-            ), reverse=self.sort_reverse)
+            # Display items in time-sliced batches
+            self.populate_rows(rows)
             
-            # Display items
-            for item in items:
-                try:
-                    if item['is_dir']:
-                        # For directories, start a thread to calculate size
-                        item_id = self.tree.insert("", "end",
-                                                 values=(
-                                                     item['name'],
-                                                     "Calculating...",
-                                                     item['type'],
-                                                     datetime.fromtimestamp(item['modified']).strftime('%Y-%m-%d %H:%M')
-                                                 ),
-                                                 tags=('folder',))
-                        # Add tooltip for the folder
-                        self.show_tooltip(self.tree, f"Double-click to open\nPath: {item['path']}")
-                        # Start size calculation in background
-                        thread = threading.Thread(
-                            target=self.calculate_folder_size_async,
-                            args=(item['path'], item_id)
-                        )
-                        thread.daemon = True
-                        thread.start()
-                    else:
-                        item_id = self.tree.insert("", "end",
-                                                 values=(
-                                                     item['name'],
-                                                     self.format_size(item['size']),
-                                                     item['type'],
-                                                     datetime.fromtimestamp(item['modified']).strftime('%Y-%m-%d %H:%M')
-                                                 ),
-                                                 tags=('file',))
-                        # Add tooltip for the file
-                        self.show_tooltip(self.tree,
-                                       f"Type: {item['type']}\nSize: {self.format_size(item['size'])}\n"
-                                       f"Modified: {datetime.fromtimestamp(item['modified']).strftime('%Y-%m-%d %H:%M')}\n"
-                                       f"Path: {item['path']}")
-                except Exception as e:
-                    print(f"Error displaying {item['name']}: {str(e)}")
-                    continue
-                    
-        except PermissionError:
-            messagebox.showerror("Error", "Permission denied")
+        # Update status bar
+        self.update_status_bar()
+
+    def row_size(self, index, row):
+        """Return the known size of a snapshot entry, queueing it if unknown"""
+        snapshot = self.snapshot
+        item = snapshot.entries[index]
+        if not item.is_dir:
+            return item.size
+        
+        # Reuse a size that already arrived, or one computed during an
+        # earlier scan of a parent
+        size = snapshot.folder_sizes.get(index)
+        if size is None and item.path in self.mount_points:
+            size = 0  # Not sized while folders stay on one filesystem
+            snapshot.set_folder_size(index, size)
+        if size is None:
+            size = self.size_engine.cached_size(item.path, item.modified)
+            if size is not None:
+                snapshot.set_folder_size(index, size)
+        # Otherwise queue size calculation once, top rows first
+        if size is None and index not in snapshot.size_requested:
+            snapshot.size_requested.add(index)
+            self.size_scheduler.submit(item.path, str(index), priority=row)
+        return size
+
+    def insert_row(self, index, row, position="end", existing=False):
+        """Insert the snapshot entry at index into the tree.
+
+        With existing=True the row is already in the tree (detached after a
+        change on disk) and is moved back to position with fresh values.
+        """
+        item = self.snapshot.entries[index]
+        item_id = str(index)
+        try:
+            size = self.row_size(index, row)
+            values = (
+                item.name,
+                self.folder_size_text(item.path, size) if item.is_dir else self.format_size(size),
+                item.type,
+                datetime.fromtimestamp(item.modified).strftime('%Y-%m-%d %H:%M')
+            )
+            tags = ('folder',) if item.is_dir else ('file',)
+            if existing:
+                self.tree.move(item_id, "", position)
+                self.tree.item(item_id, values=values, tags=tags)
+                self.set_row_size(item_id, size)
+            else:
+                self.tree.insert("", position, iid=item_id, values=values, tags=tags)
+                self.add_row_size(item_id, size)
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+            print(f"Error displaying {item.name}: {str(e)}")
+
+    def on_directory_changed(self, path, name):
+        """Called from the watcher thread when an entry of path changed"""
+        self.watch_queue.put((path, name))
+
+    def process_watch_events(self):
+        """Apply queued filesystem changes to the current view"""
+        # Leave changes queued until all rows of the view are inserted
+        if not self.populate_items:
+            changed = set()
+            rescan = False
+            try:
+                while True:
+                    path, name = self.watch_queue.get_nowait()
+                    if self.snapshot is None or path != self.snapshot.path:
+                        continue
+                    if name is None:
+                        rescan = True
+                    else:
+                        changed.add(name)
+            except Empty:
+                pass
             
-        # Start updating sizes and update status bar
-        self.root.after(100, self.update_sizes)
+            if rescan:
+                # The directory itself changed or events were lost
+                if os.path.isdir(self.current_path):
+                    self.refresh()
+                else:
+                    self.go_up()
+            elif changed:
+                self.apply_directory_changes(changed)
+        self.root.after(WATCH_APPLY_MS, self.process_watch_events)
+
+    def apply_directory_changes(self, names):
+        """Patch the snapshot and the tree rows for the changed entry names"""
+        snapshot = self.snapshot
+        changed = set()
+        paths = []
+        folders = []
+        for name in names:
+            full_path = os.path.join(snapshot.path, name)
+            paths.append(full_path)
+            old_index = snapshot.name_index.get(name)
+            if old_index is not None and snapshot.entries[old_index].is_dir:
+                folders.append(full_path)
+            try:
+                entry = make_entry(name, full_path, os.stat(full_path), self.get_file_type_category)
+            except OSError:
+                index = snapshot.remove_entry(name)
+                if index is not None:
+                    changed.add(index)
+                continue
+            changed.add(snapshot.update_entry(entry))
+        # Only the folders on the changed paths need new sizes; sizes below
+        # them can only be cached for names that were folders before
+        self.size_engine.forget_many(paths, folders)
+        
+        # Take the changed rows out of the tree, then put back the visible ones
+        detached = set()
+        for index in changed:
+            item_id = str(index)
+            if item_id in self.row_sizes:
+                self.tree.detach(item_id)
+                detached.add(item_id)
+        
+        entries = snapshot.entries
+        rows = [i for i in snapshot.order(self.sort_by, self.sort_reverse)
+                if self.should_show_item(entries[i])]
+        for position, index in enumerate(rows):
+            if index in changed:
+                item_id = str(index)
+                self.insert_row(index, position, position, existing=item_id in detached)
+                detached.discard(item_id)
+        
+        # Rows that were removed or are now filtered out
+        for item_id in detached:
+            self.remove_row(item_id)
         self.update_status_bar()
 
-    def update_path(self, path):
+    def populate_rows(self, items):
+        """Insert rows for the given snapshot indexes without blocking Tk.
+
+        The first screenful is inserted right away; the remaining rows are
+        inserted from root.after callbacks that each run for at most
+        ROW_BATCH_SECONDS, so the window stays responsive for huge folders.
+        """
+        self.populate_items = items
+        self.populate_next = 0
+        self.insert_row_batch(first_paint=True)
+
+    def insert_row_batch(self, first_paint=False):
+        """Insert the next time-sliced batch of pending rows"""
+        self.populate_job = None
+        items = self.populate_items
+        start = self.populate_next
+        if first_paint:
+            end = min(len(items), start + FIRST_PAINT_ROWS)
+        else:
+            end = len(items)
+        deadline = time.perf_counter() + ROW_BATCH_SECONDS
+        
+        row = start
+        with profiler.span("populate"):
+            while row < end:
+                self.insert_row(items[row], row)
+                row += 1
+                if not first_paint and row % 64 == 0 and time.perf_counter() >= deadline:
+                    break
+        profiler.count("rows.inserted", row - start)
+        self.populate_next = row
+        
+        if row < len(items):
+            self.populate_job = self.root.after(1, self.insert_row_batch)
+        else:
+            self.populate_items = []
+        if not first_paint:
+            self.update_status_bar()
+
+    def cancel_populate(self):
+        """Stop inserting rows for the previous view"""
+        if self.populate_job is not None:
+            self.root.after_cancel(self.populate_job)
+            self.populate_job = None
+        self.populate_items = []
+        self.populate_next = 0
+
+    def update_path(self, path, record_history=True):
+        self.stop_search()
+        self.stop_report()
+        if record_history:
+            self.record_history(path)
         self.current_path = path
         self.path_var.set(path)
         self.update_breadcrumb()
         self.display_files(path)
 
     def go_up(self):
+        # Leaving search results goes back to the searched folder
+        if self.search_query is not None:
+            self.clear_search()
+            return
+        
+        # Leaving a report goes back to the folder or My Computer it was started from
+        if self.report is not None:
+            if self.current_path is None:
+                self.show_my_computer()
+            else:
+                self.update_path(self.current_path)
+            return
+        
         # If we're already at My Computer view, do nothing
         if self.current_path is None:
             return
             
         # If we're at a root directory, go to My Computer view
-        if os.name == 'nt' and len(self.current_path) <= 3:
+        parent = os.path.dirname(self.current_path)
+        if not parent or parent == self.current_path:
             self.show_my_computer()
             return
             
         # Normal directory up navigation
-        parent = os.path.dirname(self.current_path)
-        if parent and parent != self.current_path:
-            self.update_path(parent)
+        self.update_path(parent)
+
+    def record_history(self, location):
+        """Add a folder (None for My Computer) to the history, dropping the forward part"""
+        if self.history and self.history[self.history_index] == location:
+            return
+        del self.history[self.history_index + 1:]
+        self.history.append(location)
+        if len(self.history) > HISTORY_LENGTH:
+            del self.history[0]
+        self.history_index = len(self.history) - 1
+
+    def go_back(self):
+        """Go to the previous folder in the history"""
+        # Search results and reports go back to the folder they were opened in
+        if self.search_query is not None or self.report is not None:
+            self.search_var.set("")
+            self.open_history(self.history_index)
+        elif self.history_index > 0:
+            self.open_history(self.history_index - 1)
+
+    def go_forward(self):
+        """Go to the next folder in the history"""
+        if self.history_index < len(self.history) - 1:
+            self.open_history(self.history_index + 1)
+
+    def open_history(self, index):
+        self.history_index = index
+        location = self.history[index]
+        if location is None:
+            self.show_my_computer(record_history=False)
+        else:
+            self.update_path(location, record_history=False)
 
     def on_item_double_click(self, event):
         selection = self.tree.selection()
@@ -499,11 +1095,34 @@ class FileManager:
             
         item_name = item_values[0]  # Name is now the first column
         
+        # Report rows open the folder itself or the one that contains the file
+        if item in self.report_paths:
+            path = self.report_paths[item]
+            if 'folder' in self.tree.item(item, 'tags'):
+                self.update_path(path)
+            else:
+                self.update_path(os.path.dirname(path))
+            return
+        if self.report is not None:
+            return
+        
+        # Rows of a folder listing or search results map to snapshot entries
+        if self.snapshot is not None and item.isdigit():
+            entry = self.snapshot.entries[int(item)]
+            if entry.is_dir or (is_archive(entry.name) and self.search_query is None
+                                and self.archive_location is None):
+                # Archives open as folders
+                self.update_path(entry.path)
+            elif self.search_query is not None:
+                # Open the folder that contains the found file
+                self.update_path(os.path.dirname(entry.path))
+            return
+        
         # Handle drive selection from My Computer view
         if self.current_path is None:  # We're in My Computer view
-            # Extract drive letter from the text (e.g., "Local Disk (C:)" -> "C:")
-            drive = item_name.split("(")[1].split(")")[0] + "\\"
-            self.update_path(drive)
+            volume = self.volume_rows.get(item)
+            if volume:
+                self.update_path(volume.path)
             return
             
         # Normal folder navigation
@@ -523,105 +1142,102 @@ class FileManager:
         self.root.geometry(f"+{x}+{y}")
 
     def get_available_drives(self):
-        drives = []
-        bitmask = windll.kernel32.GetLogicalDrives()
-        for letter in string.ascii_uppercase:
-            if bitmask & 1:
-                drive_path = f"{letter}:\\"
-                try:
-                    drive_type = windll.kernel32.GetDriveTypeW(drive_path)
-                    # Include all drive types except DRIVE_NO_ROOT_DIR (1)
-                    if drive_type > 1:
-                        drives.append(drive_path)
-                except:
-                    pass
-            bitmask >>= 1
-        return drives
-
-    def get_drive_space(self, drive):
-        try:
-            usage = shutil.disk_usage(drive)
-            return usage.total, usage.used, usage.free
-        except:
-            return 0, 0, 0
+        return [volume.path for volume in self.volume_backend.list_volumes()]
 
-    def show_my_computer(self):
+    def show_my_computer(self, record_history=True):
+        self.stop_search()
+        self.stop_report()
+        self.archive_location = None
+        if record_history:
+            self.record_history(None)
+        
+        # Cancel size calculations and row insertion for the previous view
+        self.size_scheduler.cancel_all()
+        self.cancel_populate()
+        self.snapshot = None
+        self.watcher.watch(None)
+        
         # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.clear_rows()
         
         # Set path to "My Computer"
         self.path_var.set("My Computer")
         self.current_path = None
         
+        # Rows are shown right away; labels and space are probed in the background
+        self.volume_generation += 1
+        generation = self.volume_generation
+        self.volume_rows = {}
+        self.volume_deadlines = {}
+        deadline = time.monotonic() + VOLUME_PROBE_TIMEOUT
         try:
             # Get and display available drives
-            drives = self.get_available_drives()
-            for drive in sorted(drives):
-                try:
-                    # Get drive type
-                    drive_type = windll.kernel32.GetDriveTypeW(drive)
-                    
-                    # Get volume name
-                    volume_name_buffer = ctypes.create_unicode_buffer(1024)
-                    file_system_name_buffer = ctypes.create_unicode_buffer(1024)
-                    windll.kernel32.GetVolumeInformationW(
-                        drive,
-                        volume_name_buffer,
-                        ctypes.sizeof(volume_name_buffer),
-                        None, None, None,
-                        file_system_name_buffer,
-                        ctypes.sizeof(file_system_name_buffer)
-                    )
-                    volume_name = volume_name_buffer.value
-                    
-                    # Set drive label based on type
-                    if drive_type == 2:  # DRIVE_REMOVABLE
-                        drive_label = "Removable Drive"
-                    elif drive_type == 3:  # DRIVE_FIXED
-                        drive_label = "Local Disk"
-                    elif drive_type == 4:  # DRIVE_REMOTE
-                        drive_label = "Network Drive"
-                    elif drive_type == 5:  # DRIVE_CDROM
-                        drive_label = "CD/DVD Drive"
-                    else:
-                        drive_label = "Drive"
-                    
-                    # Get drive space
-                    total, used, free = self.get_drive_space(drive)
-                    
-                    # Format drive text
-                    drive_letter = drive[0]
-                    if volume_name:
-                        drive_name = f"{volume_name} ({drive_letter}:)"
-                    else:
-                        drive_name = f"{drive_label} ({drive_letter}:)"
-                    
-                    # Add size information
-                    size_info = f"Free: {self.format_size(free)} / Total: {self.format_size(total)}" if total > 0 else "Unknown"
-                    
-                    self.tree.insert("", "end",
-                                   values=(
-                                       drive_name,
-                                       size_info,
-                                       drive_label,
-                                       datetime.fromtimestamp(os.path.getctime(drive)).strftime('%Y-%m-%d %H:%M')
-                                   ),
-                                   tags=('folder',))
-                except Exception as e:
-                    print(f"Error displaying drive {drive}: {str(e)}")
-                    # Fallback for any errors
-                    drive_letter = drive[0]
-                    self.tree.insert("", "end",
-                                   values=(
-                                       f"Local Disk ({drive_letter}:)",
-                                       "Unknown",
-                                       "Drive",
-                                       ""
-                                   ),
-                                   tags=('folder',))
+            for volume in sorted(self.volume_backend.list_volumes()):
+                info = self.volume_prober.cached(volume.path)
+                item_id = self.tree.insert("", "end",
+                                           values=self.volume_row_values(volume, info),
+                                           tags=('folder',))
+                self.add_row_size(item_id, None)
+                self.volume_rows[item_id] = volume
+                if info is None:
+                    self.volume_deadlines[item_id] = deadline
+                    self.volume_prober.probe(volume.path, generation)
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
+        
+        if self.volume_deadlines:
+            self.root.after(100, self.update_volume_rows, generation)
+        self.update_status_bar()
+
+    def volume_row_values(self, volume, info, unavailable=False):
+        """Format a My Computer row, with placeholders until info is probed"""
+        if info is None:
+            status = "Unavailable" if unavailable else "Checking..."
+            return (f"{volume.kind} ({volume.short})", status, volume.kind, "")
+        
+        # Format drive text
+        drive_name = f"{info.label or volume.kind} ({volume.short})"
+        
+        # Add size information
+        size_info = f"Free: {self.format_size(info.free)} / Total: {self.format_size(info.total)}" if info.total > 0 else "Unknown"
+        
+        return (drive_name,
+                size_info,
+                volume.kind,
+                datetime.fromtimestamp(info.created).strftime('%Y-%m-%d %H:%M'))
+
+    def update_volume_rows(self, generation):
+        """Fill in probed volumes and mark the ones that did not answer in time"""
+        if generation != self.volume_generation:
+            return
+        rows = {volume.path: item_id for item_id, volume in self.volume_rows.items()}
+        try:
+            while True:
+                result_generation, path, info = self.volume_queue.get_nowait()
+                # Answers for an earlier visit of My Computer
+                if result_generation != generation:
+                    continue
+                item_id = rows.get(path)
+                # Late answers still fill in rows already marked unavailable
+                if item_id is None or (info is None and item_id not in self.volume_deadlines):
+                    continue
+                self.volume_deadlines.pop(item_id, None)
+                self.tree.item(item_id, values=self.volume_row_values(
+                    self.volume_rows[item_id], info, unavailable=info is None))
+        except Empty:
+            pass
+        
+        now = time.monotonic()
+        for item_id, deadline in list(self.volume_deadlines.items()):
+            if now >= deadline:
+                del self.volume_deadlines[item_id]
+                self.tree.item(item_id, values=self.volume_row_values(
+                    self.volume_rows[item_id], None, unavailable=True))
+        
+        if self.volume_deadlines:
+            self.root.after(100, self.update_volume_rows, generation)
+        elif self.volume_prober.busy(generation):
+            self.root.after(VOLUME_LATE_POLL_MS, self.update_volume_rows, generation)
 
     def create_tooltip(self):
         """Create tooltip window"""
@@ -669,6 +1285,57 @@ class FileManager:
         widget.bind("<Leave>", hide)
         widget.bind("<Button-1>", hide)
 
+    def on_tree_motion(self, event):
+        """Remember the pointer position and update the tooltip soon"""
+        self.tooltip_event = (event.x_root, event.y_root, event.y)
+        if self.tooltip_job is None:
+            self.tooltip_job = self.root.after(TOOLTIP_THROTTLE_MS, self.update_tree_tooltip)
+
+    def update_tree_tooltip(self):
+        """Show the tooltip for the row under the pointer"""
+        self.tooltip_job = None
+        if self.tooltip_event is None:
+            return
+        x_root, y_root, y = self.tooltip_event
+        item = self.tree.identify_row(y)
+        if not item:
+            self.tooltip_row = None
+            self.tooltip.withdraw()
+            return
+        
+        # Only format the text when the pointer moves to another row
+        if item != self.tooltip_row:
+            self.tooltip_row = item
+            self.prefetch_row(item)
+            self.tooltip.label.configure(text=self.tooltip_text(item))
+            self.tooltip.deiconify()
+        self.tooltip.geometry(f"+{x_root + 15}+{y_root + 10}")
+
+    def tooltip_text(self, item):
+        """Build the tooltip text for a tree row"""
+        entry = None
+        if self.snapshot is not None and item.isdigit():
+            entry = self.snapshot.entries[int(item)]
+        if item in self.report_paths:
+            return f"Double-click to open its folder\nPath: {self.report_paths[item]}"
+        if entry is None:
+            return f"Double-click to open\nItem: {self.tree.item(item, 'values')[0]}"
+        if entry.is_dir:
+            usage = self.size_engine.cached_usage(entry.path, entry.modified)
+            sizes = ""
+            if usage is not None:
+                sizes = (f"Size: {self.format_size(usage.apparent)}\n"
+                         f"Size on disk: {self.format_size(usage.allocated)}\n")
+            return f"Double-click to open\n{sizes}Path: {entry.path}\nItem: {entry.name}"
+        return (f"Type: {entry.type}\nSize: {self.format_size(entry.size)}\n"
+                f"Modified: {datetime.fromtimestamp(entry.modified).strftime('%Y-%m-%d %H:%M')}\n"
+                f"Path: {entry.path}\nItem: {entry.name}")
+
+    def hide_tree_tooltip(self, event=None):
+        self.tooltip_event = None
+        self.tooltip_row = None
+        self.tooltip.withdraw()
+
     def create_breadcrumb(self):
         """Create breadcrumb navigation"""
         self.breadcrumb_frame = tk.Frame(self.root, bg="#2b2b2b")
@@ -744,62 +1411,88 @@ class FileManager:
                                    fg="white",
                                    anchor="e")
         self.status_right.pack(side="right", padx=5, pady=2)
+        
+        # File operation progress, packed only while a job runs
+        self.status_job = tk.Label(self.status_frame,
+                                 text="",
+                                 bg="#1f1f1f",
+                                 fg="#e0c060",
+                                 anchor="w",
+                                 cursor="hand2")
+        self.status_job.bind("<Button-1>", self.cancel_operations)
+        
+        # Performance overlay, packed only while toggled on with F12
+        self.status_perf = tk.Label(self.status_frame,
+                                  text="",
+                                  bg="#1f1f1f",
+                                  fg="#9cdcfe",
+                                  font=("Consolas", 8),
+                                  anchor="w")
+
+    def clear_rows(self):
+        """Remove all rows from the tree and reset the size aggregates"""
+        self.tree.delete(*self.tree.get_children())
+        self.row_sizes = {}
+        self.total_size = 0
+        self.selected_items = set()
+        self.selected_size = 0
+
+    def add_row_size(self, item_id, size):
+        """Record the size of a newly inserted row (None if not known yet)"""
+        self.row_sizes[item_id] = size
+        if size is not None:
+            self.total_size += size
+
+    def set_row_size(self, item_id, size):
+        """Update the size of a row and the totals it contributes to"""
+        if item_id not in self.row_sizes:
+            return
+        delta = (size or 0) - (self.row_sizes[item_id] or 0)
+        self.row_sizes[item_id] = size
+        self.total_size += delta
+        if item_id in self.selected_items:
+            self.selected_size += delta
+
+    def remove_row(self, item_id):
+        """Delete a row from the tree and from the size aggregates"""
+        self.tree.delete(item_id)
+        size = self.row_sizes.pop(item_id, None) or 0
+        self.total_size -= size
+        if item_id in self.selected_items:
+            self.selected_items.discard(item_id)
+            self.selected_size -= size
 
     def update_status_bar(self, event=None):
         """Update status bar information"""
-        # Update selected items info
-        selection = self.tree.selection()
-        if selection:
-            selected_count = len(selection)
-            selected_size = 0
-            for item in selection:
-                size_str = self.tree.item(item)["values"][1]
-                if size_str != "Calculating...":
-                    try:
-                        # Extract numeric value and unit
-                        value = float(size_str.split()[0])
-                        unit = size_str.split()[1]
-                        # Convert to bytes
-                        multiplier = {
-                            'B': 1,
-                            'KB': 1024,
-                            'MB': 1024**2,
-                            'GB': 1024**3,
-                            'TB': 1024**4
-                        }
-                        selected_size += value * multiplier[unit]
-                    except:
-                        pass
-            
-            self.status_left.config(
-                text=f"Selected: {selected_count} item{'s' if selected_count > 1 else ''}, "
-                     f"Total size: {self.format_size(selected_size)}")
-        else:
-            self.status_left.config(text="")
+        with profiler.span("status_bar"):
+            # Apply only the selection changes since the last update
+            selection = set(self.tree.selection())
+            if selection != self.selected_items:
+                row_sizes = self.row_sizes
+                for item in selection - self.selected_items:
+                    self.selected_size += row_sizes.get(item) or 0
+                for item in self.selected_items - selection:
+                    self.selected_size -= row_sizes.get(item) or 0
+                self.selected_items = selection
+        
+            # Update selected items info
+            if selection:
+                selected_count = len(selection)
+                self.status_left.config(
+                    text=f"Selected: {selected_count} item{'s' if selected_count > 1 else ''}, "
+                         f"Total size: {self.format_size(self.selected_size)}")
+            else:
+                self.status_left.config(text="")
 
-        # Update total items info
-        total_items = len(self.tree.get_children())
-        total_size = 0
-        for item in self.tree.get_children():
-            size_str = self.tree.item(item)["values"][1]
-            if size_str != "Calculating..." and "Free:" not in size_str:
-                try:
-                    value = float(size_str.split()[0])
-                    unit = size_str.split()[1]
-                    multiplier = {
-                        'B': 1,
-                        'KB': 1024,
-                        'MB': 1024**2,
-                        'GB': 1024**3,
-                        'TB': 1024**4
-                    }
-                    total_size += value * multiplier[unit]
-                except:
-                    pass
-        
-        self.status_right.config(
-            text=f"Total: {total_items} item{'s' if total_items > 1 else ''}, "
-                 f"Size: {self.format_size(total_size)}")
+            # Update total items info
+            total_items = len(self.row_sizes)
+            if self.populate_items:
+                self.status_right.config(
+                    text=f"Loading: {total_items} of {len(self.populate_items)} items")
+                return
+            self.status_right.config(
+                text=f"Total: {total_items} item{'s' if total_items > 1 else ''}, "
+                     f"Size: {self.format_size(self.total_size)}")
 
     def bind_shortcuts(self):
         """Bind keyboard shortcuts"""
@@ -812,8 +1505,22 @@ class FileManager:
         # Selection shortcuts
         self.root.bind("<Control-a>", self.select_all)
         
+        # File operation shortcuts
+        self.root.bind("<Control-c>", self.copy_selection)
+        self.root.bind("<Control-x>", self.cut_selection)
+        self.root.bind("<Control-v>", self.paste_clipboard)
+        self.root.bind("<Control-V>", lambda e: self.paste_clipboard(e, verify=True))
+        
         # View shortcuts
         self.root.bind("<Control-m>", lambda e: self.show_my_computer())
+        self.root.bind("<Control-f>", lambda e: self.search_entry.focus_set())
+        self.root.bind("<Control-d>", self.find_duplicates)
+        self.root.bind("<Control-u>", self.show_disk_usage)
+        self.root.bind("<Alt-p>", self.toggle_preview)
+        
+        # Diagnostics shortcuts
+        self.root.bind("<F12>", self.toggle_perf_overlay)
+        self.root.bind("<Control-F12>", self.toggle_trace)
         
         # Add tooltips to navigation buttons
         for widget in self.root.winfo_children():
@@ -823,6 +1530,236 @@ class FileManager:
                 elif widget.cget('text') == "My Computer":
                     self.show_tooltip(widget, "My Computer (Ctrl+M)")
 
+    def selected_paths(self):
+        """Return the paths of the selected files and folders"""
+        if self.report is not None:
+            return [self.report_paths[item] for item in self.tree.selection()
+                    if item in self.report_paths]
+        if self.snapshot is None:
+            return []
+        entries = self.snapshot.entries
+        return [entries[int(item)].path for item in self.tree.selection()
+                if item.isdigit() and entries[int(item)] is not None]
+
+    def copy_selection(self, event=None):
+        return self.set_clipboard("copy")
+
+    def cut_selection(self, event=None):
+        return self.set_clipboard("move")
+
+    def set_clipboard(self, operation):
+        """Remember the selected items for a later paste"""
+        if isinstance(self.root.focus_get(), tk.Entry):
+            return None  # Let the search box copy and paste text
+        paths = self.selected_paths()
+        if paths and operation == "move" and self.archive_location is not None:
+            messagebox.showerror("Error", "Archives are read-only, copy the items instead")
+            return "break"
+        if paths:
+            self.clipboard = (operation, paths)
+            count = len(paths)
+            self.status_left.config(
+                text=f"{'Copied' if operation == 'copy' else 'Cut'} {count} item{'s' if count > 1 else ''}")
+        return "break"
+
+    def paste_clipboard(self, event=None, verify=False):
+        """Copy or move the clipboard items into the current folder"""
+        if isinstance(self.root.focus_get(), tk.Entry):
+            return None
+        if self.clipboard is None:
+            return "break"
+        if (self.current_path is None or self.search_query is not None
+                or self.report is not None or self.archive_location is not None):
+            messagebox.showerror("Error", "Open a folder to paste into")
+            return "break"
+        operation, paths = self.clipboard
+        if operation == "move":
+            # Cut items can only be pasted once
+            self.clipboard = None
+        # Items copied from inside an archive are extracted
+        members = [path for path in paths if not os.path.lexists(path)
+                   and (split_archive_path(path) or (None, ""))[1]]
+        files = [path for path in paths if path not in members]
+        if members:
+            self.submit_operation(ExtractJob(members, self.current_path, self.archive_cache))
+        if files:
+            self.submit_operation(CopyJob(operation, files, self.current_path, verify=verify))
+        return "break"
+
+    def delete_selection(self, event=None):
+        """Permanently delete the selected items after confirmation"""
+        paths = self.selected_paths()
+        if not paths:
+            return "break"
+        if self.archive_location is not None:
+            messagebox.showerror("Error", "Archives are read-only")
+            return "break"
+        count = len(paths)
+        what = f'"{os.path.basename(paths[0])}"' if count == 1 else f"{count} items"
+        if messagebox.askyesno("Delete", f"Permanently delete {what}?"):
+            self.submit_operation(DeleteJob(paths))
+        return "break"
+
+    def submit_operation(self, job):
+        job_id = self.file_operations.submit(job)
+        self.operation_jobs[job_id] = job
+        self.operation_progress[job_id] = job.progress()
+        self.update_operation_status()
+
+    def update_operations(self):
+        """Show progress of file operations and refresh the folders they changed"""
+        try:
+            while True:
+                progress = self.operation_queue.get_nowait()
+                if progress.operation == "delete":
+                    self.remove_deleted_rows(progress)
+                if progress.finished:
+                    self.operation_progress.pop(progress.job_id, None)
+                    self.finish_operation(progress)
+                elif progress.job_id in self.operation_progress:
+                    self.operation_progress[progress.job_id] = progress
+        except Empty:
+            pass
+        self.update_operation_status()
+        self.root.after(OPERATION_POLL_MS, self.update_operations)
+
+    def remove_deleted_rows(self, progress):
+        """Drop the rows of deleted items as soon as their whole subtree is gone"""
+        handled = self.operation_removed.get(progress.job_id, 0)
+        paths = progress.completed[handled:]
+        self.operation_removed[progress.job_id] = len(progress.completed)
+        if paths and self.report is not None:
+            deleted = set(paths)
+            for item_id, path in list(self.report_paths.items()):
+                if path in deleted:
+                    del self.report_paths[item_id]
+                    self.remove_row(item_id)
+            self.update_status_bar()
+            return
+        snapshot = self.snapshot
+        # Rows still being inserted are left to the directory watcher
+        if not paths or snapshot is None or self.search_query is not None or self.populate_items:
+            return
+        names = {os.path.basename(path) for path in paths
+                 if os.path.dirname(path) == snapshot.path}
+        if names:
+            # Also forgets the cached sizes of the current folder and its ancestors
+            self.apply_directory_changes(names)
+
+    def finish_operation(self, progress):
+        """Drop stale folder sizes and report errors of a finished job"""
+        self.operation_removed.pop(progress.job_id, None)
+        job = self.operation_jobs.pop(progress.job_id, None)
+        if job is not None:
+            self.size_engine.forget_many(job.changed_folders, job.changed_folders)
+            # Rows of the current folder change through the watcher, but the
+            # sizes of its subfolders have to be recalculated
+            current = self.current_path
+            if current is not None and self.search_query is None and any(
+                    folder.startswith(os.path.join(current, '')) for folder in job.changed_folders):
+                self.refresh()
+            elif progress.operation == "delete" and (
+                    self.search_query is not None or self.report is not None):
+                # Search results and reports are not watched, run them again
+                self.refresh()
+        if progress.errors:
+            shown = progress.errors[:OPERATION_ERRORS_SHOWN]
+            more = len(progress.errors) - len(shown)
+            message = "\n".join(shown) + (f"\n...and {more} more" if more > 0 else "")
+            messagebox.showerror("Error", f"Some items could not be processed:\n{message}")
+
+    def update_operation_status(self):
+        """Show the progress of the running file operation in the status bar"""
+        if not self.operation_progress:
+            if self.status_job.winfo_manager():
+                self.status_job.pack_forget()
+            return
+        progress = self.operation_progress[min(self.operation_progress)]
+        verb = {"copy": "Copying", "move": "Moving", "delete": "Deleting",
+                "extract": "Extracting"}.get(
+            progress.operation, progress.operation.capitalize())
+        if not progress.total_files:
+            # Deleting does not count the items up front
+            text = (f"{verb}: {progress.done_files} items, "
+                    f"{self.format_size(progress.done_bytes)} removed")
+        else:
+            if progress.total_bytes:
+                percent = progress.done_bytes / progress.total_bytes
+            else:
+                percent = progress.done_files / progress.total_files
+            text = (f"{verb} {progress.done_files} of {progress.total_files} items, "
+                    f"{self.format_size(progress.done_bytes)} of {self.format_size(progress.total_bytes)} "
+                    f"({percent:.0%})")
+        queued = len(self.operation_progress) - 1
+        if queued > 0:
+            text += f", {queued} more queued"
+        self.status_job.config(text=text + " - click to cancel")
+        if not self.status_job.winfo_manager():
+            self.status_job.pack(side="left", padx=5, pady=2)
+
+    def cancel_operations(self, event=None):
+        """Ask to cancel the running and queued file operations"""
+        if self.operation_progress and messagebox.askyesno(
+                "Cancel", "Cancel the running file operations?"):
+            self.file_operations.cancel()
+
+    def toggle_perf_overlay(self, event=None):
+        """Show or hide live timings and counters in the status bar"""
+        self.perf_overlay = not self.perf_overlay
+        if self.perf_overlay:
+            profiler.enabled = True
+            self.status_perf.pack(side="left", padx=5, pady=2)
+            self.update_perf_overlay()
+        else:
+            profiler.enabled = profiler.trace_file is not None
+            self.status_perf.pack_forget()
+
+    def start_trace(self, path):
+        """Record spans and counters to a Chrome trace file"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            profiler.start_trace(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not start trace: {str(e)}")
+            return
+        self.update_perf_overlay()
+
+    def toggle_trace(self, event=None):
+        """Start a trace in the cache directory, or stop it and show where it was saved"""
+        if profiler.trace_file is None:
+            self.start_trace(os.path.join(
+                get_cache_dir(), f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+            return
+        path = profiler.stop_trace()
+        profiler.enabled = self.perf_overlay
+        messagebox.showinfo("Trace saved", f"Trace written to {path}")
+
+    def update_perf_overlay(self):
+        """Refresh the overlay and sample counters into the trace"""
+        if self.perf_overlay_job is not None:
+            self.root.after_cancel(self.perf_overlay_job)
+            self.perf_overlay_job = None
+        if not self.perf_overlay and profiler.trace_file is None:
+            return
+        profiler.sample_counters()
+        if self.perf_overlay:
+            timers, counters = profiler.stats()
+            parts = []
+            for name, label in PERF_OVERLAY_TIMERS:
+                timer = timers.get(name)
+                if timer is not None:
+                    parts.append(f"{label} {timer[2] * 1000:.1f}ms")
+            classify = timers.get("classify")
+            if classify is not None:
+                parts.append(f"classify {classify[1] * 1000:.0f}ms total")
+            parts.append(f"stat {counters.get('syscalls.stat', 0)}")
+            parts.append(f"rows {counters.get('rows.inserted', 0)}")
+            parts.append(f"workers {counters.get('size.workers_busy', 0)}/{self.size_workers}")
+            parts.append(f"jobs {counters.get('queue.size_jobs', 0)}")
+            parts.append(f"results {counters.get('queue.size_results', 0)}")
+            self.status_perf.config(text=" | ".join(parts))
+        self.perf_overlay_job = self.root.after(PERF_OVERLAY_MS, self.update_perf_overlay)
+
     def select_all(self, event=None):
         """Select all items in the current view"""
         for item in self.tree.get_children():
@@ -830,12 +1767,411 @@ class FileManager:
 
     def refresh(self, event=None):
         """Refresh the current view"""
-        if self.current_path is None:
+        if self.search_query is not None:
+            self.start_search()
+        elif self.report is not None:
+            self.report()
+        elif self.current_path is None:
             self.show_my_computer()
         else:
+            # List again and recalculate folder sizes for this directory
+            self.size_engine.forget(self.current_path)
+            self.mount_points.clear()
+            self.snapshot_cache.discard(self.current_path)
             self.display_files(self.current_path)
 
+    def get_search_roots(self):
+        """Return the folders the filename index covers"""
+        # Network volumes are left out, indexing them would flood the network
+        return [volume.path for volume in self.volume_backend.list_volumes()
+                if volume.kind != "Network Drive"]
+
+    def run_indexer(self):
+        """Keep the filename index up to date, in a background thread"""
+        while True:
+            try:
+                self.filename_index.refresh(self.get_search_roots())
+            except Exception as e:
+                print(f"Error indexing file names: {str(e)}")
+            time.sleep(INDEX_REFRESH_SECONDS)
+
+    def start_search(self):
+        """Search the filename index and stream the results into the view"""
+        query = self.search_var.get().strip()
+        if not query:
+            self.clear_search()
+            return
+        
+        self.stop_search()
+        self.stop_report()
+        self.search_query = query
+        generation = self.search_generation
+        
+        # Cancel work for the previous view and start an empty result list
+        self.size_scheduler.cancel_all()
+        self.watcher.watch(None)
+        self.snapshot = DirectorySnapshot(None, [])
+        self.render_snapshot()
+        
+        scope = self.current_path
+        if self.archive_location is not None:
+            # Archives are not indexed, search the folder that contains it
+            scope = os.path.dirname(self.archive_location[0])
+            self.archive_location = None
+        content_search = self.content_search_var.get()
+        if content_search:
+            if scope is None:
+                messagebox.showinfo("Search", "Open a folder to search file contents")
+                self.clear_search()
+                return
+            label = f"Contents: {query} in {scope}"
+        else:
+            label = f"Search: {query}" + (f" in {scope}" if scope else "")
+            if self.filename_index.indexing:
+                label += " (index is being updated)"
+        self.path_var.set(label)
+        self.update_breadcrumb()
+        tk.Label(self.breadcrumb_frame, text=f"> {label}",
+                bg="#2b2b2b", fg="white").pack(side="left", padx=2)
+        
+        if content_search:
+            thread = threading.Thread(target=self.run_content_search,
+                                      args=(query, scope, self.entry_filter.type_filter, generation))
+        else:
+            thread = threading.Thread(target=self.run_search, args=(query, scope, generation))
+        thread.daemon = True
+        thread.start()
+        self.root.after(50, self.update_search_results, generation)
+
+    def run_search(self, query, scope, generation):
+        """Query the filename index in a background thread"""
+        try:
+            for batch in self.filename_index.search(
+                    query, self.get_file_type_category, scope,
+                    cancelled=lambda: generation != self.search_generation):
+                self.search_queue.put((generation, batch))
+        except sqlite3.Error as e:
+            print(f"Error searching for {query}: {str(e)}")
+        finally:
+            self.search_queue.put((generation, None))
+
+    def run_content_search(self, query, scope, type_filter, generation):
+        """Search file contents below scope across a pool of processes.
+
+        Every match becomes one result row named "path:line: preview".
+        """
+        cancelled = lambda: generation != self.search_generation
+        try:
+            for results in iter_content_matches(scope, query, self.get_file_type_category,
+                                                type_filter, cancelled):
+                batch = []
+                for path, size, mtime, matches in results:
+                    category = self.get_file_type_category(path, False)
+                    for line_number, preview in matches:
+                        batch.append(FileEntry(f"{path}:{line_number}: {preview}",
+                                               path, False, size, mtime, category))
+                self.search_queue.put((generation, batch))
+        except Exception as e:
+            print(f"Error searching for {query}: {str(e)}")
+        finally:
+            self.search_queue.put((generation, None))
+
+    def update_search_results(self, generation):
+        """Append search results to the view as they arrive.
+
+        Each call inserts rows for at most ROW_BATCH_SECONDS and leaves the
+        rest of its batch for the next call, so broad queries stay responsive.
+        Rows stay in the order they arrived; the snapshot sorts the results
+        once, when a column header is clicked.
+        """
+        if generation != self.search_generation:
+            return
+        snapshot = self.snapshot
+        finished = False
+        deadline = time.perf_counter() + ROW_BATCH_SECONDS
+        try:
+            while time.perf_counter() < deadline:
+                if self.search_batch_next >= len(self.search_batch):
+                    result_generation, batch = self.search_queue.get_nowait()
+                    if result_generation != generation:
+                        continue
+                    if batch is None:
+                        finished = True
+                        break
+                    self.search_batch, self.search_batch_next = batch, 0
+                start = self.search_batch_next
+                self.search_batch_next = min(len(self.search_batch), start + 64)
+                for entry in self.search_batch[start:self.search_batch_next]:
+                    index = snapshot.append_entry(entry)
+                    if self.should_show_item(entry):
+                        self.insert_row(index, len(self.row_sizes))
+        except Empty:
+            pass
+        
+        self.update_status_bar()
+        if not finished:
+            # Come back at once while results are waiting to be inserted
+            busy = self.search_batch_next < len(self.search_batch) or not self.search_queue.empty()
+            self.root.after(1 if busy else 50, self.update_search_results, generation)
+
+    def stop_search(self):
+        """Cancel a running search and leave search mode"""
+        self.search_generation += 1
+        self.search_batch = []
+        self.search_batch_next = 0
+        self.search_query = None
+
+    def start_report(self, title, restart):
+        """Replace the view with an empty report and return its generation.
+
+        restart is called without arguments to run the report again on refresh.
+        """
+        self.stop_search()
+        self.stop_report()
+        self.report = restart
+        generation = self.report_generation
+        
+        # Cancel work for the previous view
+        self.size_scheduler.cancel_all()
+        self.cancel_populate()
+        self.watcher.watch(None)
+        self.snapshot = None
+        self.clear_rows()
+        self.report_paths = {}
+        
+        self.path_var.set(title)
+        self.update_breadcrumb()
+        self.report_label = tk.Label(self.breadcrumb_frame, text=f"> {title}",
+                                     bg="#2b2b2b", fg="white")
+        self.report_label.pack(side="left", padx=2)
+        self.update_status_bar()
+        return generation
+
+    def stop_report(self):
+        """Cancel a running report and leave report mode"""
+        self.report_generation += 1
+        self.report = None
+        self.report_path = None
+        self.report_paths = {}
+
+    def report_scope(self, title, message):
+        """Return the folder a report covers: the current one or the selected drive"""
+        if self.report_path is not None:
+            return self.report_path  # Running the report shown again
+        if self.archive_location is not None:
+            messagebox.showinfo(title, "Reports are not available inside archives")
+            return None
+        if self.current_path is not None:
+            return self.current_path
+        selection = self.tree.selection()
+        volume = self.volume_rows.get(selection[0]) if selection else None
+        if volume is None:
+            messagebox.showinfo(title, message)
+            return None
+        return volume.path
+
+    def set_report_rows(self, parent, rows):
+        """Make rows the children of parent in order, reusing rows already shown.
+
+        Each row is (item id, values, tags, path or None, size or None), so
+        rows keep their selection across updates of a running report.
+        """
+        wanted = {row[0] for row in rows}
+        for item_id in self.tree.get_children(parent):
+            if item_id not in wanted:
+                for child in self.tree.get_children(item_id):
+                    self.report_paths.pop(child, None)
+                    self.remove_row(child)
+                self.report_paths.pop(item_id, None)
+                self.remove_row(item_id)
+        for position, (item_id, values, tags, path, size) in enumerate(rows):
+            if self.tree.exists(item_id):
+                self.tree.move(item_id, parent, position)
+                self.tree.item(item_id, values=values, tags=tags)
+                self.set_row_size(item_id, size)
+            else:
+                self.tree.insert(parent, position, iid=item_id, values=values, tags=tags, open=True)
+                self.add_row_size(item_id, size)
+            if path is not None:
+                self.report_paths[item_id] = path
+
+    def show_disk_usage(self, event=None):
+        """Show the largest files and folders below the current folder or selected drive"""
+        scope = self.report_scope("Disk Usage",
+                                  "Open a folder or select a drive to see what uses its space")
+        if scope is None:
+            return
+        
+        generation = self.start_report(f"Disk usage of {scope}", self.show_disk_usage)
+        self.report_path = scope
+        # Like folder sizes, the scan stays on the filesystem it starts on
+        scan = DiskUsageScan(scope, self.classifier.classify, workers=self.size_workers,
+                             one_device=self.one_device_var.get())
+        thread = threading.Thread(target=scan.run)
+        thread.daemon = True
+        thread.start()
+        self.root.after(100, self.update_disk_usage, scan, generation)
+
+    def update_disk_usage(self, scan, generation):
+        """Show the current state of a disk usage scan"""
+        if generation != self.report_generation:
+            scan.cancel()
+            return
+        finished = scan.finished
+        report = scan.report()
+        with profiler.span("usage_report"):
+            self.show_usage_report(report)
+        
+        status = (f"{self.format_size(report.total)} in {report.files} files "
+                  f"and {report.folders} folders")
+        if not finished:
+            status = f"scanning, {status}"
+        self.report_label.config(text=f"> Disk usage of {self.report_path}: {status}")
+        self.update_status_bar()
+        if not finished:
+            self.root.after(USAGE_REFRESH_MS, self.update_disk_usage, scan, generation)
+
+    def show_usage_report(self, report):
+        """Update the category totals and the largest folders and files"""
+        total = report.total or 1
+        share = lambda size: f"{size * 100 / total:.1f}% of total"
+        self.set_report_rows("", [
+            ("usage:categories", ("Categories", self.format_size(report.total), "", ""),
+             ('group',), None, None),
+            ("usage:folders", (f"Largest {len(report.largest_folders)} folders", "", "", ""),
+             ('group',), None, None),
+            ("usage:files", (f"Largest {len(report.largest_files)} files", "", "", ""),
+             ('group',), None, None),
+        ])
+        categories = sorted(report.categories.items(), key=lambda item: -item[1])
+        self.set_report_rows("usage:categories", [
+            (f"usage:category:{category}", (category, self.format_size(size), "Category", share(size)),
+             ('file',), None, None)
+            for category, size in categories])
+        # Folder sizes include the files listed below, only files add to the totals
+        self.set_report_rows("usage:folders", [
+            (f"usage:folder:{path}", (path, self.format_size(size), "Folder", share(size)),
+             ('folder',), path, None)
+            for size, path in report.largest_folders])
+        self.set_report_rows("usage:files", [
+            (f"usage:file:{path}",
+             (path, self.format_size(size), self.get_file_type_category(path, False), share(size)),
+             ('file',), path, size)
+            for size, path in report.largest_files])
+
+    def find_duplicates(self, event=None):
+        """Show sets of identical files below the current folder or selected drive"""
+        scope = self.report_scope("Duplicates",
+                                  "Open a folder or select a drive to look for duplicate files")
+        if scope is None:
+            return
+        
+        generation = self.start_report(f"Duplicates in {scope}", self.find_duplicates)
+        self.report_path = scope
+        self.duplicate_order = []  # negated reclaimable bytes of the shown sets
+        self.duplicate_progress = ("scan", 0, 0)
+        thread = threading.Thread(target=self.run_duplicates,
+                                  args=(scope, generation, self.one_device_var.get()))
+        thread.daemon = True
+        thread.start()
+        self.root.after(100, self.update_duplicates, generation)
+
+    def run_duplicates(self, scope, generation, one_device):
+        """Look for duplicate files in a background thread"""
+        def progress(stage, done, total):
+            self.report_queue.put((generation, "progress", (stage, done, total)))
+        
+        try:
+            for group in find_duplicates(scope, lambda: generation != self.report_generation,
+                                         progress, one_device=one_device):
+                entries = []
+                for path in group.paths:
+                    try:
+                        stats = os.stat(path, follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append(make_entry(os.path.basename(path), path, stats,
+                                              self.get_file_type_category))
+                self.report_queue.put((generation, "group", entries))
+        except Exception as e:
+            print(f"Error finding duplicates in {scope}: {str(e)}")
+        finally:
+            self.report_queue.put((generation, "done", None))
+
+    def update_duplicates(self, generation):
+        """Add duplicate sets to the view as they are confirmed"""
+        if generation != self.report_generation:
+            return
+        finished = False
+        try:
+            while True:
+                result_generation, kind, payload = self.report_queue.get_nowait()
+                if result_generation != generation:
+                    continue
+                if kind == "progress":
+                    self.duplicate_progress = payload
+                elif kind == "group":
+                    self.insert_duplicate_group(payload)
+                else:
+                    finished = True
+                    break
+        except Empty:
+            pass
+        
+        sets = len(self.duplicate_order)
+        summary = (f"{sets} set{'s' if sets != 1 else ''}, "
+                   f"{self.format_size(-sum(self.duplicate_order))} reclaimable")
+        stage, done, total = self.duplicate_progress
+        if finished:
+            status = summary
+        elif stage == "scan":
+            status = f"scanning, {done} files"
+        elif stage == "partial":
+            status = f"comparing {done} of {total} files, {summary}"
+        else:
+            status = (f"hashing {self.format_size(done)} of {self.format_size(total)}, "
+                      f"{summary}")
+        self.report_label.config(text=f"> Duplicates in {self.report_path}: {status}")
+        self.update_status_bar()
+        if not finished:
+            self.root.after(100, self.update_duplicates, generation)
+
+    def insert_duplicate_group(self, entries):
+        """Insert a set of identical files, keeping the largest savings on top"""
+        if len(entries) < 2:
+            return
+        size = entries[0].size
+        reclaimable = size * (len(entries) - 1)
+        position = bisect.bisect_right(self.duplicate_order, -reclaimable)
+        self.duplicate_order.insert(position, -reclaimable)
+        group_id = self.tree.insert("", position, open=True, tags=('group',), values=(
+            f"{len(entries)} identical files",
+            self.format_size(size * len(entries)),
+            entries[0].type,
+            f"{self.format_size(reclaimable)} reclaimable"
+        ))
+        for entry in entries:
+            item_id = self.tree.insert(group_id, "end", tags=('file',), values=(
+                entry.path,
+                self.format_size(entry.size),
+                entry.type,
+                datetime.fromtimestamp(entry.modified).strftime('%Y-%m-%d %H:%M')
+            ))
+            self.report_paths[item_id] = entry.path
+            self.add_row_size(item_id, entry.size)
+
+    def clear_search(self):
+        """Leave search results and show the searched folder again"""
+        self.search_var.set("")
+        self.stop_search()
+        self.tree.focus_set()
+        if self.current_path is None:
+            self.show_my_computer()
+        else:
+            self.update_path(self.current_path)
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = FileManager(root)
-    root.mainloop() 
\ No newline at end of file
+    root.mainloop()
+    profiler.stop_trace() 
\ No newline at end of file
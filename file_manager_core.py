@@ -0,0 +1,3815 @@
+"""Headless core of the file manager: scanning, sizing, search and filters.
+
+Nothing here depends on tkinter, so the same logic can be used by the GUI
+and from the command line::
+
+    python file_manager_core.py ls PATH
+    python file_manager_core.py du PATH
+    python file_manager_core.py find PATH PATTERN
+"""
+import os
+import sys
+import errno
+import stat
+import select
+import struct
+import threading
+import heapq
+import itertools
+from queue import Queue
+import time
+import string
+import shutil
+import sqlite3
+import hashlib
+from datetime import datetime, timedelta
+import mimetypes
+import mmap
+import multiprocessing
+import zipfile
+import tarfile
+import zlib
+import codecs
+import re
+import fnmatch
+import argparse
+import csv
+import json
+from collections import namedtuple, OrderedDict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """Timers and counters around the hot paths, off unless enabled.
+
+    ``span(name)`` times a block, ``timed(name, func)`` wraps a function
+    called too often for one trace event per call, and ``count(name, n)``
+    bumps a counter. Gauges are callables read whenever stats are taken,
+    for live values such as queue depths. With start_trace() every span is
+    also written to a file in the Chrome trace event format, which can be
+    opened in chrome://tracing, Perfetto or speedscope.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timers = {}    # name -> [calls, total seconds, last seconds, max seconds]
+        self.counters = {}  # name -> value
+        self.gauges = {}    # name -> callable returning the current value
+        self.trace_file = None
+        self.trace_start = time.perf_counter()
+        self.pid = os.getpid()
+
+    def span(self, name):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def timed(self, name, func):
+        """Return func wrapped to add its run time to a timer, or func itself when disabled"""
+        if not self.enabled:
+            return func
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.add_time(name, perf_counter() - start)
+        return wrapper
+
+    def add_time(self, name, elapsed):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] = elapsed
+            timer[3] = max(timer[3], elapsed)
+
+    def record(self, name, start, end):
+        """Add a finished span to its timer and to the trace"""
+        self.add_time(name, end - start)
+        if self.trace_file is not None:
+            self._write_event({"name": name, "cat": name.split('.')[0], "ph": "X",
+                               "ts": (start - self.trace_start) * 1e6,
+                               "dur": (end - start) * 1e6,
+                               "pid": self.pid, "tid": threading.get_ident()})
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def stats(self):
+        """Return (timers, counters), with the current value of every gauge"""
+        with self.lock:
+            timers = {name: tuple(timer) for name, timer in self.timers.items()}
+            counters = dict(self.counters)
+        for name, func in list(self.gauges.items()):
+            try:
+                counters[name] = func()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {str(e)}")
+        return timers, counters
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def start_trace(self, path):
+        """Write spans and counter samples to path until stop_trace()"""
+        trace_file = open(path, 'w', encoding='utf-8')
+        # JSON array format; viewers accept the array without its closing bracket
+        trace_file.write('[\n')
+        with self.lock:
+            self.trace_file = trace_file
+            self.trace_start = time.perf_counter()
+        self.enabled = True
+        self._write_event({"name": "process_name", "ph": "M", "pid": self.pid,
+                           "args": {"name": "file_manager"}})
+
+    def sample_counters(self):
+        """Write counters, gauges and timer totals to the trace as counter events"""
+        if self.trace_file is None:
+            return
+        timers, counters = self.stats()
+        for name, timer in timers.items():
+            counters[f"{name} ms"] = round(timer[1] * 1000, 3)
+        ts = (time.perf_counter() - self.trace_start) * 1e6
+        for name, value in counters.items():
+            self._write_event({"name": name, "ph": "C", "ts": ts, "pid": self.pid,
+                               "args": {"value": value}})
+
+    def stop_trace(self):
+        """Finish the trace file, returning its path or None"""
+        self.sample_counters()
+        with self.lock:
+            trace_file, self.trace_file = self.trace_file, None
+        if trace_file is None:
+            return None
+        trace_file.write(json.dumps({"name": "thread_name", "ph": "M", "pid": self.pid,
+                                     "tid": threading.get_ident(),
+                                     "args": {"name": "main"}}) + ']\n')
+        trace_file.close()
+        return trace_file.name
+
+    def _write_event(self, event):
+        line = json.dumps(event) + ',\n'
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.write(line)
+
+
+# Shared by the GUI, the command line tools and the worker threads
+profiler = Profiler()
+
+
+# Extensions whose category is not derived correctly from their MIME type
+CATEGORY_OVERRIDES = {
+    '.7z': "Archives", '.rar': "Archives", '.zip': "Archives", '.tar': "Archives",
+    '.gz': "Archives", '.tgz': "Archives", '.bz2': "Archives", '.xz': "Archives",
+    '.zst': "Archives", '.tar.gz': "Archives", '.tar.bz2': "Archives",
+    '.tar.xz': "Archives", '.tar.zst': "Archives",
+    '.doc': "Documents", '.docx': "Documents", '.xls': "Documents", '.xlsx': "Documents",
+    '.ppt': "Documents", '.pptx': "Documents", '.odt': "Documents", '.ods': "Documents",
+    '.odp': "Documents", '.rtf': "Documents", '.pdf': "Documents", '.md': "Documents",
+    '.csv': "Documents", '.epub': "Documents",
+}
+
+
+def mime_category(mime_type):
+    """Map a MIME type to one of the filter categories"""
+    if mime_type.startswith('text/') or mime_type in ['application/pdf', 'application/msword']:
+        return "Documents"
+    elif mime_type.startswith('image/'):
+        return "Images"
+    elif mime_type.startswith('audio/'):
+        return "Audio"
+    elif mime_type.startswith('video/'):
+        return "Video"
+    elif mime_type in ['application/zip', 'application/x-rar-compressed']:
+        return "Archives"
+    else:
+        return "Others"
+
+
+class CategoryClassifier:
+    """Classify file names with a dict lookup on their lowercased suffix.
+
+    The table is built once from the mimetypes database, then the
+    CATEGORY_OVERRIDES and any user overrides are applied on top. Compound
+    suffixes such as .tar.gz are looked up before the last suffix alone.
+    """
+
+    def __init__(self, overrides=None):
+        mimetypes.init()
+        table = {}
+        for types_map in (mimetypes.common_types, mimetypes.types_map):
+            for ext, mime_type in types_map.items():
+                table[ext.lower()] = mime_category(mime_type)
+        table.update(CATEGORY_OVERRIDES)
+        if overrides:
+            table.update((ext.lower(), category) for ext, category in overrides.items())
+        self.table = table
+        # Last suffixes that may be part of a compound one, e.g. ".gz" of ".tar.gz"
+        self.compound_tails = frozenset(ext[ext.rfind('.'):] for ext in table if ext.rfind('.') > 0)
+
+    def classify(self, name, is_dir=False):
+        if is_dir:
+            return "Folder"
+        dot = name.rfind('.')
+        if dot == -1:
+            return "Others"
+        suffix = name[dot:].lower()
+        if suffix in self.compound_tails:
+            compound = name.rfind('.', 0, dot)
+            if compound != -1:
+                category = self.table.get(name[compound:].lower())
+                if category is not None:
+                    return category
+        return self.table.get(suffix, "Others")
+
+
+class FileEntry(namedtuple("FileEntry", "name path is_dir size modified type")):
+    """Immutable record describing one directory entry"""
+    __slots__ = ()
+
+
+def make_entry(name, path, stats, classify):
+    """Build a FileEntry from an already fetched stat result"""
+    is_dir = stat.S_ISDIR(stats.st_mode)
+    return FileEntry(
+        name=name,
+        path=path,
+        is_dir=is_dir,
+        # For directories, size is calculated later in the background
+        size=0 if is_dir else stats.st_size,
+        modified=stats.st_mtime,
+        type=classify(name, is_dir)
+    )
+
+
+def scan_directory(path, classify):
+    """List a directory in a single os.scandir pass.
+
+    Each entry costs exactly one stat call: the DirEntry caches its stat
+    result, and the file/folder flag is taken from st_mode instead of
+    separate isfile/isdir calls. ``classify(path, is_dir)`` returns the
+    type category for the entry.
+    """
+    entries = []
+    classify = profiler.timed("classify", classify)
+    with profiler.span("scan"), os.scandir(path) as it:
+        for entry in it:
+            try:
+                stats = entry.stat()
+            except (PermissionError, OSError) as e:
+                print(f"Error accessing {entry.name}: {str(e)}")
+                continue
+            entries.append(make_entry(entry.name, entry.path, stats, classify))
+    profiler.count("syscalls.scandir")
+    profiler.count("syscalls.stat", len(entries))
+    return entries
+
+
+_DIGITS = re.compile(r'\d+')
+
+
+def _pad_number(match):
+    digits = match.group()
+    return f"{len(digits):04d}{digits}"
+
+
+def natural_key(name):
+    """Case-folded sort key that orders embedded numbers numerically"""
+    return _DIGITS.sub(_pad_number, name.casefold())
+
+
+class DirectorySnapshot:
+    """In-memory listing of one directory with precomputed sort keys.
+
+    Sorting and filtering only reorder or mask the snapshot, and folder
+    sizes are kept on it as they arrive, so neither has to touch the disk.
+    Tree rows use the entry index as their item id. Entries changed on disk
+    are patched in place; removed entries leave a None behind so the
+    indexes of all other rows stay valid.
+    """
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+        self.folder_sizes = {}       # entry index -> size in bytes
+        self.size_requested = set()  # entry indexes queued for size calculation
+        self.orders = {}             # column -> ascending list of entry indexes
+        self.unsorted = False        # entries were appended without sorting
+        
+        # Directories always come first; within each group rows are ordered
+        # by name, and the other columns sort stably on top of that
+        with profiler.span("snapshot"):
+            self.name_keys = name_keys = [natural_key(entry.name) for entry in entries]
+            self.dirs = sorted((i for i, e in enumerate(entries) if e.is_dir), key=name_keys.__getitem__)
+            self.files = sorted((i for i, e in enumerate(entries) if not e.is_dir), key=name_keys.__getitem__)
+            self.type_keys = [entry.type for entry in entries]
+            self.modified_keys = [entry.modified for entry in entries]
+            self.name_index = {entry.name: i for i, entry in enumerate(entries)}
+
+    def _group(self, entry):
+        return self.dirs if entry.is_dir else self.files
+
+    def _insert_sorted(self, group, index):
+        # Binary search on the name keys of the group
+        key = self.name_keys[index]
+        low, high = 0, len(group)
+        while low < high:
+            middle = (low + high) // 2
+            if self.name_keys[group[middle]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        group.insert(low, index)
+
+    def _sort_groups(self):
+        if self.unsorted:
+            self.dirs.sort(key=self.name_keys.__getitem__)
+            self.files.sort(key=self.name_keys.__getitem__)
+            self.unsorted = False
+
+    def append_entry(self, entry):
+        """Add an entry without sorting it in yet, returning its index.
+
+        Streamed results are appended this way and sorted once, the next
+        time an order is needed.
+        """
+        index = len(self.entries)
+        self.entries.append(entry)
+        self.name_keys.append(natural_key(entry.name))
+        self.type_keys.append(entry.type)
+        self.modified_keys.append(entry.modified)
+        self.name_index[entry.name] = index
+        self._group(entry).append(index)
+        self.unsorted = True
+        self.orders = {}
+        return index
+
+    def update_entry(self, entry):
+        """Add an entry or replace the one with the same name, returning its index"""
+        self._sort_groups()
+        index = self.name_index.get(entry.name)
+        if index is None:
+            index = len(self.entries)
+            self.entries.append(entry)
+            self.name_keys.append(natural_key(entry.name))
+            self.type_keys.append(entry.type)
+            self.modified_keys.append(entry.modified)
+            self.name_index[entry.name] = index
+        else:
+            self._group(self.entries[index]).remove(index)
+            self.entries[index] = entry
+            self.type_keys[index] = entry.type
+            self.modified_keys[index] = entry.modified
+            self.folder_sizes.pop(index, None)
+            self.size_requested.discard(index)
+        self._insert_sorted(self._group(entry), index)
+        self.orders = {}
+        return index
+
+    def remove_entry(self, name):
+        """Remove the entry with the given name, returning its old index"""
+        index = self.name_index.pop(name, None)
+        if index is not None:
+            self._group(self.entries[index]).remove(index)
+            self.entries[index] = None
+            self.folder_sizes.pop(index, None)
+            self.size_requested.discard(index)
+            self.orders = {}
+        return index
+
+    def set_folder_size(self, index, size):
+        self.folder_sizes[index] = size
+        # Size order depends on folder sizes, rebuild it on next use
+        self.orders.pop('size', None)
+
+    def forget_folder_size(self, index):
+        self.folder_sizes.pop(index, None)
+        self.size_requested.discard(index)
+        self.orders.pop('size', None)
+
+    def order(self, column, reverse=False):
+        """Return entry indexes sorted by column, directories first"""
+        order = self.orders.get(column)
+        if order is None:
+            self._sort_groups()
+            with profiler.span("sort"):
+                if column == 'size':
+                    keys = [0 if e is None else self.folder_sizes.get(i, 0) if e.is_dir else e.size
+                            for i, e in enumerate(self.entries)]
+                elif column == 'type':
+                    keys = self.type_keys
+                elif column == 'modified':
+                    keys = self.modified_keys
+                else:
+                    keys = None
+                if keys is None:
+                    order = self.dirs + self.files
+                else:
+                    order = (sorted(self.dirs, key=keys.__getitem__) +
+                             sorted(self.files, key=keys.__getitem__))
+            self.orders[column] = order
+        return order[::-1] if reverse else order
+
+
+def format_size(size):
+    """Return a size in bytes as a short human readable string"""
+    if size is None:
+        return "Calculating..."
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} PB"
+
+
+# Size Range filter choices, in bytes
+SIZE_RANGES = {
+    "Any": (0, float('inf')),
+    "<10MB": (0, 10 * 1024 * 1024),
+    "10MB-100MB": (10 * 1024 * 1024, 100 * 1024 * 1024),
+    "100MB-1GB": (100 * 1024 * 1024, 1024 * 1024 * 1024),
+    ">1GB": (1024 * 1024 * 1024, float('inf'))
+}
+
+TYPE_FILTERS = ["All", "Documents", "Images", "Audio", "Video", "Archives", "Others"]
+DATE_FILTERS = ["Any time", "Today", "This week", "This month", "This year"]
+
+
+def date_range(date_filter, now=None):
+    """Return the (start, end) datetimes of a Date Modified choice, or None"""
+    if now is None:
+        now = datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    date_ranges = {
+        "Any time": None,
+        "Today": (midnight, now),
+        "This week": (midnight - timedelta(days=now.weekday()), now),
+        "This month": (midnight.replace(day=1), now),
+        "This year": (midnight.replace(month=1, day=1), now)
+    }
+    return date_ranges[date_filter]
+
+
+class EntryFilter:
+    """File Type, Size Range and Date Modified filters applied to entries.
+
+    Folders always pass; the size and date filters only apply to files.
+    """
+
+    def __init__(self, type_filter="All", size_filter="Any", date_filter="Any time", now=None):
+        self.type_filter = type_filter
+        self.size_min, self.size_max = SIZE_RANGES[size_filter]
+        dates = date_range(date_filter, now)
+        if dates:
+            self.date_min, self.date_max = dates[0].timestamp(), dates[1].timestamp()
+        else:
+            self.date_min = self.date_max = None
+
+    def __call__(self, entry):
+        # Always show folders
+        if entry.is_dir:
+            return True
+            
+        # Check file type filter
+        if self.type_filter != "All":
+            if entry.type != self.type_filter:
+                return False
+        
+        # Check size filter (only for files)
+        if not (self.size_min <= entry.size <= self.size_max):
+            return False
+        
+        # Check date filter
+        if self.date_min is not None:
+            if not (self.date_min <= entry.modified <= self.date_max):
+                return False
+        
+        return True
+
+
+# Seconds between checks of the current directory when inotify is unavailable
+WATCH_POLL_INTERVAL = 2.0
+
+
+class InotifyWatcher:
+    """Watch one directory with Linux inotify, called through ctypes.
+
+    ``callback(path, name)`` is invoked from a background thread for every
+    entry that was created, deleted, modified or renamed in the watched
+    directory. ``name`` is None when the whole directory has to be listed
+    again (the directory itself went away or the event queue overflowed).
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self, callback):
+        # Imported here so platforms without inotify never pay for ctypes
+        import ctypes
+        import ctypes.util
+        self.callback = callback
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.lock = threading.Lock()
+        self.wd = None
+        self.path = None
+        
+        # Pipe used to wake the reader thread when stopping
+        self.wake_r, self.wake_w = os.pipe()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, path):
+        """Watch path instead of the previously watched directory"""
+        with self.lock:
+            self._unwatch()
+            if path is None:
+                return
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+            if wd < 0:
+                import ctypes
+                errno = ctypes.get_errno()
+                print(f"Error watching {path}: {os.strerror(errno)}")
+                return
+            self.wd = wd
+            self.path = path
+
+    def _unwatch(self):
+        if self.wd is not None:
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+        self.wd = None
+        self.path = None
+
+    def stop(self):
+        with self.lock:
+            self._unwatch()
+        os.write(self.wake_w, b'x')
+
+    def _run(self):
+        while True:
+            readable, _, _ = select.select([self.fd, self.wake_r], [], [])
+            if self.wake_r in readable:
+                break
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                continue
+            
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                offset += 16
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                with self.lock:
+                    path = self.path if wd == self.wd else None
+                if mask & self.IN_Q_OVERFLOW:
+                    path = self.path
+                    name = b''
+                if path is None or mask & self.IN_IGNORED:
+                    continue
+                if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    name = b''
+                self.callback(path, os.fsdecode(name) if name else None)
+        os.close(self.fd)
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+
+class PollingWatcher:
+    """Watch one directory by polling its mtime.
+
+    Used where inotify is not available. The directory is only listed again
+    when its own mtime changes, so entries that are created, deleted or
+    renamed are reported, while in-place modifications of existing files
+    are only noticed together with one of those.
+    """
+
+    def __init__(self, callback, interval=WATCH_POLL_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.path = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, path):
+        with self.lock:
+            self.path = path
+            self.mtime_ns = None
+            self.listing = None
+
+    def stop(self):
+        self.stopped.set()
+
+    def _list(self, path):
+        listing = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    stats = entry.stat()
+                    listing[entry.name] = (stats.st_mtime_ns, stats.st_size)
+                except OSError:
+                    listing[entry.name] = None
+        return listing
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                path, mtime_ns, listing = self.path, self.mtime_ns, self.listing
+            if path is None:
+                continue
+            try:
+                new_mtime_ns = os.stat(path).st_mtime_ns
+                if new_mtime_ns == mtime_ns:
+                    continue
+                new_listing = self._list(path)
+            except OSError:
+                self.callback(path, None)
+                new_mtime_ns, new_listing = None, None
+            else:
+                if listing is not None:
+                    for name in listing.keys() | new_listing.keys():
+                        if listing.get(name) != new_listing.get(name):
+                            self.callback(path, name)
+            with self.lock:
+                if self.path == path:
+                    self.mtime_ns, self.listing = new_mtime_ns, new_listing
+
+
+def create_directory_watcher(callback):
+    """Return an inotify watcher on Linux, or a polling watcher elsewhere"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(callback)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, polling for changes: {str(e)}")
+    return PollingWatcher(callback)
+
+
+# Seconds between incremental refreshes of the filename index
+INDEX_REFRESH_SECONDS = 900
+
+# Number of search results handed to the view at a time
+SEARCH_BATCH_SIZE = 500
+
+
+def name_matcher(pattern):
+    """Return (matches, literal) for a filename search pattern.
+
+    Patterns containing *, ? or [ are matched as globs against the whole
+    name, anything else as a case-insensitive substring. ``literal`` is the
+    longest fixed part of the pattern, usable to narrow an index lookup.
+    """
+    if any(c in pattern for c in '*?['):
+        regex = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+        # Character classes match one of several characters, none is required
+        fixed = re.sub(r'\[!?\]?[^\]]*\]', '*', pattern)
+        literal = max(re.split(r'[*?]', fixed), key=len)
+        return regex.match, literal
+    folded = pattern.casefold()
+    return (lambda name: folded in name.casefold()), pattern
+
+
+class FilenameIndex:
+    """On-disk index of file and folder names for fast searching.
+
+    Names are stored per directory together with the directory mtime, and
+    an FTS5 trigram table over the names answers substring queries without
+    scanning the whole table. Refreshing only lists directories whose mtime
+    changed since the previous scan. Each thread uses its own connection.
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(get_cache_dir(), 'filenames.db')
+        self.db_path = db_path
+        self.local = threading.local()
+        self.indexing = False
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            db = self.connect()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error opening filename index {db_path}: {str(e)}")
+            self.db_path = 'file:filenames?mode=memory&cache=shared'
+            db = self.connect()
+        
+        db.execute("""CREATE TABLE IF NOT EXISTS dirs (
+                          id INTEGER PRIMARY KEY,
+                          path TEXT UNIQUE NOT NULL,
+                          mtime_ns INTEGER NOT NULL)""")
+        db.execute("""CREATE TABLE IF NOT EXISTS names (
+                          id INTEGER PRIMARY KEY,
+                          dir_id INTEGER NOT NULL,
+                          name TEXT NOT NULL,
+                          is_dir INTEGER NOT NULL,
+                          size INTEGER NOT NULL,
+                          mtime REAL NOT NULL)""")
+        db.execute("CREATE INDEX IF NOT EXISTS names_dir ON names (dir_id)")
+        try:
+            db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS names_fts USING fts5(
+                              name, content='names', content_rowid='id', tokenize='trigram')""")
+            db.execute("""CREATE TRIGGER IF NOT EXISTS names_ai AFTER INSERT ON names BEGIN
+                              INSERT INTO names_fts (rowid, name) VALUES (new.id, new.name);
+                          END""")
+            db.execute("""CREATE TRIGGER IF NOT EXISTS names_ad AFTER DELETE ON names BEGIN
+                              INSERT INTO names_fts (names_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                          END""")
+            self.has_trigrams = True
+        except sqlite3.Error:
+            # SQLite without FTS5 trigrams, fall back to LIKE scans
+            self.has_trigrams = False
+        db.commit()
+
+    def connect(self):
+        """Return the connection for the calling thread"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, uri=self.db_path.startswith('file:'))
+            if not self.db_path.startswith('file:'):
+                db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def refresh(self, roots, cancelled=None):
+        """Bring the index up to date for the given root folders"""
+        self.indexing = True
+        try:
+            for root in roots:
+                if cancelled is not None and cancelled():
+                    break
+                self._refresh_root(root, cancelled)
+        finally:
+            self.indexing = False
+
+    def _refresh_root(self, root, cancelled):
+        db = self.connect()
+        try:
+            root_dev = os.stat(root).st_dev
+        except OSError:
+            return
+        stack = [root]
+        visited = 0
+        while stack:
+            if cancelled is not None and cancelled():
+                break
+            path = stack.pop()
+            try:
+                stats = os.stat(path)
+            except OSError:
+                continue
+            # Other filesystems mounted below the root are indexed as their own roots
+            if stats.st_dev != root_dev:
+                continue
+            
+            row = db.execute("SELECT id, mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[1] == stats.st_mtime_ns:
+                subdirs = [name for name, in db.execute(
+                    "SELECT name FROM names WHERE dir_id = ? AND is_dir = 1", (row[0],))]
+            else:
+                subdirs = self._index_directory(db, path, row, stats.st_mtime_ns)
+            stack.extend(os.path.join(path, name) for name in subdirs)
+            
+            visited += 1
+            if visited % 200 == 0:
+                db.commit()
+        db.commit()
+
+    def _index_directory(self, db, path, row, mtime_ns):
+        """List one directory into the index, returning its subfolder names"""
+        names = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        stats = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    is_dir = stat.S_ISDIR(stats.st_mode)
+                    names.append((entry.name, is_dir, 0 if is_dir else stats.st_size, stats.st_mtime))
+        except OSError:
+            pass
+        
+        if row is None:
+            dir_id = db.execute("INSERT INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                                (path, mtime_ns)).lastrowid
+        else:
+            dir_id = row[0]
+            # Forget subfolders that no longer exist, with everything below them
+            subdirs = {name for name, is_dir, _, _ in names if is_dir}
+            for name, in db.execute("SELECT name FROM names WHERE dir_id = ? AND is_dir = 1",
+                                    (dir_id,)).fetchall():
+                if name not in subdirs:
+                    self._remove_tree(db, os.path.join(path, name))
+            db.execute("DELETE FROM names WHERE dir_id = ?", (dir_id,))
+            db.execute("UPDATE dirs SET mtime_ns = ? WHERE id = ?", (mtime_ns, dir_id))
+        db.executemany("INSERT INTO names (dir_id, name, is_dir, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                       [(dir_id,) + item for item in names])
+        return [name for name, is_dir, _, _ in names if is_dir]
+
+    def _remove_tree(self, db, path):
+        prefix = os.path.join(path, '')
+        dir_ids = [dir_id for dir_id, in db.execute(
+            "SELECT id FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+            (path, prefix, prefix + '\uffff'))]
+        for dir_id in dir_ids:
+            db.execute("DELETE FROM names WHERE dir_id = ?", (dir_id,))
+            db.execute("DELETE FROM dirs WHERE id = ?", (dir_id,))
+
+    def search(self, pattern, classify, scope=None, cancelled=None):
+        """Yield lists of FileEntry objects whose name matches pattern.
+
+        Patterns containing *, ? or [ are matched as globs against the whole
+        name, anything else as a case-insensitive substring. Result names are
+        full paths. ``scope`` limits results to one folder tree.
+        """
+        db = self.connect()
+        matches, literal = name_matcher(pattern)
+        
+        sql = ("SELECT d.path, n.name, n.is_dir, n.size, n.mtime FROM names n "
+               "JOIN dirs d ON d.id = n.dir_id")
+        params = []
+        if self.has_trigrams and len(literal) >= 3:
+            sql += " WHERE n.id IN (SELECT rowid FROM names_fts WHERE names_fts MATCH ?)"
+            params.append('"' + literal.replace('"', '""') + '"')
+        else:
+            escaped = literal.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            sql += " WHERE n.name LIKE ? ESCAPE '\\'"
+            params.append(f"%{escaped}%")
+        if scope is not None:
+            prefix = os.path.join(scope, '')
+            sql += " AND (d.path = ? OR (d.path >= ? AND d.path < ?))"
+            params += [scope, prefix, prefix + '\uffff']
+        
+        batch = []
+        for dir_path, name, is_dir, size, mtime in db.execute(sql, params):
+            if cancelled is not None and cancelled():
+                return
+            if not matches(name):
+                continue
+            full_path = os.path.join(dir_path, name)
+            batch.append(FileEntry(full_path, full_path, bool(is_dir), size, mtime,
+                                   classify(full_path, bool(is_dir))))
+            if len(batch) >= SEARCH_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# Files larger than this are skipped by content search, in bytes
+CONTENT_SEARCH_MAX_SIZE = 64 * 1024 * 1024
+
+# Number of files handed to a content search process at a time
+CONTENT_SEARCH_CHUNK = 64
+
+# Matches reported per file and characters of each line preview
+CONTENT_MATCHES_PER_FILE = 100
+CONTENT_PREVIEW_CHARS = 120
+
+
+def grep_file(path, regex, max_size=CONTENT_SEARCH_MAX_SIZE):
+    """Return (size, mtime, [(line_number, preview), ...]) for one file.
+
+    The file is memory-mapped instead of read, binary files (a NUL byte in
+    the first 8 KB) and files over max_size are skipped.
+    """
+    with open(path, 'rb') as f:
+        stats = os.fstat(f.fileno())
+        if stats.st_size == 0 or stats.st_size > max_size:
+            return stats.st_size, stats.st_mtime, []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data.find(b'\0', 0, 8192) != -1:
+                return stats.st_size, stats.st_mtime, []
+            matches = []
+            line_number = 1
+            counted = 0
+            for match in regex.finditer(data):
+                start = match.start()
+                line_start = data.rfind(b'\n', 0, start) + 1
+                if line_start < counted:
+                    continue  # Another match on a line already reported
+                line_number += data[counted:line_start].count(b'\n')
+                line_end = data.find(b'\n', start)
+                if line_end == -1:
+                    line_end = len(data)
+                line = data[line_start:min(line_end, line_start + CONTENT_PREVIEW_CHARS * 4)]
+                preview = line.decode('utf-8', errors='replace').strip()[:CONTENT_PREVIEW_CHARS]
+                matches.append((line_number, preview))
+                counted = line_end + 1
+                line_number += 1
+                if len(matches) >= CONTENT_MATCHES_PER_FILE:
+                    break
+            return stats.st_size, stats.st_mtime, matches
+
+
+def grep_files(paths, pattern, ignore_case=True):
+    """Search a chunk of files for pattern; runs in a worker process"""
+    regex = re.compile(re.escape(pattern.encode('utf-8')), re.IGNORECASE if ignore_case else 0)
+    results = []
+    for path in paths:
+        try:
+            size, mtime, matches = grep_file(path, regex)
+        except (OSError, ValueError):
+            continue
+        if matches:
+            results.append((path, size, mtime, matches))
+    return results
+
+
+def iter_content_candidates(root, classify, type_filter="All", max_size=CONTENT_SEARCH_MAX_SIZE):
+    """Yield chunks of file paths below root worth searching for content"""
+    chunk = []
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        if entry.stat(follow_symlinks=False).st_size > max_size:
+                            continue
+                    except OSError:
+                        continue
+                    if type_filter != "All" and classify(entry.path, False) != type_filter:
+                        continue
+                    chunk.append(entry.path)
+                    if len(chunk) >= CONTENT_SEARCH_CHUNK:
+                        yield chunk
+                        chunk = []
+        except OSError:
+            continue
+    if chunk:
+        yield chunk
+
+
+def _chunk_results(done):
+    results = []
+    for future in done:
+        try:
+            results.extend(future.result())
+        except Exception as e:
+            print(f"Error in worker process: {str(e)}")
+    return results
+
+
+def pool_context():
+    """Return a process start method that is safe from a process running threads"""
+    # Forking the GUI could copy a lock held by one of its threads
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def iter_pool_results(func, chunks, cancelled=None, workers=None):
+    """Yield lists of results of func over chunks as a process pool finishes them.
+
+    Chunks are submitted from this thread with a bounded number in flight,
+    so a long stream of chunks never piles up in memory. ``func`` must be
+    importable at module level, the workers do not fork this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    cancelled = cancelled or (lambda: False)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+    pending = set()
+    try:
+        for chunk in chunks:
+            if cancelled():
+                return
+            pending.add(executor.submit(func, chunk))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results = _chunk_results(done)
+                if results:
+                    yield results
+        while pending and not cancelled():
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            results = _chunk_results(done)
+            if results:
+                yield results
+    finally:
+        executor.shutdown(wait=not pending, cancel_futures=True)
+
+
+def iter_content_matches(root, pattern, classify, type_filter="All", cancelled=None, workers=None):
+    """Yield lists of (path, size, mtime, matches) for files below root"""
+    chunks = iter_content_candidates(root, classify, type_filter)
+    return iter_pool_results(partial(grep_files, pattern=pattern), chunks, cancelled, workers)
+
+
+class Volume(namedtuple("Volume", "path kind short")):
+    """A mounted volume: root path, kind label and short name ("C:", "/home")"""
+    __slots__ = ()
+
+
+class WindowsVolumeBackend:
+    """Drive letters from GetLogicalDrives and GetDriveTypeW"""
+
+    DRIVE_KINDS = {
+        2: "Removable Drive",  # DRIVE_REMOVABLE
+        3: "Local Disk",       # DRIVE_FIXED
+        4: "Network Drive",    # DRIVE_REMOTE
+        5: "CD/DVD Drive",     # DRIVE_CDROM
+    }
+
+    def __init__(self):
+        import ctypes
+        self.kernel32 = ctypes.windll.kernel32
+
+    def list_volumes(self):
+        volumes = []
+        bitmask = self.kernel32.GetLogicalDrives()
+        for letter in string.ascii_uppercase:
+            if bitmask & 1:
+                drive_path = f"{letter}:\\"
+                try:
+                    drive_type = self.kernel32.GetDriveTypeW(drive_path)
+                    # Include all drive types except DRIVE_NO_ROOT_DIR (1)
+                    if drive_type > 1:
+                        volumes.append(Volume(drive_path, self.DRIVE_KINDS.get(drive_type, "Drive"),
+                                              f"{letter}:"))
+                except Exception:
+                    pass
+            bitmask >>= 1
+        return volumes
+
+    def get_label(self, path):
+        import ctypes
+        volume_name_buffer = ctypes.create_unicode_buffer(1024)
+        file_system_name_buffer = ctypes.create_unicode_buffer(1024)
+        self.kernel32.GetVolumeInformationW(
+            path,
+            volume_name_buffer,
+            ctypes.sizeof(volume_name_buffer),
+            None, None, None,
+            file_system_name_buffer,
+            ctypes.sizeof(file_system_name_buffer)
+        )
+        return volume_name_buffer.value
+
+
+def _unescape_mount_field(value):
+    # mountinfo escapes space, tab, newline and backslash as octal
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), value)
+
+
+class LinuxVolumeBackend:
+    """Mounts parsed from /proc/self/mountinfo.
+
+    The parsed list is cached and only read again when polling
+    /proc/self/mounts reports that the mount table changed. Pseudo and
+    system filesystems are hidden; the rest are classified as local,
+    removable, optical or network volumes.
+    """
+
+    PSEUDO_FS = frozenset([
+        'proc', 'sysfs', 'devtmpfs', 'devpts', 'tmpfs', 'ramfs', 'cgroup', 'cgroup2',
+        'securityfs', 'pstore', 'debugfs', 'tracefs', 'configfs', 'fusectl', 'mqueue',
+        'hugetlbfs', 'bpf', 'autofs', 'binfmt_misc', 'efivarfs', 'rpc_pipefs', 'nsfs',
+        'squashfs', 'overlay', 'selinuxfs', 'fuse.gvfsd-fuse', 'fuse.portal', 'fuse.lxcfs',
+    ])
+    NETWORK_FS = frozenset([
+        'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'afs', 'ceph', 'glusterfs', 'lustre',
+        'davfs', 'fuse.sshfs', 'fuse.rclone', 'fuse.davfs2', 'fuse.glusterfs', 'fuse.s3fs',
+    ])
+    OPTICAL_FS = frozenset(['iso9660', 'udf'])
+    HIDDEN_PREFIXES = ('/proc', '/sys', '/dev', '/run', '/snap', '/var/lib/docker',
+                       '/var/lib/snapd', '/boot/efi')
+    REMOVABLE_PREFIXES = ('/media', '/run/media')
+
+    def __init__(self):
+        self.volumes = None
+        self.labels = {}
+        self.poller = None
+        try:
+            self.mounts_file = open('/proc/self/mounts')
+            self.poller = select.poll()
+            self.poller.register(self.mounts_file, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            pass
+
+    def mounts_changed(self):
+        """Return True if the mount table changed since it was last read"""
+        if self.volumes is None or self.poller is None:
+            return True
+        return bool(self.poller.poll(0))
+
+    def list_volumes(self):
+        if self.mounts_changed():
+            self.volumes, self.labels = self._read_mountinfo(self._read_labels())
+        return self.volumes
+
+    def get_label(self, path):
+        return self.labels.get(path, "")
+
+    def _read_labels(self):
+        """Map device paths to filesystem labels from /dev/disk/by-label"""
+        labels = {}
+        try:
+            for name in os.listdir('/dev/disk/by-label'):
+                device = os.path.realpath(os.path.join('/dev/disk/by-label', name))
+                labels[device] = re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), name)
+        except OSError:
+            pass
+        return labels
+
+    def _is_removable(self, device_number):
+        try:
+            block = os.path.realpath(f'/sys/dev/block/{device_number}')
+        except OSError:
+            return False
+        # Partitions keep the flag on their parent disk
+        for folder in (block, os.path.dirname(block)):
+            try:
+                with open(os.path.join(folder, 'removable')) as f:
+                    return f.read().strip() == '1'
+            except OSError:
+                continue
+        return False
+
+    @staticmethod
+    def _is_under(mount_point, prefixes):
+        """Return True if mount_point is one of prefixes or a folder below one"""
+        return any(mount_point == prefix or mount_point.startswith(prefix + '/')
+                   for prefix in prefixes)
+
+    def _classify(self, mount_point, fs_type, source, device_number):
+        if fs_type in self.PSEUDO_FS:
+            return None
+        if mount_point != '/' and self._is_under(mount_point, self.HIDDEN_PREFIXES) \
+                and not self._is_under(mount_point, ('/run/media',)):
+            return None
+        if fs_type in self.NETWORK_FS or fs_type.startswith('nfs') or source.startswith('//'):
+            return "Network Drive"
+        if fs_type in self.OPTICAL_FS:
+            return "CD/DVD Drive"
+        if not source.startswith('/dev/') and fs_type not in ('zfs', 'btrfs'):
+            return None
+        if self._is_removable(device_number) or self._is_under(mount_point, self.REMOVABLE_PREFIXES):
+            return "Removable Drive"
+        return "Local Disk"
+
+    def _read_mountinfo(self, device_labels):
+        """Return the visible volumes and their labels by mount point"""
+        volumes = []
+        labels = {}
+        seen = set()
+        try:
+            with open('/proc/self/mountinfo') as f:
+                lines = f.readlines()
+        except OSError:
+            return [Volume('/', "Local Disk", '/')], {}
+        
+        for line in lines:
+            fields = line.split()
+            try:
+                separator = fields.index('-', 6)
+                device_number = fields[2]
+                root = _unescape_mount_field(fields[3])
+                mount_point = _unescape_mount_field(fields[4])
+                fs_type = fields[separator + 1]
+                source = _unescape_mount_field(fields[separator + 2])
+            except (ValueError, IndexError):
+                continue
+            
+            # The same filesystem tree mounted twice (bind mounts) is shown once
+            if (device_number, root) in seen:
+                continue
+            kind = self._classify(mount_point, fs_type, source, device_number)
+            if kind is None:
+                continue
+            seen.add((device_number, root))
+            volumes.append(Volume(mount_point, kind, mount_point))
+            if source.startswith('/dev/'):
+                label = device_labels.get(os.path.realpath(source))
+                if label:
+                    labels[mount_point] = label
+        return volumes, labels
+
+
+class PosixVolumeBackend:
+    """Root filesystem plus /Volumes, for systems without mountinfo"""
+
+    def list_volumes(self):
+        volumes = [Volume('/', "Local Disk", '/')]
+        try:
+            for name in sorted(os.listdir('/Volumes')):
+                path = os.path.join('/Volumes', name)
+                if os.path.ismount(path) and os.path.realpath(path) != '/':
+                    volumes.append(Volume(path, "Drive", path))
+        except OSError:
+            pass
+        return volumes
+
+    def get_label(self, path):
+        return os.path.basename(path) if path != '/' else ""
+
+
+def create_volume_backend():
+    """Return the volume backend for the running platform"""
+    if os.name == 'nt':
+        return WindowsVolumeBackend()
+    if os.path.exists('/proc/self/mountinfo'):
+        return LinuxVolumeBackend()
+    return PosixVolumeBackend()
+
+
+# Seconds a volume probe may take before the volume is shown as unavailable
+VOLUME_PROBE_TIMEOUT = 3.0
+
+# Seconds that probed volume labels and free/total space stay valid
+VOLUME_INFO_TTL = 30.0
+
+
+class VolumeInfo(namedtuple("VolumeInfo", "label total free created")):
+    """Result of probing one volume"""
+    __slots__ = ()
+
+
+class VolumeProber:
+    """Probe volume labels and space in background threads.
+
+    Each probe runs in its own daemon thread because a stale network drive
+    or an empty optical drive can block the call for a long time. A volume
+    whose previous probe is still stuck is not probed again; its answer is
+    posted for the latest generation that asked for it. Results are
+    cached for ``ttl`` seconds and posted to ``result_queue`` as
+    (generation, path, info), with info None if probing failed.
+    """
+
+    def __init__(self, backend, result_queue, ttl=VOLUME_INFO_TTL):
+        self.backend = backend
+        self.result_queue = result_queue
+        self.ttl = ttl
+        self.cache = {}  # path -> (probe time, VolumeInfo)
+        self.running = {}  # path -> latest generation waiting for it
+        self.lock = threading.Lock()
+
+    def cached(self, path):
+        """Return cached info for a volume if it is recent enough"""
+        with self.lock:
+            cached = self.cache.get(path)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        return None
+
+    def busy(self, generation):
+        """Return True while probes asked for by generation have not answered"""
+        with self.lock:
+            return generation in self.running.values()
+
+    def probe(self, path, generation):
+        with self.lock:
+            running = path in self.running
+            self.running[path] = generation
+            if running:
+                return
+        thread = threading.Thread(target=self._probe, args=(path, generation))
+        thread.daemon = True
+        thread.start()
+
+    def _probe(self, path, generation):
+        try:
+            usage = shutil.disk_usage(path)
+            info = VolumeInfo(self.backend.get_label(path), usage.total, usage.free,
+                              os.path.getctime(path))
+        except Exception as e:
+            print(f"Error probing drive {path}: {str(e)}")
+            info = None
+        with self.lock:
+            generation = self.running.pop(path)
+            if info is not None:
+                self.cache[path] = (time.monotonic(), info)
+        self.result_queue.put((generation, path, info))
+
+
+# Number of background threads used to calculate folder sizes
+DEFAULT_SIZE_WORKERS = 4
+
+
+class FolderSizeScheduler:
+    """Fixed-size pool of worker threads that calculate folder sizes.
+
+    Jobs are taken lowest priority first, so rows that are on screen can be
+    moved ahead of the rest. ``size_func(folder, cancelled, progress)``
+    reports partial sizes through ``progress`` while it runs. Every job
+    carries the generation it was submitted in; cancel_all() starts a new
+    generation, which drops pending jobs, stops running walks early and
+    lets the UI discard late results. A job whose size_func raises still
+    posts a final result, with size None.
+    """
+
+    def __init__(self, result_queue, size_func, max_workers=DEFAULT_SIZE_WORKERS):
+        self.result_queue = result_queue
+        self.size_func = size_func
+        self.generation = 0
+        self.pending = []  # heap of [priority, seq, generation, folder, item_id]
+        self.jobs = {}     # item_id -> heap entry, for reprioritizing
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.busy = 0  # workers currently running size_func
+        
+        for _ in range(max(1, max_workers)):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, folder, item_id, priority=0):
+        """Queue a folder size calculation for a tree item"""
+        with self.condition:
+            old_job = self.jobs.get(item_id)
+            if old_job is not None:
+                old_job[4] = None
+            job = [priority, next(self.counter), self.generation, folder, item_id]
+            self.jobs[item_id] = job
+            heapq.heappush(self.pending, job)
+            self.condition.notify()
+
+    def prioritize(self, item_ids):
+        """Move pending jobs for the given items to the front of the queue"""
+        with self.condition:
+            for item_id in item_ids:
+                job = self.jobs.get(item_id)
+                if job is None or job[0] < 0:
+                    continue
+                # Leave the old heap entry behind as a tombstone
+                job[4] = None
+                new_job = [-1, next(self.counter), job[2], job[3], item_id]
+                self.jobs[item_id] = new_job
+                heapq.heappush(self.pending, new_job)
+
+    def cancel_all(self):
+        """Drop all pending work and invalidate running jobs"""
+        with self.condition:
+            self.generation += 1
+            self.pending = []
+            self.jobs = {}
+            return self.generation
+
+    def shutdown(self):
+        """Cancel all work and let the worker threads exit"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.cancel_all()
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, _, generation, folder, item_id = heapq.heappop(self.pending)
+                if item_id is None or generation != self.generation:
+                    continue
+                del self.jobs[item_id]
+                self.busy += 1
+            
+            failed = False
+            try:
+                size = self.size_func(
+                    folder,
+                    lambda: generation != self.generation,
+                    lambda partial: self.result_queue.put((generation, item_id, partial, False)))
+            except Exception as e:
+                # Keep the worker alive and let the caller count the job as done
+                print(f"Error sizing {folder}: {str(e)}")
+                size = None
+                failed = True
+            finally:
+                with self.condition:
+                    self.busy -= 1
+            if (size is not None or failed) and generation == self.generation:
+                self.result_queue.put((generation, item_id, size, True))
+
+
+# Maximum number of folders kept in the on-disk size index
+DEFAULT_SIZE_INDEX_ENTRIES = 200000
+
+# Bumped when the size index columns change, older indexes are rebuilt
+SIZE_INDEX_VERSION = 4
+
+
+def get_cache_dir():
+    """Return the per-user cache directory for the file manager"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'file_manager')
+
+
+class FolderSizeIndex:
+    """Persistent SQLite index of folder sizes.
+
+    Every folder is stored with its own mtime, the apparent and allocated
+    size of the files directly inside it, its hard linked files and the
+    names of its subfolders. A folder whose mtime is unchanged does not
+    have to be listed again, and the least recently used rows are evicted
+    once max_entries is exceeded. Totals are not stored: a change deep
+    below a folder leaves its mtime alone, so they are summed from the
+    rows of the whole subtree, which the walk stats anyway.
+    """
+
+    def __init__(self, db_path=None, max_entries=DEFAULT_SIZE_INDEX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        if db_path is None:
+            db_path = os.path.join(get_cache_dir(), 'folder_sizes.db')
+        try:
+            if db_path != ':memory:':
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self.db = self._connect(db_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error opening size index {db_path}: {str(e)}")
+            self.db = self._connect(':memory:')
+
+    def _connect(self, db_path):
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        if db_path != ':memory:':
+            db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if db.execute("PRAGMA user_version").fetchone()[0] != SIZE_INDEX_VERSION:
+            db.execute("DROP TABLE IF EXISTS folders")
+            db.execute(f"PRAGMA user_version = {SIZE_INDEX_VERSION}")
+        db.execute("""CREATE TABLE IF NOT EXISTS folders (
+                          path TEXT PRIMARY KEY,
+                          mtime_ns INTEGER NOT NULL,
+                          files_size INTEGER NOT NULL,
+                          files_allocated INTEGER NOT NULL,
+                          links TEXT NOT NULL,
+                          subdirs TEXT NOT NULL,
+                          last_used REAL NOT NULL)""")
+        db.execute("CREATE INDEX IF NOT EXISTS folders_last_used ON folders (last_used)")
+        db.commit()
+        return db
+
+    def lookup(self, path):
+        """Return (mtime_ns, files_size, files_allocated, links, subdirs) or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT mtime_ns, files_size, files_allocated, links, subdirs "
+                "FROM folders WHERE path = ?",
+                (path,)).fetchone()
+        if row is None:
+            return None
+        mtime_ns, files_size, files_allocated, links, subdirs = row
+        numbers = [int(n) for n in links.split()]
+        links = list(zip(numbers[0::3], numbers[1::3], numbers[2::3]))
+        return (mtime_ns, files_size, files_allocated, links,
+                subdirs.split('\0') if subdirs else [])
+
+    def store_many(self, rows):
+        """Insert or refresh (path, mtime_ns, files_size, files_allocated, links, subdirs) rows"""
+        if not rows:
+            return
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(path, mtime_ns, files_size, files_allocated,
+                  ' '.join(f"{key} {size} {allocated}" for key, size, allocated in links),
+                  '\0'.join(subdirs), now)
+                 for path, mtime_ns, files_size, files_allocated, links, subdirs in rows])
+            self._evict()
+            self.db.commit()
+
+    def invalidate(self, path):
+        """Forget a folder so its size is recalculated next time"""
+        with self.lock:
+            self.db.execute("DELETE FROM folders WHERE path = ?", (path,))
+            self.db.commit()
+
+    def _evict(self):
+        count = self.db.execute("SELECT COUNT(*) FROM folders").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute(
+                "DELETE FROM folders WHERE path IN "
+                "(SELECT path FROM folders ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,))
+
+
+# Maximum number of folder totals kept in memory
+DEFAULT_SIZE_MEMO_ENTRIES = 500000
+
+# Seconds between partial size updates while a folder is being walked
+SIZE_PROGRESS_INTERVAL = 0.5
+
+
+class FolderSize(namedtuple("FolderSize", "apparent allocated")):
+    """Apparent and allocated bytes of a folder tree, as ``du -b`` and ``du -B1`` count them.
+
+    Files, folders and symbolic links all count with their own size, and
+    a file with several hard links in the tree counts once.
+    """
+    __slots__ = ()
+
+
+def allocated_size(stats):
+    """Return the bytes a file takes on disk, or its size where blocks are not reported"""
+    blocks = getattr(stats, 'st_blocks', None)
+    return stats.st_size if blocks is None else blocks * 512
+
+
+class FolderSizeEngine:
+    """Bottom-up folder size calculation shared by all size workers.
+
+    A single post-order walk computes the total of every folder below the
+    requested one and memoizes each of them in memory, so opening a child
+    folder after its parent has been sized shows the child totals at once.
+    The persistent FolderSizeIndex is used to skip listing folders whose
+    mtime is unchanged.
+
+    Like du, a file with several hard links is counted once per folder
+    total, and folders and symbolic links count with their own size, so
+    the apparent and allocated totals match ``du -b`` and ``du -B1``.
+    Only files with more than one link are remembered, keyed by device
+    and inode. With one_device the walk does not enter folders on another
+    device, such as mounted network filesystems.
+    """
+
+    def __init__(self, index, max_memo_entries=DEFAULT_SIZE_MEMO_ENTRIES, one_device=False):
+        self.index = index
+        self.max_memo_entries = max_memo_entries
+        self.one_device = one_device
+        self.memo = OrderedDict()  # path -> (mtime, FolderSize)
+        self.memo_lock = threading.Lock()
+
+    def set_one_device(self, one_device):
+        """Switch one device mode, dropping the memoized totals of the other mode"""
+        with self.memo_lock:
+            self.one_device = one_device
+            self.memo.clear()
+
+    def cached_size(self, path, mtime):
+        """Return the memoized size of a folder if its mtime still matches"""
+        usage = self.cached_usage(path, mtime)
+        return None if usage is None else usage.apparent
+
+    def cached_usage(self, path, mtime):
+        """Return the memoized FolderSize of a folder if its mtime still matches"""
+        with self.memo_lock:
+            cached = self.memo.get(path)
+            if cached is None or cached[0] != mtime:
+                return None
+            self.memo.move_to_end(path)
+            return cached[1]
+
+    def forget(self, path):
+        """Drop memoized sizes for a folder, its descendants and its ancestors"""
+        self.forget_many([path], [path])
+
+    def forget_many(self, paths, folders=()):
+        """Drop memoized sizes for changed paths and their ancestors.
+
+        Descendants are only dropped for the paths in ``folders``, with a
+        single pass over the memo for all of them.
+        """
+        prefixes = tuple(os.path.join(folder, '') for folder in folders)
+        with self.memo_lock:
+            dropped = set()
+            for path in paths:
+                self.memo.pop(path, None)
+                parent = os.path.dirname(path)
+                # Changed paths usually share their ancestors
+                while parent and parent != path and parent not in dropped:
+                    dropped.add(parent)
+                    self.memo.pop(parent, None)
+                    path, parent = parent, os.path.dirname(parent)
+            if prefixes:
+                for key in [k for k in self.memo if k.startswith(prefixes)]:
+                    del self.memo[key]
+
+    def _remember(self, path, mtime, usage):
+        with self.memo_lock:
+            self.memo[path] = (mtime, usage)
+            self.memo.move_to_end(path)
+            while len(self.memo) > self.max_memo_entries:
+                self.memo.popitem(last=False)
+
+    def _enter(self, path, device):
+        """Return a walk frame for a folder, listing it only if it changed"""
+        try:
+            stats = os.stat(path)
+        except OSError:
+            return None
+        profiler.count("syscalls.stat")
+        if device is not None and stats.st_dev != device:
+            profiler.count("size.other_device")
+            return None
+        cached = self.index.lookup(path)
+        if cached is not None and cached[0] == stats.st_mtime_ns:
+            _, files_size, files_allocated, links, subdirs = cached
+            profiler.count("size.index_hits")
+        else:
+            files_size = files_allocated = 0
+            links = []  # (device << 64 | inode, size, allocated) of hard linked files
+            subdirs = []
+            files = 0
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_symlink():
+                                # Not followed, but the link itself takes space
+                                link_stats = entry.stat(follow_symlinks=False)
+                                files_size += link_stats.st_size
+                                files_allocated += allocated_size(link_stats)
+                                files += 1
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                                continue
+                            file_stats = entry.stat(follow_symlinks=False)
+                            files += 1
+                        except (OSError, PermissionError):
+                            continue
+                        if file_stats.st_nlink > 1:
+                            links.append((file_stats.st_dev << 64 | file_stats.st_ino,
+                                          file_stats.st_size, allocated_size(file_stats)))
+                        else:
+                            files_size += file_stats.st_size
+                            files_allocated += allocated_size(file_stats)
+            except (OSError, PermissionError):
+                pass
+            profiler.count("syscalls.scandir")
+            profiler.count("syscalls.stat", files)
+        
+        # Hard linked files met so far in this subtree, counted once each
+        seen = {}
+        # The folder itself is counted too
+        apparent, allocated = files_size + stats.st_size, files_allocated + allocated_size(stats)
+        for key, size, size_allocated in links:
+            if key not in seen:
+                seen[key] = (size, size_allocated)
+                apparent += size
+                allocated += size_allocated
+        # [path, mtime, mtime_ns, listing, subdirs, next_child, apparent, allocated, seen]
+        return [path, stats.st_mtime, stats.st_mtime_ns, (files_size, files_allocated, links),
+                subdirs, 0, apparent, allocated, seen]
+
+    @staticmethod
+    def _add_child(frame, child):
+        """Add a finished subfolder to its parent's totals, counting shared links once"""
+        seen, child_seen = frame[8], child[8]
+        if len(child_seen) > len(seen):
+            # Merge the smaller set into the larger one
+            seen, child_seen = child_seen, seen
+            frame[8] = seen
+        for key, sizes in child_seen.items():
+            if key in seen:
+                frame[6] -= sizes[0]
+                frame[7] -= sizes[1]
+            else:
+                seen[key] = sizes
+        frame[6] += child[6]
+        frame[7] += child[7]
+
+    def folder_size(self, folder, cancelled=None, progress=None, device=None):
+        """Calculate the apparent total size of a folder, or None if cancelled"""
+        usage = self.folder_usage(folder, cancelled, progress, device)
+        return None if usage is None else usage.apparent
+
+    def folder_usage(self, folder, cancelled=None, progress=None, device=None):
+        """Calculate the FolderSize of a folder, or None if cancelled.
+
+        ``progress(size)`` is called every SIZE_PROGRESS_INTERVAL seconds
+        with the number of bytes found so far. In one device mode the walk
+        stays on ``device``, by default the device of the folder itself.
+        """
+        if not self.one_device:
+            device = None
+        elif device is None:
+            try:
+                device = os.stat(folder).st_dev
+            except OSError:
+                return FolderSize(0, 0)
+        with profiler.span("folder_size"):
+            return self._folder_size(folder, cancelled, progress, device)
+
+    def _folder_size(self, folder, cancelled, progress, device):
+        root = self._enter(folder, device)
+        if root is None:
+            return FolderSize(0, 0)
+        
+        rows = []
+        stack = [root]
+        usage = None
+        next_progress = time.monotonic() + SIZE_PROGRESS_INTERVAL
+        while stack:
+            if cancelled is not None and cancelled():
+                self.index.store_many(rows)
+                return None
+            frame = stack[-1]
+            path, mtime, mtime_ns, listing, subdirs, next_child, apparent, allocated, _ = frame
+            if next_child < len(subdirs):
+                frame[5] += 1
+                child = self._enter(os.path.join(path, subdirs[next_child]), device)
+                if child is not None:
+                    stack.append(child)
+                if progress is not None and time.monotonic() >= next_progress:
+                    progress(sum(f[6] for f in stack))
+                    next_progress = time.monotonic() + SIZE_PROGRESS_INTERVAL
+                continue
+            
+            # All children done, the folder total is final
+            stack.pop()
+            self._remember(path, mtime, FolderSize(apparent, allocated))
+            rows.append((path, mtime_ns) + listing + (subdirs,))
+            if stack:
+                self._add_child(stack[-1], frame)
+            else:
+                usage = FolderSize(apparent, allocated)
+            if len(rows) >= 1000:
+                self.index.store_many(rows)
+                rows = []
+        self.index.store_many(rows)
+        return usage
+
+
+# Files smaller than this are copied in parallel, larger ones one at a time
+LARGE_FILE_BYTES = 4 * 1024 * 1024
+
+# Number of threads copying small files at once
+DEFAULT_COPY_WORKERS = 8
+
+# Small files handed to a copy thread at a time
+COPY_BATCH_FILES = 64
+
+# Number of threads unlinking files of a delete job
+DEFAULT_DELETE_WORKERS = 8
+
+# Bytes moved per copy_file_range / sendfile / read call
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Seconds between progress reports of a running file operation
+OPERATION_PROGRESS_INTERVAL = 0.1
+
+
+def remove_tree(path):
+    """Delete a folder tree without recursion, returning the number of entries removed.
+
+    Unlike shutil.rmtree this does not hit the recursion limit on very deep
+    trees. Symbolic links are removed, never followed.
+    """
+    removed = 0
+    stack = [(path, False)]
+    while stack:
+        folder, emptied = stack.pop()
+        if emptied:
+            os.rmdir(folder)
+            removed += 1
+            continue
+        stack.append((folder, True))
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                else:
+                    os.unlink(entry.path)
+                    removed += 1
+    return removed
+
+
+class OperationCancelled(Exception):
+    """Raised inside a file operation once it has been cancelled"""
+
+
+JobProgress = namedtuple("JobProgress",
+                         "job_id operation done_bytes total_bytes done_files total_files "
+                         "finished errors completed")
+
+
+def _copy_fd(fd_in, fd_out, size, progress, cancelled):
+    """Copy everything from fd_in to fd_out, in the kernel when the OS allows it"""
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while True:
+                if cancelled():
+                    raise OperationCancelled()
+                n = os.copy_file_range(fd_in, fd_out, COPY_CHUNK_BYTES)
+                if n == 0:
+                    # Some filesystems report nothing copied instead of failing
+                    if copied or not size:
+                        return
+                    break
+                copied += n
+                progress(n)
+                if copied >= size:
+                    return  # Saves a final call for the many small files
+        except OSError as e:
+            # Not supported for this pair of files, try the next method
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                         errno.EOPNOTSUPP, errno.EPERM):
+                raise
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            while True:
+                if cancelled():
+                    raise OperationCancelled()
+                n = os.sendfile(fd_out, fd_in, copied, COPY_CHUNK_BYTES)
+                if n == 0:
+                    if copied or not size:
+                        return
+                    break
+                copied += n
+                progress(n)
+        except OSError as e:
+            if copied or e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+    while True:
+        if cancelled():
+            raise OperationCancelled()
+        data = os.read(fd_in, COPY_CHUNK_BYTES)
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd_out, view):]
+        progress(len(data))
+
+
+def copy_file(src, dst, stats, progress=None, cancelled=None):
+    """Copy one regular file with its permission bits and timestamps.
+
+    ``stats`` is the lstat result of src. A partly written dst is removed
+    if the copy fails or is cancelled.
+    """
+    progress = progress or (lambda n: None)
+    cancelled = cancelled or (lambda: False)
+    binary = getattr(os, 'O_BINARY', 0)
+    fd_in = os.open(src, os.O_RDONLY | binary)
+    try:
+        fd_out = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | binary,
+                         stat.S_IMODE(stats.st_mode) | stat.S_IWUSR)
+        try:
+            _copy_fd(fd_in, fd_out, stats.st_size, progress, cancelled)
+            if hasattr(os, 'fchmod'):
+                os.fchmod(fd_out, stat.S_IMODE(stats.st_mode))
+            if os.utime in os.supports_fd:
+                os.utime(fd_out, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+        except BaseException:
+            os.close(fd_out)
+            os.unlink(dst)
+            raise
+        os.close(fd_out)
+    finally:
+        os.close(fd_in)
+    if os.utime not in os.supports_fd:
+        os.utime(dst, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+    if not hasattr(os, 'fchmod') and not stats.st_mode & stat.S_IWUSR:
+        os.chmod(dst, stat.S_IMODE(stats.st_mode))
+
+
+def file_digest(path):
+    """Return the BLAKE2 digest of a file's contents"""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(COPY_CHUNK_BYTES)
+            if not data:
+                return digest.digest()
+            digest.update(data)
+
+
+def unique_destination(folder, name):
+    """Return a path in folder for name that does not exist yet"""
+    target = os.path.join(folder, name)
+    if not os.path.lexists(target):
+        return target
+    stem, suffix = os.path.splitext(name)
+    if stem.endswith('.tar'):
+        stem, suffix = stem[:-4], '.tar' + suffix
+    for number in itertools.count(2):
+        target = os.path.join(folder, f"{stem} ({number}){suffix}")
+        if not os.path.lexists(target):
+            return target
+
+
+class FileJob:
+    """Base class of the jobs run by FileOperationQueue.
+
+    Subclasses implement run() and keep the done/total counters up to
+    date through add_done() and add_error(); the queue reads them through
+    progress() from another thread. A total of 0 means it is not known.
+    Sources that are fully processed can be reported early through
+    add_completed().
+    """
+
+    operation = "job"
+
+    def __init__(self):
+        self.job_id = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.done_bytes = 0
+        self.total_bytes = 0
+        self.done_files = 0
+        self.total_files = 0
+        self.errors = []
+        self.completed = []
+        self.changed_folders = set()  # folders whose contents or sizes changed
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def add_bytes(self, n):
+        with self.lock:
+            self.done_bytes += n
+
+    def add_done(self, files=1):
+        with self.lock:
+            self.done_files += files
+
+    def add_error(self, path, error):
+        message = error.strerror if isinstance(error, OSError) and error.strerror else str(error)
+        with self.lock:
+            self.errors.append(f"{path}: {message}")
+
+    def add_completed(self, path):
+        with self.lock:
+            self.completed.append(path)
+
+    def progress(self, finished=False):
+        with self.lock:
+            return JobProgress(self.job_id, self.operation, self.done_bytes, self.total_bytes,
+                               self.done_files, self.total_files, finished, list(self.errors),
+                               list(self.completed))
+
+    def run(self):
+        raise NotImplementedError
+
+
+class CopyJob(FileJob):
+    """Copy or move files and folders into a destination folder.
+
+    A move within one device is a single rename. Otherwise the sources are
+    walked once to plan the work, folders are created, files below
+    LARGE_FILE_BYTES are copied on a pool of threads and larger ones one at
+    a time with zero-copy system calls. With verify=True every copy is
+    compared with its source afterwards, and a move only deletes its
+    sources once all copies succeeded.
+    """
+
+    def __init__(self, operation, sources, destination, verify=False,
+                 workers=DEFAULT_COPY_WORKERS):
+        super().__init__()
+        if operation not in ("copy", "move"):
+            raise ValueError(f"Unknown file operation {operation}")
+        self.operation = operation
+        self.sources = [os.path.abspath(source) for source in sources]
+        self.destination = os.path.abspath(destination)
+        self.verify = verify
+        self.workers = max(1, workers)
+
+    def run(self):
+        self.changed_folders.add(self.destination)
+        dest_dev = os.stat(self.destination).st_dev
+        dirs, files, links, copied_sources = [], [], [], []
+        for source in self.sources:
+            if self.cancelled():
+                return
+            try:
+                source_stats = os.lstat(source)
+            except OSError as e:
+                self.add_error(source, e)
+                continue
+            if self.operation == "move" and os.path.dirname(source) == self.destination:
+                continue  # Already there
+            prefix = os.path.join(source, '')
+            if self.destination == source or self.destination.startswith(prefix):
+                self.add_error(source, "Cannot copy a folder into itself")
+                continue
+            target = unique_destination(self.destination, os.path.basename(source))
+
+            # Same device: moving is just a rename
+            if self.operation == "move" and source_stats.st_dev == dest_dev:
+                with self.lock:
+                    self.total_files += 1
+                try:
+                    os.rename(source, target)
+                    self.changed_folders.add(os.path.dirname(source))
+                    self.add_done()
+                except OSError as e:
+                    self.add_error(source, e)
+                continue
+            self._plan(source, source_stats, target, dirs, files, links)
+            copied_sources.append(source)
+
+        self._copy(dirs, files, links)
+        if self.verify and not self.cancelled():
+            self._verify(files)
+        if self.operation == "move" and copied_sources and not self.errors and not self.cancelled():
+            for source in copied_sources:
+                self._remove_source(source)
+                self.changed_folders.add(os.path.dirname(source))
+
+    def _plan(self, source, source_stats, target, dirs, files, links):
+        """Walk one source, collecting (src, dst, stats) for folders, files and links"""
+        stack = [(source, source_stats, target)]
+        while stack:
+            src, stats, dst = stack.pop()
+            if stat.S_ISLNK(stats.st_mode):
+                links.append((src, dst, stats))
+            elif stat.S_ISDIR(stats.st_mode):
+                dirs.append((src, dst, stats))
+                try:
+                    with os.scandir(src) as it:
+                        for entry in it:
+                            try:
+                                child_stats = entry.stat(follow_symlinks=False)
+                            except OSError as e:
+                                self.add_error(entry.path, e)
+                                continue
+                            stack.append((entry.path, child_stats, os.path.join(dst, entry.name)))
+                except OSError as e:
+                    self.add_error(src, e)
+            elif stat.S_ISREG(stats.st_mode):
+                files.append((src, dst, stats))
+            else:
+                self.add_error(src, "Not a regular file, skipped")
+                continue
+            with self.lock:
+                self.total_files += 1
+                self.total_bytes += stats.st_size if stat.S_ISREG(stats.st_mode) else 0
+
+    def _copy_batch(self, batch):
+        for src, dst, stats in batch:
+            if self.cancelled():
+                return
+            try:
+                copy_file(src, dst, stats, self.add_bytes, self.cancelled)
+                self.add_done()
+            except OperationCancelled:
+                return
+            except OSError as e:
+                self.add_error(src, e)
+
+    def _copy(self, dirs, files, links):
+        # Parents are planned before their children
+        for src, dst, stats in dirs:
+            if self.cancelled():
+                return
+            try:
+                os.mkdir(dst, stat.S_IMODE(stats.st_mode) | stat.S_IRWXU)
+                self.add_done()
+            except OSError as e:
+                self.add_error(src, e)
+
+        small_pool = ThreadPoolExecutor(max_workers=self.workers)
+        large_pool = ThreadPoolExecutor(max_workers=1)
+        pending = set()
+        batch = []
+        try:
+            for item in files:
+                if self.cancelled():
+                    break
+                if item[2].st_size >= LARGE_FILE_BYTES:
+                    pending.add(large_pool.submit(self._copy_batch, [item]))
+                else:
+                    batch.append(item)
+                    if len(batch) < COPY_BATCH_FILES:
+                        continue
+                    pending.add(small_pool.submit(self._copy_batch, batch))
+                    batch = []
+                if len(pending) >= self.workers * 4:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if batch:
+                pending.add(small_pool.submit(self._copy_batch, batch))
+            wait(pending)
+        finally:
+            small_pool.shutdown(wait=True, cancel_futures=True)
+            large_pool.shutdown(wait=True, cancel_futures=True)
+
+        for src, dst, stats in links:
+            if self.cancelled():
+                return
+            try:
+                os.symlink(os.readlink(src), dst)
+                self.add_done()
+            except OSError as e:
+                self.add_error(src, e)
+
+        # Folder times last, as creating their contents changed them
+        for src, dst, stats in reversed(dirs):
+            try:
+                os.utime(dst, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+                os.chmod(dst, stat.S_IMODE(stats.st_mode))
+            except OSError:
+                continue
+
+    def _verify_one(self, src, dst, stats):
+        try:
+            if os.path.getsize(dst) != stats.st_size or file_digest(src) != file_digest(dst):
+                self.add_error(dst, "Copy differs from the original")
+        except OSError as e:
+            self.add_error(dst, e)
+
+    def _verify(self, files):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for src, dst, stats in files:
+                if self.cancelled():
+                    break
+                pool.submit(self._verify_one, src, dst, stats)
+
+    def _remove_source(self, source):
+        """Delete a source tree after it was copied to another device"""
+        try:
+            if os.path.isdir(source) and not os.path.islink(source):
+                remove_tree(source)
+            else:
+                os.unlink(source)
+        except OSError as e:
+            self.add_error(source, e)
+
+
+class DeleteJob(FileJob):
+    """Delete files and folder trees, unlinking on a pool of threads.
+
+    Every folder is listed and emptied by its own task, so separate
+    subtrees are deleted in parallel, and a folder is removed as soon as
+    all of its subfolders are. Sources that are completely gone are listed
+    in ``completed`` while the rest of the job is still running.
+    """
+
+    operation = "delete"
+
+    def __init__(self, sources, workers=DEFAULT_DELETE_WORKERS):
+        super().__init__()
+        self.sources = [os.path.abspath(source) for source in sources]
+        self.workers = max(1, workers)
+        self.idle = threading.Condition()
+        self.outstanding = 0  # folder tasks queued or running
+
+    def run(self):
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for source in self.sources:
+                if self.cancelled():
+                    break
+                self.changed_folders.add(os.path.dirname(source))
+                try:
+                    stats = os.lstat(source)
+                    if not stat.S_ISDIR(stats.st_mode):
+                        os.unlink(source)
+                except OSError as e:
+                    self.add_error(source, e)
+                    continue
+                if stat.S_ISDIR(stats.st_mode):
+                    self._submit(pool, source, None)
+                else:
+                    self.add_bytes(stats.st_size)
+                    self.add_done()
+                    self.add_completed(source)
+            with self.idle:
+                while self.outstanding:
+                    self.idle.wait()
+        finally:
+            pool.shutdown(wait=True)
+
+    def _submit(self, pool, folder, parent):
+        with self.idle:
+            self.outstanding += 1
+        pool.submit(self._run_task, pool, folder, parent)
+
+    def _run_task(self, pool, folder, parent):
+        try:
+            self._delete_folder(pool, folder, parent)
+        except Exception as e:
+            self.add_error(folder, e)
+        finally:
+            with self.idle:
+                self.outstanding -= 1
+                if not self.outstanding:
+                    self.idle.notify_all()
+
+    def _delete_folder(self, pool, folder, parent):
+        """Unlink the files of one folder and queue its subfolders"""
+        # [path, parent node, parts left]; the listing itself is one part
+        node = [folder, parent, 1]
+        subfolders = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if self.cancelled():
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(entry.path)
+                            continue
+                        size = entry.stat(follow_symlinks=False).st_size
+                        os.unlink(entry.path)
+                    except OSError as e:
+                        self.add_error(entry.path, e)
+                        continue
+                    self.add_bytes(size)
+                    self.add_done()
+        except OSError as e:
+            self.add_error(folder, e)
+        
+        with self.idle:
+            node[2] += len(subfolders)
+        for subfolder in subfolders:
+            self._submit(pool, subfolder, node)
+        self._finish_part(node)
+
+    def _finish_part(self, node):
+        """Count one finished part of a folder, removing folders whose parts are all done"""
+        while node is not None:
+            with self.idle:
+                node[2] -= 1
+                if node[2] > 0:
+                    return
+            path, parent = node[0], node[1]
+            if self.cancelled():
+                return
+            try:
+                os.rmdir(path)
+                self.add_done()
+            except OSError as e:
+                self.add_error(path, e)
+                return
+            if parent is None:
+                self.add_completed(path)
+            node = parent
+
+
+class FileOperationQueue:
+    """Runs file operation jobs one after another in a background thread.
+
+    While a job runs, its JobProgress is put on result_queue every
+    OPERATION_PROGRESS_INTERVAL seconds, and a last time with
+    finished=True when it is done, so the UI can poll the queue from
+    root.after like the folder size results.
+    """
+
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+        self.jobs = Queue()
+        self.queued = []
+        self.current = None
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, job):
+        """Queue a job and return its id"""
+        job.job_id = next(self.counter)
+        with self.lock:
+            self.queued.append(job)
+        self.jobs.put(job)
+        return job.job_id
+
+    def cancel(self, job_id=None):
+        """Cancel one job, or the running and all queued jobs"""
+        with self.lock:
+            jobs = self.queued + ([self.current] if self.current else [])
+        for job in jobs:
+            if job_id is None or job.job_id == job_id:
+                job.cancel()
+
+    def pending_count(self):
+        """Number of jobs queued or running"""
+        with self.lock:
+            return len(self.queued) + (1 if self.current else 0)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.queued.remove(job)
+                self.current = job
+            worker = threading.Thread(target=self._run_job, args=(job,))
+            worker.daemon = True
+            worker.start()
+            while worker.is_alive():
+                worker.join(OPERATION_PROGRESS_INTERVAL)
+                if worker.is_alive():
+                    self.result_queue.put(job.progress())
+            with self.lock:
+                self.current = None
+            self.result_queue.put(job.progress(finished=True))
+
+    def _run_job(self, job):
+        try:
+            with profiler.span(f"operation.{job.operation}"):
+                job.run()
+        except Exception as e:
+            job.add_error(job.operation, e)
+
+
+# Suffixes of archives that are browsed as folders
+ARCHIVE_SUFFIXES = ('.zip', '.jar', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+                    '.tar.xz', '.txz')
+
+# Number of parsed archive indexes kept in memory
+ARCHIVE_CACHE_ENTRIES = 8
+
+# Magic numbers of the compressions tarfile can read
+_COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def split_archive_path(path):
+    """Return (archive, inner folder) for a path at or inside an archive, else None.
+
+    Paths inside an archive continue the archive path with the member
+    names, e.g. /data/logs.zip/2024/app.log; inner paths use "/".
+    """
+    inner = []
+    current = path
+    while True:
+        if is_archive(current) and os.path.isfile(current):
+            return current, "/".join(reversed(inner))
+        parent, name = os.path.split(current)
+        if not name or parent == current:
+            return None
+        inner.append(name)
+        current = parent
+
+
+def _member_parts(name):
+    """Split a member name into path components, or None if it escapes the archive"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+    return parts
+
+
+def _copy_stream(src, out, left, progress, cancelled):
+    """Copy up to left bytes from one file object to another"""
+    while left:
+        if cancelled():
+            raise OperationCancelled()
+        chunk = src.read(min(left, COPY_CHUNK_BYTES))
+        if not chunk:
+            raise OSError(errno.EIO, "Archive member is truncated")
+        out.write(chunk)
+        left -= len(chunk)
+        progress(len(chunk))
+
+
+def _copy_zip_member(f, ref, out, progress, cancelled):
+    """Stream a stored or deflated zip member from its local header"""
+    offset, compress_size, compress_type, crc = ref
+    f.seek(offset)
+    header = f.read(30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        raise OSError(errno.EIO, "Bad zip member header")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(offset + 30 + name_length + extra_length)
+    decompressor = zlib.decompressobj(-15) if compress_type == zipfile.ZIP_DEFLATED else None
+    checksum = 0
+    left = compress_size
+    while left or (decompressor is not None and decompressor.unconsumed_tail):
+        if cancelled():
+            raise OperationCancelled()
+        if decompressor is not None and decompressor.unconsumed_tail:
+            data = decompressor.decompress(decompressor.unconsumed_tail, COPY_CHUNK_BYTES)
+        else:
+            chunk = f.read(min(left, COPY_CHUNK_BYTES))
+            if not chunk:
+                raise OSError(errno.EIO, "Archive member is truncated")
+            left -= len(chunk)
+            data = chunk if decompressor is None else decompressor.decompress(chunk, COPY_CHUNK_BYTES)
+        out.write(data)
+        checksum = zlib.crc32(data, checksum)
+        progress(len(data))
+    if decompressor is not None:
+        data = decompressor.flush()
+        out.write(data)
+        checksum = zlib.crc32(data, checksum)
+        progress(len(data))
+    if checksum != crc:
+        raise OSError(errno.EIO, "Archive member is corrupt (CRC mismatch)")
+
+
+class ArchiveIndex:
+    """Folders and members of a zip or tar archive, read once from its directory.
+
+    Zip archives are indexed from the central directory and tar archives
+    from the member headers, so no file data is decompressed (a compressed
+    tar still has to be decompressed to reach its headers). Each file is
+    kept as (size, mtime, ref): ref is the position of its data when it
+    can be read in place, otherwise its member name.
+    """
+
+    def __init__(self, path, stats=None):
+        stats = stats or os.stat(path)
+        self.path = path
+        self.modified = stats.st_mtime
+        self.folders = {"": {}}   # inner folder -> {name: (size, mtime, ref) or None for folders}
+        self.sizes = {"": 0}      # inner folder -> bytes of all files below it
+        self.folder_times = {}    # inner folder -> mtime, for folders with their own member
+        with profiler.span("archive.index"):
+            if zipfile.is_zipfile(path):
+                self.kind = "zip"
+                self._read_zip()
+            else:
+                self.kind = "tar"
+                self._read_tar()
+
+    def _read_zip(self):
+        times = {}  # date_time -> mtime, members often share timestamps
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                parts = _member_parts(info.filename)
+                if parts is None:
+                    continue
+                mtime = times.get(info.date_time)
+                if mtime is None:
+                    try:
+                        mtime = time.mktime(info.date_time + (0, 0, -1))
+                    except (OverflowError, ValueError):
+                        mtime = self.modified
+                    times[info.date_time] = mtime
+                if info.is_dir():
+                    self._add(parts, None, mtime)
+                    continue
+                if info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) \
+                        and not info.flag_bits & 0x1:
+                    ref = (info.header_offset, info.compress_size, info.compress_type, info.CRC)
+                else:
+                    ref = info.filename  # encrypted or another compression, read through zipfile
+                self._add(parts, (info.file_size, mtime, ref), mtime)
+
+    def _read_tar(self):
+        with open(self.path, 'rb') as f:
+            self.compressed = f.read(6).startswith(_COMPRESSED_MAGIC)
+        with tarfile.open(self.path, 'r|*' if self.compressed else 'r:') as archive:
+            while True:
+                member = archive.next()
+                if member is None:
+                    break
+                # Members are kept in the index, not in the TarFile
+                archive.members = []
+                parts = _member_parts(member.name)
+                if parts is None:
+                    continue
+                if member.isdir():
+                    self._add(parts, None, member.mtime)
+                elif member.isreg():
+                    in_place = not self.compressed and not member.issparse()
+                    ref = member.offset_data if in_place else member.name
+                    self._add(parts, (member.size, member.mtime, ref), member.mtime)
+
+    def _add(self, parts, record, mtime):
+        folder = ""
+        for name in parts[:-1]:
+            folder = self._folder(folder, name)
+        if record is None:
+            self.folder_times[self._folder(folder, parts[-1])] = mtime
+            return
+        if parts[-1] in self.folders[folder] and self.folders[folder][parts[-1]] is None:
+            return  # A folder of the same name wins
+        self.folders[folder][parts[-1]] = record
+        # Count the file in every folder above it
+        self.sizes[""] += record[0]
+        path = ""
+        for name in parts[:-1]:
+            path = f"{path}/{name}" if path else name
+            self.sizes[path] += record[0]
+
+    def _folder(self, parent, name):
+        path = f"{parent}/{name}" if parent else name
+        if path not in self.folders:
+            self.folders[path] = {}
+            self.sizes[path] = 0
+            self.folders[parent][name] = None
+        return path
+
+    def snapshot(self, inner, classify):
+        """Return a DirectorySnapshot of a folder in the archive, with folder sizes"""
+        children = self.folders.get(inner)
+        if children is None:
+            raise FileNotFoundError(errno.ENOENT, "No such folder in the archive", inner)
+        base = os.path.join(self.path, *inner.split('/')) if inner else self.path
+        entries = []
+        for name, record in children.items():
+            if record is None:
+                child = f"{inner}/{name}" if inner else name
+                entries.append(FileEntry(name, os.path.join(base, name), True, 0,
+                                         self.folder_times.get(child, self.modified), "Folder"))
+            else:
+                entries.append(FileEntry(name, os.path.join(base, name), False, record[0],
+                                         record[1], classify(name, False)))
+        snapshot = DirectorySnapshot(base, entries)
+        for index in snapshot.dirs:
+            child = f"{inner}/{entries[index].name}" if inner else entries[index].name
+            snapshot.set_folder_size(index, self.sizes[child])
+        return snapshot
+
+    def plan(self, inner, target):
+        """Map a member or folder to target paths: (folders, {member: (path, size, mtime)})"""
+        folder, _, name = inner.rpartition('/')
+        record = self.folders.get(folder, {}).get(name, False)
+        if record is False:
+            raise FileNotFoundError(errno.ENOENT, "No such member in the archive", inner)
+        if record is not None:
+            return [], {inner: (target, record[0], record[1])}
+        folders = []
+        members = {}
+        stack = [(inner, target)]
+        while stack:
+            folder, folder_target = stack.pop()
+            folders.append(folder_target)
+            for name, record in self.folders[folder].items():
+                if record is None:
+                    stack.append((f"{folder}/{name}", os.path.join(folder_target, name)))
+                else:
+                    members[f"{folder}/{name}"] = (os.path.join(folder_target, name),
+                                                   record[0], record[1])
+        return folders, members
+
+    def extract(self, members, progress=None, cancelled=None):
+        """Stream members to new files, yielding (member, error or None) as each one is done.
+
+        members maps inner paths to (target path, size, mtime) as returned
+        by plan(). Members that can be read in place are read from their
+        offsets; the rest are picked up in one pass through the archive.
+        """
+        progress = progress or (lambda n: None)
+        cancelled = cancelled or (lambda: False)
+        in_place = []
+        by_name = {}
+        for inner, (target, size, mtime) in members.items():
+            folder, _, name = inner.rpartition('/')
+            ref = self.folders[folder][name][2]
+            if isinstance(ref, str):
+                by_name[ref] = (inner, target, size, mtime)
+            else:
+                in_place.append((ref, inner, target, size, mtime))
+
+        # Read in archive order, so a large archive is read front to back
+        in_place.sort(key=lambda item: item[0] if self.kind == "tar" else item[0][0])
+        if in_place:
+            with open(self.path, 'rb') as f:
+                for ref, inner, target, size, mtime in in_place:
+                    if cancelled():
+                        return
+                    if self.kind == "zip":
+                        copy = lambda out: _copy_zip_member(f, ref, out, progress, cancelled)
+                    else:
+                        f.seek(ref)
+                        copy = lambda out: _copy_stream(f, out, size, progress, cancelled)
+                    yield inner, self._write(target, mtime, copy)
+        if not by_name or cancelled():
+            return
+
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.path) as archive:
+                for name, (inner, target, size, mtime) in by_name.items():
+                    if cancelled():
+                        return
+                    def copy(out):
+                        with archive.open(name) as src:
+                            _copy_stream(src, out, size, progress, cancelled)
+                    yield inner, self._write(target, mtime, copy)
+            return
+        with tarfile.open(self.path, 'r|*' if self.compressed else 'r:') as archive:
+            while by_name and not cancelled():
+                member = archive.next()
+                if member is None:
+                    break
+                archive.members = []
+                item = by_name.pop(member.name, None)
+                if item is None:
+                    continue
+                inner, target, size, mtime = item
+                src = archive.extractfile(member)
+                yield inner, self._write(target, mtime,
+                                         lambda out: _copy_stream(src, out, size, progress, cancelled))
+        for inner, target, size, mtime in by_name.values():
+            yield inner, FileNotFoundError(errno.ENOENT, "Member not found in the archive")
+
+    def _write(self, target, mtime, copy):
+        """Create target and fill it with copy(out), returning the error if it failed"""
+        try:
+            with open(target, 'xb') as out:
+                try:
+                    copy(out)
+                except BaseException:
+                    out.close()
+                    os.unlink(target)
+                    raise
+            os.utime(target, (mtime, mtime))
+        except (OSError, OperationCancelled, tarfile.TarError, zipfile.BadZipFile) as e:
+            return e
+        return None
+
+
+class ArchiveCache:
+    """Parsed archive indexes, reused while the archive keeps its mtime and size"""
+
+    def __init__(self, max_entries=ARCHIVE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()  # path -> ((mtime, size), ArchiveIndex)
+
+    def get(self, path, build=True):
+        """Return the index of an archive, or None if it is not cached and not build"""
+        stats = os.stat(path)
+        key = (stats.st_mtime_ns, stats.st_size)
+        with self.lock:
+            cached = self.indexes.get(path)
+            if cached is not None and cached[0] == key:
+                self.indexes.move_to_end(path)
+                return cached[1]
+        if not build:
+            return None
+        try:
+            index = ArchiveIndex(path, stats)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+            raise OSError(errno.EINVAL, f"Cannot read archive: {str(e)}", path)
+        with self.lock:
+            self.indexes[path] = (key, index)
+            self.indexes.move_to_end(path)
+            while len(self.indexes) > self.max_entries:
+                self.indexes.popitem(last=False)
+        return index
+
+
+class ExtractJob(FileJob):
+    """Copy files and folders out of archives into a folder.
+
+    Each member is streamed from the archive straight to its new file;
+    nothing else in the archive is decompressed.
+    """
+
+    operation = "extract"
+
+    def __init__(self, sources, destination, archive_cache):
+        super().__init__()
+        self.sources = sources
+        self.destination = os.path.abspath(destination)
+        self.archive_cache = archive_cache
+
+    def run(self):
+        self.changed_folders.add(self.destination)
+        # Plan all sources first so the progress has a total
+        plans = []
+        for source in self.sources:
+            location = split_archive_path(source)
+            try:
+                if location is None or not location[1]:
+                    raise FileNotFoundError(errno.ENOENT, "Not inside an archive")
+                index = self.archive_cache.get(location[0])
+                target = unique_destination(self.destination, os.path.basename(source))
+                folders, members = index.plan(location[1], target)
+            except OSError as e:
+                self.add_error(source, e)
+                continue
+            plans.append((source, index, folders, members))
+            with self.lock:
+                self.total_files += len(members)
+                self.total_bytes += sum(size for _, size, _ in members.values())
+
+        for source, index, folders, members in plans:
+            if self.cancelled():
+                return
+            try:
+                for folder in folders:
+                    os.makedirs(folder, exist_ok=True)
+            except OSError as e:
+                self.add_error(source, e)
+                continue
+            failed = False
+            for inner, error in index.extract(members, self.add_bytes, self.cancelled):
+                if isinstance(error, OperationCancelled):
+                    return
+                if error is not None:
+                    failed = True
+                    self.add_error(inner, error)
+                else:
+                    self.add_done()
+            if not failed:
+                self.add_completed(source)
+
+
+# Bytes read from the start of a file for a text or hex preview
+PREVIEW_TEXT_BYTES = 64 * 1024
+PREVIEW_HEX_BYTES = 4 * 1024
+
+# Characters of rendered previews kept in memory
+PREVIEW_CACHE_CHARS = 8 * 1024 * 1024
+
+# Entries of a folder counted and listed by its preview
+PREVIEW_FOLDER_ENTRIES = 10000
+PREVIEW_FOLDER_NAMES = 200
+
+# JPEG segments skipped while looking for the frame header
+_JPEG_MAX_SEGMENTS = 1000
+_JPEG_FRAME_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class Preview(namedtuple("Preview", "title details text")):
+    __slots__ = ()
+
+
+def image_dimensions(f):
+    """Return (format, width, height) read from the image header of a file, or None"""
+    head = f.read(32)
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', head[16:24])
+        return "PNG", width, height
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        return "GIF", width, height
+    if head.startswith(b'BM') and len(head) >= 26:
+        if struct.unpack('<I', head[14:18])[0] == 12:
+            width, height = struct.unpack('<HH', head[18:22])
+        else:
+            width, height = struct.unpack('<ii', head[18:26])
+        return "BMP", width, abs(height)
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return "WebP", width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', head[21:25])[0]
+            return "WebP", (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X':
+            return ("WebP", int.from_bytes(head[24:27], 'little') + 1,
+                    int.from_bytes(head[27:30], 'little') + 1)
+        return None
+    if head.startswith(b'\xff\xd8'):
+        # Walk the segments up to the frame header, seeking over their data
+        f.seek(2)
+        for _ in range(_JPEG_MAX_SEGMENTS):
+            marker = f.read(2)
+            while len(marker) == 2 and marker[1] == 0xFF:
+                marker = marker[1:] + f.read(1)  # fill bytes
+            if len(marker) != 2 or marker[0] != 0xFF:
+                return None
+            length = f.read(2)
+            if len(length) != 2:
+                return None
+            if marker[1] in _JPEG_FRAME_MARKERS:
+                frame = f.read(5)
+                if len(frame) != 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:5])
+                return "JPEG", width, height
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+    return None
+
+
+def decode_text(data):
+    """Decode the start of a file as text, or return None if it looks binary"""
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return data.decode('utf-16', errors='replace')
+    if b'\x00' in data:
+        return None
+    try:
+        # Incremental, so a character cut off at the end is not an error
+        return codecs.getincrementaldecoder('utf-8-sig')().decode(data)
+    except UnicodeDecodeError:
+        pass
+    text = data.decode('utf-8', errors='replace')
+    if text.count('\ufffd') > len(text) // 100:
+        return None
+    return text
+
+
+def hex_dump(data, offset=0):
+    """Format bytes as lines of offset, 16 hex bytes and their printable characters"""
+    lines = []
+    for start in range(0, len(data), 16):
+        row = data[start:start + 16]
+        hex_part = ' '.join(f"{byte:02x}" for byte in row[:8])
+        if len(row) > 8:
+            hex_part += '  ' + ' '.join(f"{byte:02x}" for byte in row[8:])
+        text = ''.join(chr(byte) if 32 <= byte < 127 else '.' for byte in row)
+        lines.append(f"{offset + start:08x}  {hex_part:<49}  |{text}|")
+    return "\n".join(lines)
+
+
+def make_preview(path, cancelled=None):
+    """Render a preview of a file or folder from a bounded read.
+
+    Text files show their first PREVIEW_TEXT_BYTES, other files a hex dump
+    of their first PREVIEW_HEX_BYTES, and images only what their header
+    says. Returns None if cancelled. Raises OSError.
+    """
+    cancelled = cancelled or (lambda: False)
+    name = os.path.basename(path.rstrip('\\/')) or path
+    stats = os.stat(path)
+    if stat.S_ISDIR(stats.st_mode):
+        count = 0
+        names = []
+        with os.scandir(path) as it:
+            for entry in it:
+                count += 1
+                if len(names) < PREVIEW_FOLDER_NAMES:
+                    names.append(entry.name)
+                if count >= PREVIEW_FOLDER_ENTRIES or cancelled():
+                    break
+        names.sort(key=natural_key)
+        more = "+" if count >= PREVIEW_FOLDER_ENTRIES else ""
+        return Preview(name, f"Folder, {count}{more} item{'s' if count != 1 else ''}", "\n".join(names))
+    if not stat.S_ISREG(stats.st_mode):
+        return Preview(name, "Special file", "")
+
+    size = format_size(stats.st_size)
+    with open(path, 'rb') as f:
+        dimensions = image_dimensions(f)
+        if dimensions is not None:
+            kind, width, height = dimensions
+            return Preview(name, f"{kind} image, {width} x {height} pixels, {size}", "")
+        f.seek(0)
+        head = f.read(PREVIEW_TEXT_BYTES)
+    if cancelled():
+        return None
+    text = decode_text(head)
+    if text is not None:
+        shown = f", first {format_size(len(head))} shown" if stats.st_size > len(head) else ""
+        return Preview(name, f"Text, {size}{shown}", text)
+    data = head[:PREVIEW_HEX_BYTES]
+    shown = f", first {len(data)} bytes shown" if stats.st_size > len(data) else ""
+    return Preview(name, f"Binary, {size}{shown}", hex_dump(data))
+
+
+class PreviewCache:
+    """Rendered previews by key, least recently used dropped beyond max_chars"""
+
+    def __init__(self, max_chars=PREVIEW_CACHE_CHARS):
+        self.max_chars = max_chars
+        self.chars = 0
+        self.previews = OrderedDict()  # key -> Preview
+
+    def get(self, key):
+        preview = self.previews.get(key)
+        if preview is not None:
+            self.previews.move_to_end(key)
+        return preview
+
+    def put(self, key, preview):
+        old = self.previews.pop(key, None)
+        if old is not None:
+            self.chars -= len(old.text)
+        self.previews[key] = preview
+        self.chars += len(preview.text)
+        while self.chars > self.max_chars and len(self.previews) > 1:
+            _, dropped = self.previews.popitem(last=False)
+            self.chars -= len(dropped.text)
+
+
+class LatestRequestWorker:
+    """Handle requests on one background thread, only ever for the newest one.
+
+    A request replaces one that has not started yet and cancels one that is
+    being handled. Subclasses implement handle(key, path, cancelled).
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = None  # (generation, key, path) waiting to be handled
+        self.generation = 0
+        worker = threading.Thread(target=self._run)
+        worker.daemon = True
+        worker.start()
+
+    def request(self, key, path):
+        with self.condition:
+            self.generation += 1
+            self.pending = (self.generation, key, path)
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.pending = None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                generation, key, path = self.pending
+                self.pending = None
+            try:
+                self.handle(key, path, lambda: generation != self.generation)
+            except Exception as e:
+                print(f"Error handling {path}: {str(e)}")
+
+    def handle(self, key, path, cancelled):
+        raise NotImplementedError
+
+
+class PreviewLoader(LatestRequestWorker):
+    """Render previews in the background, results go to result_queue as (key, Preview)"""
+
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+        super().__init__()
+
+    def handle(self, key, path, cancelled):
+        try:
+            with profiler.span("preview"):
+                preview = make_preview(path, cancelled)
+        except OSError as e:
+            preview = Preview(os.path.basename(path) or path, "Preview not available",
+                              e.strerror or str(e))
+        if preview is not None and not cancelled():
+            self.result_queue.put((key, preview))
+
+
+# Limits of the recently listed folders kept for instant Back, Forward and Up
+SNAPSHOT_CACHE_FOLDERS = 32
+SNAPSHOT_CACHE_ENTRIES = 1000000
+
+
+class SnapshotCache:
+    """Recently shown or prefetched DirectorySnapshots, least recently used first out.
+
+    Each snapshot is stored with the folder mtime it was listed at, so a
+    cached listing can be shown at once and checked against the disk after.
+    The snapshots are shared with the view, folder sizes that arrive later
+    are kept with them.
+    """
+
+    def __init__(self, max_folders=SNAPSHOT_CACHE_FOLDERS, max_entries=SNAPSHOT_CACHE_ENTRIES):
+        self.max_folders = max_folders
+        self.max_entries = max_entries
+        self.entries = 0
+        self.lock = threading.Lock()
+        self.snapshots = OrderedDict()  # path -> (snapshot, mtime_ns)
+
+    def get(self, path):
+        """Return (snapshot, mtime_ns) for a cached folder, or None"""
+        with self.lock:
+            cached = self.snapshots.get(path)
+            if cached is not None:
+                self.snapshots.move_to_end(path)
+            return cached
+
+    def put(self, path, snapshot, mtime_ns):
+        with self.lock:
+            self._discard(path)
+            self.snapshots[path] = (snapshot, mtime_ns)
+            self.entries += len(snapshot.entries)
+            while len(self.snapshots) > 1 and (len(self.snapshots) > self.max_folders
+                                               or self.entries > self.max_entries):
+                _, (dropped, _) = self.snapshots.popitem(last=False)
+                self.entries -= len(dropped.entries)
+
+    def discard(self, path):
+        with self.lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        cached = self.snapshots.pop(path, None)
+        if cached is not None:
+            self.entries -= len(cached[0].entries)
+
+
+def list_folder(path, classify):
+    """Return (DirectorySnapshot, mtime_ns) for a folder.
+
+    The mtime is read before listing, so a change during the listing makes
+    the snapshot look outdated rather than current.
+    """
+    mtime_ns = os.stat(path).st_mtime_ns
+    return DirectorySnapshot(path, scan_directory(path, classify)), mtime_ns
+
+
+class SnapshotPrefetcher(LatestRequestWorker):
+    """List folders into a SnapshotCache in the background, e.g. the one under the pointer"""
+
+    def __init__(self, cache, classify):
+        self.cache = cache
+        self.classify = classify
+        super().__init__()
+
+    def handle(self, key, path, cancelled):
+        cached = self.cache.get(path)
+        try:
+            if cached is not None and cached[1] == os.stat(path).st_mtime_ns:
+                return
+            with profiler.span("prefetch"):
+                snapshot, mtime_ns = list_folder(path, self.classify)
+        except OSError:
+            return
+        profiler.count("prefetch.folders")
+        self.cache.put(path, snapshot, mtime_ns)
+
+
+# Bytes hashed at the start and at the end of files whose size collides
+DUPLICATE_PARTIAL_BYTES = 16 * 1024
+
+# Files at least this large are memory-mapped for the full hash
+DUPLICATE_MMAP_BYTES = 1024 * 1024
+
+# Limits on the files and bytes handed to a hashing process at a time
+DUPLICATE_CHUNK_FILES = 256
+DUPLICATE_CHUNK_BYTES = 256 * 1024 * 1024
+
+# Seconds between progress reports of a duplicate search
+DUPLICATE_PROGRESS_INTERVAL = 0.2
+
+
+class DuplicateGroup(namedtuple("DuplicateGroup", "size paths")):
+    __slots__ = ()
+
+    @property
+    def reclaimable(self):
+        """Bytes freed by keeping a single copy"""
+        return self.size * (len(self.paths) - 1)
+
+
+def partial_digests(items):
+    """Hash the head and tail of (path, size) items; runs in a worker process.
+
+    Files up to twice DUPLICATE_PARTIAL_BYTES are hashed completely.
+    """
+    results = []
+    for path, size in items:
+        try:
+            with open(path, 'rb') as f:
+                digest = hashlib.blake2b(f.read(DUPLICATE_PARTIAL_BYTES), digest_size=16)
+                if size > 2 * DUPLICATE_PARTIAL_BYTES:
+                    f.seek(-DUPLICATE_PARTIAL_BYTES, os.SEEK_END)
+                digest.update(f.read(DUPLICATE_PARTIAL_BYTES))
+        except OSError:
+            continue
+        results.append((path, size, digest.digest()))
+    return results
+
+
+def full_digests(items):
+    """Hash whole files of (path, size, key) items; runs in a worker process.
+
+    Unreadable files get a digest of None so the caller can still tell
+    when every member of a group is done.
+    """
+    results = []
+    for path, size, key in items:
+        digest = hashlib.blake2b()
+        try:
+            with open(path, 'rb') as f:
+                if size >= DUPLICATE_MMAP_BYTES:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        digest.update(data)
+                else:
+                    digest.update(f.read())
+            value = digest.digest()
+        except (OSError, ValueError):
+            value = None
+        results.append((path, size, key, value))
+    return results
+
+
+def _digest_chunks(items, weight):
+    """Split items into chunks bounded by file count and total weight"""
+    chunk = []
+    total = 0
+    for item in items:
+        chunk.append(item)
+        total += weight(item)
+        if len(chunk) >= DUPLICATE_CHUNK_FILES or total >= DUPLICATE_CHUNK_BYTES:
+            yield chunk
+            chunk = []
+            total = 0
+    if chunk:
+        yield chunk
+
+
+def size_buckets(root, min_size=1, cancelled=None, progress=None, one_device=False):
+    """Return {size: [paths]} for regular files below root, without opening any.
+
+    Symbolic links are not followed and further hard links to a file
+    already seen are dropped, as deleting them would free nothing. With
+    one_device, folders on another device than root are skipped.
+    """
+    device = None
+    if one_device:
+        try:
+            device = os.stat(root).st_dev
+        except OSError:
+            device = None
+    buckets = {}
+    seen_inodes = set()
+    scanned = 0
+    next_report = time.monotonic() + DUPLICATE_PROGRESS_INTERVAL
+    stack = [root]
+    while stack:
+        if cancelled is not None and cancelled():
+            break
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (device is None
+                                    or entry.stat(follow_symlinks=False).st_dev == device):
+                                stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        stats = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if stats.st_size < min_size:
+                        continue
+                    if stats.st_nlink > 1:
+                        inode = (stats.st_dev, stats.st_ino)
+                        if inode in seen_inodes:
+                            continue
+                        seen_inodes.add(inode)
+                    buckets.setdefault(stats.st_size, []).append(entry.path)
+                    scanned += 1
+        except OSError:
+            continue
+        if progress is not None and time.monotonic() >= next_report:
+            progress("scan", scanned, 0)
+            next_report = time.monotonic() + DUPLICATE_PROGRESS_INTERVAL
+    return buckets
+
+
+def find_duplicates(root, cancelled=None, progress=None, workers=None, min_size=1,
+                    one_device=False):
+    """Yield a DuplicateGroup for every set of identical files below root.
+
+    Files are bucketed by size first, so a file with a unique size is never
+    opened. Colliding files get a cheap hash of their head and tail, and
+    only files still colliding after that are hashed completely, on a
+    process pool. progress(stage, done, total) is called now and then
+    with stage "scan" (files), "partial" (files) or "full" (bytes). With
+    one_device, folders on another device than root, such as /proc or
+    network mounts, are skipped.
+    """
+    cancelled = cancelled or (lambda: False)
+    report = progress or (lambda stage, done, total: None)
+
+    with profiler.span("duplicates.scan"):
+        buckets = size_buckets(root, min_size, cancelled, report, one_device)
+    candidates = [(path, size) for size, paths in buckets.items() if len(paths) > 1
+                  for path in paths]
+    profiler.count("duplicates.candidates", len(candidates))
+    del buckets
+
+    # Partial hashes, files small enough to be covered completely are final
+    groups = {}
+    done_files = 0
+    next_report = 0
+    with profiler.span("duplicates.partial"):
+        chunks = _digest_chunks(candidates, lambda item: 2 * DUPLICATE_PARTIAL_BYTES)
+        for results in iter_pool_results(partial_digests, chunks, cancelled, workers):
+            for path, size, digest in results:
+                groups.setdefault((size, digest), []).append(path)
+            done_files += len(results)
+            if time.monotonic() >= next_report:
+                report("partial", done_files, len(candidates))
+                next_report = time.monotonic() + DUPLICATE_PROGRESS_INTERVAL
+    if cancelled():
+        return
+
+    remaining = {}
+    full_items = []
+    for key, paths in groups.items():
+        if len(paths) < 2:
+            continue
+        size = key[0]
+        if size <= 2 * DUPLICATE_PARTIAL_BYTES:
+            yield DuplicateGroup(size, sorted(paths))
+            continue
+        remaining[key] = len(paths)
+        full_items.extend((path, size, key) for path in paths)
+    del groups
+
+    # Full hashes, largest files first so the biggest savings show up early
+    full_items.sort(key=lambda item: item[1], reverse=True)
+    total_bytes = sum(item[1] for item in full_items)
+    done_bytes = 0
+    matches = {}
+    with profiler.span("duplicates.full"):
+        chunks = _digest_chunks(full_items, lambda item: item[1])
+        for results in iter_pool_results(full_digests, chunks, cancelled, workers):
+            for path, size, key, digest in results:
+                done_bytes += size
+                if digest is not None:
+                    matches.setdefault(key, {}).setdefault(digest, []).append(path)
+                remaining[key] -= 1
+                if remaining[key]:
+                    continue
+                del remaining[key]
+                for paths in matches.pop(key, {}).values():
+                    if len(paths) > 1:
+                        yield DuplicateGroup(size, sorted(paths))
+            if time.monotonic() >= next_report:
+                report("full", done_bytes, total_bytes)
+                next_report = time.monotonic() + DUPLICATE_PROGRESS_INTERVAL
+
+
+# Number of largest files and folders kept by a disk usage scan
+DEFAULT_TOP_K = 100
+
+# Folder levels below the root listed by tasks of their own; deeper
+# subtrees are walked by the task that found them
+USAGE_SPLIT_DEPTH = 3
+
+
+class UsageReport(namedtuple("UsageReport",
+                             "total files folders largest_files largest_folders categories finished")):
+    __slots__ = ()
+
+
+class _UsageTally:
+    """Bounded heaps and totals of one disk usage thread"""
+
+    def __init__(self):
+        self.files = []    # min-heap of (size, path) of the largest files
+        self.folders = []  # min-heap of (size, path) of the largest folders
+        self.categories = dict.fromkeys(TYPE_FILTERS[1:], 0)
+        self.file_count = 0
+        self.folder_count = 0
+
+    def add_file(self, size, path, category, k):
+        self.file_count += 1
+        self.categories[category] = self.categories.get(category, 0) + size
+        _push_largest(self.files, (size, path), k)
+
+    def add_folder(self, size, path, k):
+        self.folder_count += 1
+        _push_largest(self.folders, (size, path), k)
+
+
+def _push_largest(heap, item, k):
+    """Keep the k largest items seen in a min-heap"""
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+class DiskUsageScan:
+    """Find the largest files and folders below root in one parallel walk.
+
+    The top USAGE_SPLIT_DEPTH folder levels are listed by separate tasks on
+    a thread pool, and deeper subtrees are walked by the task that found
+    them. Every thread keeps its own heaps of the k largest files and
+    folders plus bytes per category, so memory grows with k and the folder
+    depth rather than with the number of files, and report() can merge the
+    tallies while the walk is still running. With one_device, folders on
+    another device than root, such as /proc or network mounts, are skipped.
+    """
+
+    def __init__(self, root, classify, k=DEFAULT_TOP_K, workers=DEFAULT_SIZE_WORKERS,
+                 one_device=False):
+        self.root = root
+        self.classify = classify
+        self.k = k
+        self.workers = max(1, workers)
+        self.one_device = one_device
+        self.device = None
+        self.cancel_event = threading.Event()
+        self.idle = threading.Condition()
+        self.outstanding = 0  # folder tasks queued or running
+        self.tallies = []
+        self.local = threading.local()
+        self.finished = False
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def run(self):
+        """Walk the tree, blocking until it is done or cancelled"""
+        if self.one_device:
+            try:
+                self.device = os.stat(self.root).st_dev
+            except OSError:
+                self.device = None
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with profiler.span("disk_usage"):
+                self._submit(pool, self.root, None, 0)
+                with self.idle:
+                    while self.outstanding:
+                        self.idle.wait()
+        finally:
+            pool.shutdown(wait=True)
+            self.finished = True
+        return self.report()
+
+    def report(self):
+        """Merge the tallies of all threads into a UsageReport"""
+        with self.idle:
+            tallies = list(self.tallies)
+        files = []
+        folders = []
+        categories = dict.fromkeys(TYPE_FILTERS[1:], 0)
+        file_count = folder_count = 0
+        for tally in tallies:
+            files.extend(list(tally.files))
+            folders.extend(list(tally.folders))
+            for category, size in list(tally.categories.items()):
+                categories[category] = categories.get(category, 0) + size
+            file_count += tally.file_count
+            folder_count += tally.folder_count
+        return UsageReport(sum(categories.values()), file_count, folder_count,
+                           heapq.nlargest(self.k, files), heapq.nlargest(self.k, folders),
+                           categories, self.finished)
+
+    def _tally(self):
+        tally = getattr(self.local, "tally", None)
+        if tally is None:
+            tally = self.local.tally = _UsageTally()
+            with self.idle:
+                self.tallies.append(tally)
+        return tally
+
+    def _submit(self, pool, folder, parent, depth):
+        with self.idle:
+            self.outstanding += 1
+        pool.submit(self._run_task, pool, folder, parent, depth)
+
+    def _run_task(self, pool, folder, parent, depth):
+        try:
+            self._scan_folder(pool, folder, parent, depth)
+        except Exception as e:
+            print(f"Error scanning {folder}: {str(e)}")
+        finally:
+            with self.idle:
+                self.outstanding -= 1
+                if not self.outstanding:
+                    self.idle.notify_all()
+
+    def _scan_folder(self, pool, folder, parent, depth):
+        """List one folder, queueing its subfolders or walking them in place"""
+        tally = self._tally()
+        # [path, parent node, parts left, bytes]; the listing itself is one part
+        node = [folder, parent, 1, 0]
+        subfolders = []
+        size = self._list(folder, tally, subfolders)
+        if depth < USAGE_SPLIT_DEPTH:
+            with self.idle:
+                node[2] += len(subfolders)
+            for subfolder in subfolders:
+                self._submit(pool, subfolder, node, depth + 1)
+        else:
+            for subfolder in subfolders:
+                if self.cancelled():
+                    break
+                size += self._walk(subfolder, tally)
+        with self.idle:
+            node[3] += size
+        self._finish_part(node, tally)
+
+    def _finish_part(self, node, tally):
+        """Count one finished part of a folder, recording folders whose parts are all done"""
+        while node is not None:
+            with self.idle:
+                node[2] -= 1
+                if node[2] > 0:
+                    return
+                path, parent, size = node[0], node[1], node[3]
+                if parent is not None:
+                    parent[3] += size
+            # The root is the report total, not one of its largest folders
+            if parent is not None:
+                tally.add_folder(size, path, self.k)
+            node = parent
+
+    def _list(self, folder, tally, subfolders):
+        """Tally the files of a folder and collect its subfolders, returning their bytes"""
+        size = 0
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (self.device is None
+                                    or entry.stat(follow_symlinks=False).st_dev == self.device):
+                                subfolders.append(entry.path)
+                            continue
+                        file_size = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+                    tally.add_file(file_size, entry.path, self.classify(entry.name), self.k)
+                    size += file_size
+        except OSError:
+            pass
+        return size
+
+    def _walk(self, folder, tally):
+        """Return the bytes below folder, tallying it and every folder inside"""
+        # [path, subfolders left, bytes]; only the current branch is kept
+        subfolders = []
+        stack = [[folder, subfolders, self._list(folder, tally, subfolders)]]
+        while True:
+            frame = stack[-1]
+            if frame[1] and not self.cancelled():
+                subfolders = []
+                path = frame[1].pop()
+                stack.append([path, subfolders, self._list(path, tally, subfolders)])
+                continue
+            stack.pop()
+            tally.add_folder(frame[2], frame[0], self.k)
+            if not stack:
+                return frame[2]
+            stack[-1][2] += frame[2]
+
+
+def find_entries(root, pattern, classify):
+    """Yield a FileEntry for every name below root matching pattern.
+
+    The tree is walked with os.scandir without following symbolic links,
+    and only matching entries are stat'ed and classified.
+    """
+    matches, _ = name_matcher(pattern)
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        if not matches(entry.name):
+                            continue
+                        stats = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    yield make_entry(entry.name, entry.path, stats, classify)
+        except OSError:
+            continue
+
+
+def iter_folder_sizes(folders, engine, workers=DEFAULT_SIZE_WORKERS, device=None):
+    """Yield (folder, FolderSize) pairs as a pool of size workers finishes them.
+
+    The FolderSize is None for a folder that could not be sized.
+    """
+    results = Queue()
+    scheduler = FolderSizeScheduler(
+        results, lambda folder, cancelled, progress: engine.folder_usage(
+            folder, cancelled, progress, device),
+        workers)
+    try:
+        for folder in folders:
+            scheduler.submit(folder, folder)
+        remaining = len(folders)
+        while remaining:
+            _, folder, size, done = results.get()
+            if done:
+                remaining -= 1
+                yield folder, size
+    finally:
+        scheduler.shutdown()
+
+
+# Columns written by the command line tools, content matches add the rest
+RECORD_FIELDS = ["path", "name", "is_dir", "size", "type", "modified"]
+MATCH_FIELDS = RECORD_FIELDS + ["line", "preview"]
+DU_FIELDS = RECORD_FIELDS + ["allocated"]
+DUPLICATE_FIELDS = ["group", "size", "reclaimable", "path"]
+USAGE_FIELDS = ["kind", "name", "size"]
+
+# Seconds output may stay buffered while records are being written
+OUTPUT_FLUSH_SECONDS = 0.5
+
+
+def entry_record(entry, size):
+    """Return a FileEntry as a dict for JSON Lines or CSV output"""
+    return {
+        "path": entry.path,
+        "name": entry.name,
+        "is_dir": entry.is_dir,
+        "size": size,
+        "type": entry.type,
+        "modified": datetime.fromtimestamp(entry.modified).isoformat(timespec='seconds'),
+    }
+
+
+class RecordWriter:
+    """Stream records to a file as JSON Lines or CSV"""
+
+    def __init__(self, stream, output_format="jsonl", fields=RECORD_FIELDS):
+        self.stream = stream
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(stream, fieldnames=fields, lineterminator='\n')
+            self.csv_writer.writeheader()
+        self.next_flush = time.monotonic() + OUTPUT_FLUSH_SECONDS
+
+    def write(self, record):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(record)
+        else:
+            self.stream.write(json.dumps(record) + "\n")
+        if time.monotonic() >= self.next_flush:
+            self.flush()
+
+    def flush(self):
+        self.stream.flush()
+        self.next_flush = time.monotonic() + OUTPUT_FLUSH_SECONDS
+
+
+def open_size_engine(args):
+    """Return a FolderSizeEngine, sharing the GUI size index unless --no-cache"""
+    return FolderSizeEngine(FolderSizeIndex(':memory:' if args.no_cache else None),
+                            one_device=args.one_file_system)
+
+
+def size_device(args):
+    """Return the device folder sizes stay on with --one-file-system, or None"""
+    return os.stat(args.path).st_dev if args.one_file_system else None
+
+
+def command_ls(args, classifier, entry_filter):
+    """List one folder like the main view, optionally with folder sizes"""
+    location = None if os.path.isdir(args.path) else split_archive_path(args.path)
+    if location is not None:
+        # Folders inside archives come with their sizes
+        snapshot = ArchiveCache().get(location[0]).snapshot(location[1], classifier.classify)
+    else:
+        snapshot = DirectorySnapshot(args.path, scan_directory(args.path, classifier.classify))
+    if args.sizes and location is None:
+        dirs = {snapshot.entries[i].path: i for i in snapshot.dirs}
+        engine = open_size_engine(args)
+        for folder, usage in iter_folder_sizes(list(dirs), engine, args.workers,
+                                               size_device(args)):
+            if usage is not None:
+                snapshot.set_folder_size(dirs[folder], usage.apparent)
+
+    writer = RecordWriter(sys.stdout, args.format)
+    for index in snapshot.order(args.sort, args.reverse):
+        entry = snapshot.entries[index]
+        if not entry_filter(entry):
+            continue
+        size = snapshot.folder_sizes.get(index) if entry.is_dir else entry.size
+        writer.write(entry_record(entry, size))
+    writer.flush()
+
+
+def command_du(args, classifier, entry_filter):
+    """Print the size of every item in a folder as soon as it is known, then the total"""
+    entries = scan_directory(args.path, classifier.classify)
+    writer = RecordWriter(sys.stdout, args.format, DU_FIELDS)
+    folders = {}
+    for entry in entries:
+        if entry.is_dir:
+            folders[entry.path] = entry
+            continue
+        if entry_filter(entry):
+            record = entry_record(entry, entry.size)
+            try:
+                record["allocated"] = allocated_size(os.lstat(entry.path))
+            except OSError:
+                record["allocated"] = None
+            writer.write(record)
+    writer.flush()
+
+    engine = open_size_engine(args)
+    device = size_device(args)
+    for folder, usage in iter_folder_sizes(list(folders), engine, args.workers, device):
+        record = entry_record(folders[folder], None if usage is None else usage.apparent)
+        record["allocated"] = None if usage is None else usage.allocated
+        writer.write(record)
+        writer.flush()
+
+    # Walk the root as well, mostly from the index, so files hard linked
+    # from several subfolders count once in the total
+    usage = engine.folder_usage(args.path, device=device)
+    root = make_entry(os.path.basename(os.path.normpath(args.path)) or args.path,
+                      args.path, os.stat(args.path), classifier.classify)
+    record = entry_record(root, usage.apparent)
+    record["allocated"] = usage.allocated
+    writer.write(record)
+    writer.flush()
+
+
+def command_find(args, classifier, entry_filter):
+    """Search a folder tree by name, or by contents with --contents"""
+    if not args.contents:
+        writer = RecordWriter(sys.stdout, args.format)
+        for entry in find_entries(args.path, args.pattern, classifier.classify):
+            if entry_filter(entry):
+                writer.write(entry_record(entry, entry.size))
+        writer.flush()
+        return
+
+    writer = RecordWriter(sys.stdout, args.format, MATCH_FIELDS)
+    for results in iter_content_matches(args.path, args.pattern, classifier.classify,
+                                        entry_filter.type_filter, workers=args.workers):
+        for path, size, mtime, matches in results:
+            entry = FileEntry(os.path.basename(path), path, False, size, mtime,
+                              classifier.classify(path, False))
+            if not entry_filter(entry):
+                continue
+            for line_number, preview in matches:
+                record = entry_record(entry, size)
+                record["line"] = line_number
+                record["preview"] = preview
+                writer.write(record)
+        writer.flush()
+
+
+def command_dups(args, classifier, entry_filter):
+    """Print every set of identical files below a folder, one record per file"""
+    writer = RecordWriter(sys.stdout, args.format, DUPLICATE_FIELDS)
+    groups = find_duplicates(args.path, workers=args.workers, min_size=args.min_size,
+                             one_device=args.one_file_system)
+    for number, group in enumerate(groups, 1):
+        for path in group.paths:
+            writer.write({"group": number, "size": group.size,
+                          "reclaimable": group.reclaimable, "path": path})
+        writer.flush()
+
+
+def command_top(args, classifier, entry_filter):
+    """Print the largest files and folders below a folder and bytes per category"""
+    scan = DiskUsageScan(args.path, classifier.classify, args.count, args.workers,
+                         args.one_file_system)
+    report = scan.run()
+    writer = RecordWriter(sys.stdout, args.format, USAGE_FIELDS)
+    for category, size in sorted(report.categories.items(), key=lambda item: -item[1]):
+        writer.write({"kind": "category", "name": category, "size": size})
+    for kind, items in (("folder", report.largest_folders), ("file", report.largest_files)):
+        for size, path in items:
+            writer.write({"kind": kind, "name": path, "size": size})
+    writer.write({"kind": "total", "name": args.path, "size": report.total})
+    writer.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="file_manager_core",
+        description="List, size and search folders without the GUI. "
+                    "Results are streamed as JSON Lines or CSV.")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace of the run to FILE")
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=["jsonl", "csv"], default="jsonl",
+                        help="output format (default: jsonl)")
+    common = argparse.ArgumentParser(add_help=False, parents=[output])
+    common.add_argument("--type", choices=TYPE_FILTERS, default="All",
+                        help="only show files of this category")
+    common.add_argument("--size", choices=list(SIZE_RANGES), default="Any",
+                        help="only show files in this size range")
+    common.add_argument("--date", choices=DATE_FILTERS, default="Any time",
+                        help="only show files modified in this period")
+    sizing = argparse.ArgumentParser(add_help=False)
+    sizing.add_argument("--workers", type=int, default=DEFAULT_SIZE_WORKERS,
+                        help=f"folder size worker threads (default: {DEFAULT_SIZE_WORKERS})")
+    sizing.add_argument("--no-cache", action="store_true",
+                        help="do not read or update the on-disk size index")
+    sizing.add_argument("-x", "--one-file-system", action="store_true",
+                        help="do not size folders on other filesystems, such as mounts")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    ls_parser = commands.add_parser("ls", parents=[common, sizing],
+                                    help="list a folder, or a folder inside a zip or tar archive")
+    ls_parser.add_argument("path")
+    ls_parser.add_argument("--sort", choices=["name", "size", "type", "modified"], default="name")
+    ls_parser.add_argument("--reverse", action="store_true", help="reverse the sort order")
+    ls_parser.add_argument("--sizes", action="store_true", help="calculate folder sizes")
+    ls_parser.set_defaults(run=command_ls)
+
+    du_parser = commands.add_parser("du", parents=[common, sizing],
+                                    help="show the size of everything in a folder")
+    du_parser.add_argument("path")
+    du_parser.set_defaults(run=command_du)
+
+    find_parser = commands.add_parser("find", parents=[common], help="search a folder tree")
+    find_parser.add_argument("path")
+    find_parser.add_argument("pattern", help="glob (*, ?, [) or case-insensitive substring")
+    find_parser.add_argument("--contents", action="store_true",
+                             help="search file contents for pattern as literal text")
+    find_parser.add_argument("--workers", type=int, default=None,
+                             help="content search processes (default: one per CPU)")
+    find_parser.set_defaults(run=command_find)
+
+    dups_parser = commands.add_parser("dups", parents=[output],
+                                      help="find sets of identical files in a folder tree")
+    dups_parser.add_argument("path")
+    dups_parser.add_argument("--min-size", type=int, default=1,
+                             help="ignore files smaller than this many bytes (default: 1)")
+    dups_parser.add_argument("--workers", type=int, default=None,
+                             help="hashing processes (default: one per CPU)")
+    dups_parser.add_argument("-x", "--one-file-system", action="store_true",
+                             help="do not search folders on other filesystems, such as mounts")
+    dups_parser.set_defaults(run=command_dups, type="All", size="Any", date="Any time")
+
+    top_parser = commands.add_parser("top", parents=[output],
+                                     help="show the largest files and folders in a folder tree")
+    top_parser.add_argument("path")
+    top_parser.add_argument("--count", type=int, default=DEFAULT_TOP_K,
+                            help=f"files and folders to show (default: {DEFAULT_TOP_K})")
+    top_parser.add_argument("--workers", type=int, default=DEFAULT_SIZE_WORKERS,
+                            help=f"scanning threads (default: {DEFAULT_SIZE_WORKERS})")
+    top_parser.add_argument("-x", "--one-file-system", action="store_true",
+                            help="do not scan folders on other filesystems, such as mounts")
+    top_parser.set_defaults(run=command_top, type="All", size="Any", date="Any time")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.path = os.path.abspath(args.path)
+    classifier = CategoryClassifier()
+    entry_filter = EntryFilter(args.type, args.size, args.date)
+    if args.trace:
+        profiler.start_trace(args.trace)
+    try:
+        args.run(args, classifier, entry_filter)
+    except BrokenPipeError:
+        # Output closed early, e.g. piped into head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    except OSError as e:
+        print(f"Error reading {args.path}: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if args.trace:
+            profiler.stop_trace()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+import os
+import shutil
+import tempfile
+import unittest
+from queue import Queue
+from types import SimpleNamespace
+from unittest import mock
+
+import file_manager_core
+from file_manager_core import (
+    CategoryClassifier, CopyJob, DeleteJob, DirectorySnapshot, FileEntry, FilenameIndex,
+    FolderSizeEngine, FolderSizeIndex, FolderSizeScheduler, LinuxVolumeBackend,
+    iter_content_matches, name_matcher)
+
+
+class NameMatcherTest(unittest.TestCase):
+    def test_bracket_class_is_not_a_literal(self):
+        matches, literal = name_matcher("[abcdef]*.py")
+        self.assertEqual(literal, ".py")
+        self.assertTrue(matches("a.py"))
+        self.assertFalse(matches("zz.py"))
+
+    def test_unclosed_bracket_is_literal(self):
+        matches, literal = name_matcher("a[bc")
+        self.assertEqual(literal, "a[bc")
+        self.assertTrue(matches("a[bc"))
+
+
+class FilenameIndexSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ("a.py", "b.py", "zz.py"):
+            open(os.path.join(self.folder, name), "w").close()
+        self.index = FilenameIndex(os.path.join(self.folder, "index.db"))
+        self.index.refresh([self.folder])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def search(self, pattern):
+        classify = CategoryClassifier().classify
+        return sorted(os.path.basename(entry.path)
+                      for batch in self.index.search(pattern, classify)
+                      for entry in batch)
+
+    def test_bracket_class_glob(self):
+        self.assertEqual(self.search("[abcdef]*.py"), ["a.py", "b.py"])
+        self.assertEqual(self.search("[ab]*.py"), ["a.py", "b.py"])
+        self.assertEqual(self.search("*.py"), ["a.py", "b.py", "zz.py"])
+
+
+class DirectorySnapshotTest(unittest.TestCase):
+    def test_appended_entries_sort_once_needed(self):
+        snapshot = DirectorySnapshot(None, [])
+        for name, is_dir in (("b", False), ("c", True), ("a", False), ("a", True)):
+            snapshot.append_entry(FileEntry(name, "/" + name, is_dir, 0, 0, "Others"))
+        self.assertEqual(snapshot.order("name"), [3, 1, 2, 0])
+        snapshot.update_entry(FileEntry("aa", "/aa", False, 0, 0, "Others"))
+        self.assertEqual(snapshot.order("name"), [3, 1, 2, 4, 0])
+
+
+class ContentSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "sub", "deeper"))
+        for name, text in (("top.txt", "hello\n"), ("sub/a.txt", "no\nhello there\n"),
+                           ("sub/deeper/b.txt", "nothing here\n")):
+            with open(os.path.join(self.folder, name), "w") as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_searches_subfolders(self):
+        classify = CategoryClassifier().classify
+        found = sorted((os.path.relpath(path, self.folder), matches)
+                       for results in iter_content_matches(self.folder, "hello", classify,
+                                                           workers=1)
+                       for path, size, mtime, matches in results)
+        self.assertEqual(found, [(os.path.join("sub", "a.txt"), [(2, "hello there")]),
+                                 ("top.txt", [(1, "hello")])])
+
+
+class FolderSizeEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "a", "x"))
+        os.makedirs(os.path.join(self.folder, "b"))
+        with open(os.path.join(self.folder, "a", "data"), "wb") as f:
+            f.write(b"x" * 10000)
+        os.link(os.path.join(self.folder, "a", "data"), os.path.join(self.folder, "b", "data"))
+        os.link(os.path.join(self.folder, "a", "data"), os.path.join(self.folder, "a", "x", "data"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def folder_bytes(self, *folders):
+        return sum(os.stat(os.path.join(self.folder, *folder)).st_size for folder in folders)
+
+    @unittest.skipIf(os.name == "nt", "hard link counts need a full stat on Windows")
+    def test_hard_links_count_once_with_folder_sizes(self):
+        engine = FolderSizeEngine(FolderSizeIndex(":memory:"))
+        usage = engine.folder_usage(self.folder)
+        self.assertEqual(usage.apparent, 10000 + self.folder_bytes(
+            (), ("a",), ("a", "x"), ("b",)))
+        self.assertEqual(engine.folder_size(os.path.join(self.folder, "b")),
+                         10000 + self.folder_bytes(("b",)))
+        self.assertGreaterEqual(usage.allocated, 10000)
+
+
+class FolderSizeSchedulerTest(unittest.TestCase):
+    def test_failing_job_posts_none_and_keeps_worker(self):
+        def size_func(folder, cancelled, progress):
+            if folder == "bad":
+                raise OSError("database is locked")
+            return 42
+
+        results = Queue()
+        scheduler = FolderSizeScheduler(results, size_func, max_workers=1)
+        try:
+            scheduler.submit("bad", "1")
+            scheduler.submit("good", "2")
+            answers = sorted(results.get(timeout=5)[1:] for _ in range(2))
+        finally:
+            scheduler.shutdown()
+        self.assertEqual(answers, [("1", None, True), ("2", 42, True)])
+
+
+class LinuxVolumeClassifyTest(unittest.TestCase):
+    def classify(self, mount_point):
+        backend = LinuxVolumeBackend.__new__(LinuxVolumeBackend)
+        return backend._classify(mount_point, "ext4", "/dev/sdb1", "0:0")
+
+    def test_prefixes_match_whole_folders(self):
+        for mount_point in ("/system", "/devel", "/snapshots", "/running"):
+            self.assertEqual(self.classify(mount_point), "Local Disk")
+        self.assertIsNone(self.classify("/run/user/1000"))
+        self.assertIsNone(self.classify("/sys"))
+
+    def test_removable_prefixes(self):
+        self.assertEqual(self.classify("/media/usb"), "Removable Drive")
+        self.assertEqual(self.classify("/run/media/user/usb"), "Removable Drive")
+        self.assertEqual(self.classify("/mediastore"), "Local Disk")
+
+
+class FileJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "source")
+        self.destination = os.path.join(self.folder, "destination")
+        os.makedirs(os.path.join(self.source, "tree", "sub"))
+        os.makedirs(self.destination)
+        self.write(os.path.join("source", "tree", "a.txt"), "a")
+        self.write(os.path.join("source", "tree", "sub", "b.txt"), "b")
+        self.write(os.path.join("source", "c.txt"), "c")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, *parts):
+        return os.path.join(self.folder, *parts)
+
+    def write(self, name, text):
+        with open(self.path(name), "w") as f:
+            f.write(text)
+
+    def read(self, *parts):
+        with open(self.path(*parts)) as f:
+            return f.read()
+
+    def listing(self, *parts):
+        """Return the relative paths of everything below a folder"""
+        root = self.path(*parts)
+        found = []
+        for folder, dirs, files in os.walk(root):
+            found.extend(os.path.relpath(os.path.join(folder, name), root) for name in dirs + files)
+        return sorted(found)
+
+    def cancel_after_first(self, job):
+        """Cancel a job as soon as it finished its first item"""
+        add_done = job.add_done
+
+        def cancel(files=1):
+            add_done(files)
+            job.cancel()
+        job.add_done = cancel
+
+    def other_device(self):
+        """Make the destination look like another device, so moves copy and delete"""
+        real_stat = os.stat
+
+        def fake_stat(path, *args, **kwargs):
+            if path == self.destination:
+                return SimpleNamespace(st_dev=-1)
+            return real_stat(path, *args, **kwargs)
+        return mock.patch.object(file_manager_core.os, "stat", fake_stat)
+
+
+class CopyJobTest(FileJobTestCase):
+    def test_copy_keeps_source(self):
+        job = CopyJob("copy", [self.path("source", "tree")], self.destination)
+        job.run()
+        self.assertEqual(job.errors, [])
+        self.assertEqual(self.listing("destination"),
+                         ["tree", os.path.join("tree", "a.txt"), os.path.join("tree", "sub"),
+                          os.path.join("tree", "sub", "b.txt")])
+        self.assertEqual(self.read("destination", "tree", "sub", "b.txt"), "b")
+        self.assertEqual(self.listing("source", "tree"), self.listing("destination", "tree"))
+
+    def test_collisions_never_overwrite(self):
+        self.write(os.path.join("destination", "c.txt"), "old")
+        for operation in ("copy", "move"):
+            CopyJob(operation, [self.path("source", "c.txt")], self.destination).run()
+        self.assertEqual(self.read("destination", "c.txt"), "old")
+        self.assertEqual(self.read("destination", "c (2).txt"), "c")
+        self.assertEqual(self.read("destination", "c (3).txt"), "c")
+        self.assertFalse(os.path.exists(self.path("source", "c.txt")))
+
+    def test_move_renames_on_one_device(self):
+        job = CopyJob("move", [self.path("source", "tree"), self.path("source", "c.txt")],
+                      self.destination)
+        job.run()
+        self.assertEqual(job.errors, [])
+        self.assertEqual(self.listing("source"), [])
+        self.assertEqual(self.read("destination", "tree", "a.txt"), "a")
+        self.assertEqual(self.read("destination", "c.txt"), "c")
+
+    def test_move_to_other_device_deletes_copied_source(self):
+        job = CopyJob("move", [self.path("source", "tree")], self.destination)
+        with self.other_device():
+            job.run()
+        self.assertEqual(job.errors, [])
+        self.assertEqual(self.listing("source"), ["c.txt"])
+        self.assertEqual(self.read("destination", "tree", "sub", "b.txt"), "b")
+
+    @unittest.skipUnless(hasattr(os, "mkfifo"), "needs named pipes")
+    def test_failed_move_keeps_source(self):
+        os.mkfifo(self.path("source", "tree", "pipe"))
+        before = self.listing("source")
+        job = CopyJob("move", [self.path("source", "tree")], self.destination)
+        with self.other_device():
+            job.run()
+        self.assertEqual(len(job.errors), 1)
+        self.assertEqual(self.listing("source"), before)
+
+    def test_cancelled_move_keeps_source(self):
+        before = self.listing("source")
+        job = CopyJob("move", [self.path("source", "tree")], self.destination, workers=1)
+        self.cancel_after_first(job)
+        with self.other_device():
+            job.run()
+        self.assertTrue(job.cancelled())
+        self.assertEqual(self.listing("source"), before)
+        self.assertEqual(self.read("source", "tree", "a.txt"), "a")
+
+
+class DeleteJobTest(FileJobTestCase):
+    def test_deletes_exactly_the_selected_tree(self):
+        os.makedirs(self.path("source", "tree", "sub", "deeper", "deepest"))
+        self.write(os.path.join("source", "tree", "sub", "deeper", "d.txt"), "d")
+        self.write(os.path.join("destination", "keep.txt"), "keep")
+        if hasattr(os, "symlink"):
+            # Links are removed, never followed
+            os.symlink(self.destination, self.path("source", "tree", "link"))
+        job = DeleteJob([self.path("source", "tree")], workers=4)
+        job.run()
+        self.assertEqual(job.errors, [])
+        self.assertEqual(job.completed, [self.path("source", "tree")])
+        self.assertEqual(self.listing("source"), ["c.txt"])
+        self.assertEqual(self.listing("destination"), ["keep.txt"])
+
+    def test_deletes_files_and_folders(self):
+        job = DeleteJob([self.path("source", "c.txt"), self.path("source", "tree", "sub")])
+        job.run()
+        self.assertEqual(job.errors, [])
+        self.assertEqual(sorted(job.completed),
+                         sorted([self.path("source", "c.txt"), self.path("source", "tree", "sub")]))
+        self.assertEqual(self.listing("source"), ["tree", os.path.join("tree", "a.txt")])
+
+    def test_cancelled_delete_keeps_the_folder(self):
+        job = DeleteJob([self.path("source", "tree")], workers=1)
+        self.cancel_after_first(job)
+        job.run()
+        self.assertEqual(job.completed, [])
+        self.assertTrue(os.path.isdir(self.path("source", "tree")))
+        self.assertTrue(os.path.exists(self.path("source", "c.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()